@@ -28,3 +28,8 @@ def get_tenant_model():
             "TENANCY_TENANT_MODEL refers to models '%s.%s' which is not a "
             "subclass of 'tenancy.AbstractTenant'" % (app_label, object_name))
     return tenant_model
+
+
+def map_tenants(function, tenants, workers=1, mode='thread', progress=None):
+    from .parallel import map_tenants
+    return map_tenants(function, tenants, workers, mode, progress)
@@ -0,0 +1,251 @@
+"""
+PostgreSQL backend pooling its connections in the process and keeping track
+of the tenant schema the search path of each of them points to.
+
+Connections are handed back to the pool of their alias when they are closed
+instead of being terminated and are reused in priority by requests of the
+tenant they were pinned to, avoiding a round trip to alter their search path.
+Pinning only benefits ORM queries when `TENANCY_UNQUALIFIED_TABLES` is enabled
+since they otherwise use schema qualified table names and don't depend on the
+search path, only tenant operations and `set_tenant_schema` do. Pinned
+connections are checked with `SELECT 1` and other ones are reset with
+`RESET ALL` before being reused.
+
+The number of idle connections kept around is specified by the `POOL_SIZE` key
+of the database settings which defaults to 10. Use `get_metrics()` on the
+`pool` attribute of a connection to retrieve its pool counters.
+
+When `TENANCY_UNQUALIFIED_TABLES` is enabled tenant models use unqualified
+table names and the search path is pointed to the schema of the tenant of the
+queried model before executing ORM queries. Queries are then the same for all
+tenants which allows the statements executed at least `PREPARE_THRESHOLD`
+times on a connection, a key of the database settings which defaults to
+`None`, to be prepared and reused by all tenants.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import re
+from collections import Counter
+
+from django.db import DatabaseError
+from django.utils.encoding import force_bytes
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from ...pool import get_pool
+
+try:
+    from django.db.backends.postgresql import base, operations
+except ImportError:  # Django < 1.9
+    from django.db.backends.postgresql_psycopg2 import base, operations
+
+# Number of distinct statements which executions are counted.
+MAX_COUNTED_STATEMENTS = 10000
+
+placeholder_re = re.compile(r'%[s%]')
+
+
+def reset_connection(connection):
+    connection.rollback()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute('RESET ALL')
+
+
+def check_connection(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+def to_positional_placeholders(sql):
+    """
+    Convert the `%s` placeholders of `sql` to the `$n` ones used by prepared
+    statements and return it along with the number of placeholders.
+    """
+    count = [0]
+
+    def replace(match):
+        if match.group() == '%%':
+            return '%'
+        count[0] += 1
+        return "$%d" % count[0]
+    return placeholder_re.sub(replace, sql), count[0]
+
+
+class DatabaseOperations(operations.DatabaseOperations):
+    compiler_module = 'tenancy.backends.postgresql.compiler'
+
+
+class PreparingCursor(object):
+    """
+    Cursor wrapper executing the statements prepared by its connection
+    through `EXECUTE`.
+    """
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=None):
+        if params is None or isinstance(params, dict):
+            return self.cursor.execute(sql, params)
+        name = self.connection.get_prepared_statement(self.cursor, sql, len(params))
+        if name is None:
+            return self.cursor.execute(sql, params)
+        if params:
+            return self.cursor.execute("EXECUTE %s (%s)" % (name, ', '.join(['%s'] * len(params))), params)
+        return self.cursor.execute("EXECUTE %s" % name)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    ops_class = DatabaseOperations
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        # Django < 1.11 doesn't rely on the `*_class` attributes.
+        self.ops = DatabaseOperations(self)
+        # Schema the search path of the connection is known to point to.
+        self.tenant_schema = None
+        self.statement_executions = Counter()
+        # Mapping of statements to the name they were prepared as.
+        self.prepared_statements = {}
+        # Names of the statements prepared on the connection, `None` until
+        # they are retrieved since pooled connections might have some.
+        self.prepared_names = None
+        # Statements that failed to be prepared, usually because PostgreSQL
+        # can't infer the type of some of their parameters.
+        self.unpreparable_statements = set()
+
+    @property
+    def pool(self):
+        return get_pool(
+            self.alias, size=self.settings_dict.get('POOL_SIZE', 10), reset=reset_connection,
+            check=check_connection,
+        )
+
+    def get_active_schema(self):
+        """
+        Return the schema of the tenant exposed through `as_global` on this
+        connection if any.
+        """
+        from ... import get_tenant_model
+        tenant = getattr(self, get_tenant_model().ATTR_NAME, None)
+        return None if tenant is None else tenant.db_schema
+
+    def get_new_connection(self, conn_params):
+        self.statement_executions.clear()
+        self.prepared_statements = {}
+        self.prepared_names = None
+        pooled = self.pool.acquire(self.get_active_schema())
+        if pooled is None:
+            self.tenant_schema = None
+            return super(DatabaseWrapper, self).get_new_connection(conn_params)
+        connection, self.tenant_schema = pooled
+        return connection
+
+    def create_cursor(self, *args, **kwargs):
+        cursor = super(DatabaseWrapper, self).create_cursor(*args, **kwargs)
+        if self.settings_dict.get('PREPARE_THRESHOLD') and not (args or kwargs.get('name')):
+            return PreparingCursor(cursor, self)
+        return cursor
+
+    def _close(self):
+        connection = self.connection
+        # Connections closed in a transaction are kept by the wrapper until
+        # the next `connect()`.
+        if connection is None or connection.closed or self.in_atomic_block:
+            return super(DatabaseWrapper, self)._close()
+        try:
+            with self.wrap_database_errors:
+                if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                    # The search path might have been altered by the transaction.
+                    self.tenant_schema = None
+        except DatabaseError:
+            return super(DatabaseWrapper, self)._close()
+        self.pool.release(connection, self.tenant_schema)
+        self.tenant_schema = None
+
+    # Settings altered in a transaction are reverted when it's rolled back.
+    def _rollback(self):
+        self.tenant_schema = None
+        return super(DatabaseWrapper, self)._rollback()
+
+    def _savepoint_rollback(self, sid):
+        self.tenant_schema = None
+        return super(DatabaseWrapper, self)._savepoint_rollback(sid)
+
+    def set_tenant_schema(self, schema):
+        """
+        Point the search path of the connection to `schema` unless it already
+        does, or reset it if `schema` is `None`.
+        """
+        if schema is not None and schema == self.tenant_schema:
+            return
+        with self.cursor() as cursor:
+            if schema is None:
+                cursor.execute('RESET search_path')
+            else:
+                cursor.execute("SET search_path = %s, public" % self.ops.quote_name(schema))
+        self.tenant_schema = schema
+
+    def select_model_schema(self, model):
+        """
+        Point the search path of the connection to the schema of the tenant
+        `model` belongs to when tenant models use unqualified table names.
+        """
+        from ...settings import UNQUALIFIED_TABLES
+        if not UNQUALIFIED_TABLES or model is None:
+            return
+        schema = getattr(model._meta.apps, 'db_schema', None)
+        if schema is not None:
+            self.set_tenant_schema(schema)
+
+    def get_prepared_statement(self, cursor, sql, params_count):
+        """
+        Return the name `sql` was prepared as on this connection, preparing it
+        if it was executed at least `PREPARE_THRESHOLD` times, or `None`.
+        """
+        if sql in self.prepared_statements:
+            return self.prepared_statements[sql]
+        if sql in self.unpreparable_statements:
+            return None
+        if sql.lstrip()[:6].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            return None
+        if len(self.statement_executions) >= MAX_COUNTED_STATEMENTS:
+            self.statement_executions.clear()
+            self.unpreparable_statements.clear()
+        self.statement_executions[sql] += 1
+        if self.statement_executions[sql] < self.settings_dict['PREPARE_THRESHOLD']:
+            return None
+        statement, count = to_positional_placeholders(sql)
+        if count != params_count:
+            return None
+        if self.prepared_names is None:
+            cursor.execute('SELECT name FROM pg_prepared_statements')
+            self.prepared_names = set(name for name, in cursor.fetchall())
+        name = "tenancy_%s" % hashlib.md5(force_bytes(sql)).hexdigest()[:16]
+        if name not in self.prepared_names:
+            # A failed PREPARE must not abort the ongoing transaction.
+            in_transaction = not self.get_autocommit()
+            if in_transaction:
+                cursor.execute('SAVEPOINT tenancy_prepare')
+            try:
+                cursor.execute("PREPARE %s AS %s" % (name, statement))
+            except base.Database.Error:
+                if in_transaction:
+                    cursor.execute('ROLLBACK TO SAVEPOINT tenancy_prepare')
+                    cursor.execute('RELEASE SAVEPOINT tenancy_prepare')
+                self.unpreparable_statements.add(sql)
+                return None
+            if in_transaction:
+                cursor.execute('RELEASE SAVEPOINT tenancy_prepare')
+            self.prepared_names.add(name)
+        self.prepared_statements[sql] = name
+        return name
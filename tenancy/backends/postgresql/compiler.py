@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+from django.db.models.sql import compiler
+
+
+class TenantSchemaCompilerMixin(object):
+    """
+    Point the search path of the connection to the schema of the tenant the
+    queried model belongs to before executing queries.
+    """
+
+    def execute_sql(self, *args, **kwargs):
+        self.connection.select_model_schema(self.query.model)
+        return super(TenantSchemaCompilerMixin, self).execute_sql(*args, **kwargs)
+
+
+class SQLCompiler(TenantSchemaCompilerMixin, compiler.SQLCompiler):
+    pass
+
+
+class SQLInsertCompiler(TenantSchemaCompilerMixin, compiler.SQLInsertCompiler):
+    pass
+
+
+class SQLDeleteCompiler(TenantSchemaCompilerMixin, compiler.SQLDeleteCompiler):
+    pass
+
+
+class SQLUpdateCompiler(TenantSchemaCompilerMixin, compiler.SQLUpdateCompiler):
+    pass
+
+
+class SQLAggregateCompiler(TenantSchemaCompilerMixin, compiler.SQLAggregateCompiler):
+    pass
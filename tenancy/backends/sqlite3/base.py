@@ -0,0 +1,393 @@
+"""
+SQLite backend storing each tenant's tables in its own database file which is
+attached to connections as a schema named after the tenant's `db_schema`.
+
+Compared to the default table name prefixing this keeps the main database
+`sqlite_master` small, allows writers of different tenants to hold
+independent locks and makes dropping or backing up a tenant a file operation.
+
+Tenant databases are stored in the directory specified by the
+`TENANT_DATABASES_DIR` key of the database settings which defaults to a
+`<NAME>.tenants` directory next to the main database file.
+
+SQLite limits the number of databases that can be attached to a single
+connection through its `SQLITE_MAX_ATTACHED` compile time option which defaults
+to 10 (and is at most 125). Tenant databases are thus only attached once their
+tables are first queried and the least recently used one is detached when the
+`MAX_ATTACHED_DATABASES` key of the database settings, which defaults to 10, is
+reached. Databases used by the current transaction can't be detached which
+means a single transaction can't involve more tenants than this limit.
+"""
+from __future__ import unicode_literals
+
+import errno
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db.backends.base.introspection import TableInfo
+from django.db.backends.sqlite3 import base, features, introspection, schema
+from django.utils.encoding import force_text
+
+
+def remove_database_files(path):
+    """
+    Remove the database file at `path` along with its journal files.
+    """
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+def split_table_name(table_name):
+    """
+    Split a `schema"."table` name as generated by `db_schema_table` into its
+    schema and table components.
+    """
+    db_schema, _, table_name = table_name.rpartition('"."')
+    return (db_schema or None), table_name
+
+
+class DatabaseFeatures(features.DatabaseFeatures):
+    uses_attached_tenant_databases = True
+
+
+class DatabaseSchemaEditor(schema.DatabaseSchemaEditor):
+    # SQLite only allows the created index name to be qualified and requires
+    # foreign keys to reference tables of the same database.
+    create_index_re = re.compile(
+        r'^CREATE (UNIQUE )?INDEX (?:"[^"]+"\.)?("[^"]+") ON ("[^"]+")\.("[^"]+")'
+    )
+    non_tenant_reference_re = re.compile(r' REFERENCES "[^"]+" \("[^"]+"\)(?: DEFERRABLE INITIALLY DEFERRED)?')
+    tenant_reference_re = re.compile(r'REFERENCES "[^"]+"\.("[^"]+")')
+    rename_table_re = re.compile(r'RENAME TO "[^"]+"\.("[^"]+")')
+    drop_index_re = re.compile(r'^DROP INDEX ("[^"]+")$')
+
+    def execute(self, sql, params=()):
+        sql = force_text(sql)
+        sql = self.create_index_re.sub(
+            lambda match: 'CREATE %sINDEX %s.%s ON %s' % (
+                match.group(1) or '', match.group(3), match.group(2), match.group(4)
+            ), sql
+        )
+        sql = self.non_tenant_reference_re.sub('', sql)
+        sql = self.tenant_reference_re.sub(r'REFERENCES \1', sql)
+        sql = self.rename_table_re.sub(r'RENAME TO \1', sql)
+        tenant = getattr(self, 'tenant', None)
+        if tenant is not None:
+            sql = self.drop_index_re.sub(
+                lambda match: 'DROP INDEX %s.%s' % (self.quote_name(tenant.db_schema), match.group(1)), sql
+            )
+        return super(DatabaseSchemaEditor, self).execute(sql, params)
+
+
+class AttachedDatabaseCursor(object):
+    """
+    Cursor proxy redirecting catalog queries to an attached database.
+    """
+    pragma_re = re.compile(r'PRAGMA (\w+)\(')
+
+    def __init__(self, cursor, db_schema):
+        self.cursor = cursor
+        self.quoted_schema = '"%s"' % db_schema
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=None):
+        sql = self.pragma_re.sub(
+            lambda match: 'PRAGMA %s.%s(' % (self.quoted_schema, match.group(1)), sql
+        )
+        sql = sql.replace('sqlite_master', '%s.sqlite_master' % self.quoted_schema)
+        return self.cursor.execute(sql, params)
+
+
+def attached_table_method(name):
+    def method(self, cursor, table_name):
+        db_schema, table_name = split_table_name(table_name)
+        if db_schema is not None:
+            cursor = AttachedDatabaseCursor(cursor, db_schema)
+        return getattr(super(DatabaseIntrospection, self), name)(cursor, table_name)
+    method.__name__ = str(name)
+    return method
+
+
+class DatabaseIntrospection(introspection.DatabaseIntrospection):
+    get_table_description = attached_table_method('get_table_description')
+    get_relations = attached_table_method('get_relations')
+    get_key_columns = attached_table_method('get_key_columns')
+    get_primary_key_column = attached_table_method('get_primary_key_column')
+    get_constraints = attached_table_method('get_constraints')
+    if hasattr(introspection.DatabaseIntrospection, 'get_indexes'):
+        get_indexes = attached_table_method('get_indexes')
+
+    def get_table_list(self, cursor):
+        """
+        Return the tables of the main database along with the ones of the
+        attached tenant databases named as `db_schema_table` does.
+        """
+        tables = list(super(DatabaseIntrospection, self).get_table_list(cursor))
+        # Tenant databases are attached on demand by the queries below.
+        for db_schema in sorted(self.connection.get_tenant_database_schemas()):
+            cursor.execute(
+                "SELECT name, type FROM %s.sqlite_master "
+                "WHERE type in ('table', 'view') AND NOT name='sqlite_sequence' "
+                "ORDER BY name" % self.connection.ops.quote_name(db_schema)
+            )
+            tables.extend(
+                TableInfo('%s"."%s' % (db_schema, row[0]), row[1][0]) for row in cursor.fetchall()
+            )
+        return tables
+
+
+class TenantDatabasesCursor(object):
+    """
+    Cursor proxy attaching the tenant databases referenced by the executed
+    queries.
+    """
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=None):
+        self.connection.use_tenant_databases(sql)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.connection.use_tenant_databases(sql)
+        return self.cursor.executemany(sql, param_list)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    SchemaEditorClass = DatabaseSchemaEditor
+    features_class = DatabaseFeatures
+    introspection_class = DatabaseIntrospection
+
+    # Bumped every time a tenant database is attached or detached in order to
+    # signal other connections of the process they must synchronize.
+    tenant_databases_version = 0
+    tenant_databases_lock = threading.Lock()
+
+    # Quoted identifiers qualifying another one, possibly the schema of an
+    # attached tenant database.
+    qualifier_re = re.compile(r'"([^"]+)"\.')
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        # Django < 1.11 doesn't rely on the `*_class` attributes.
+        self.features = DatabaseFeatures(self)
+        self.introspection = DatabaseIntrospection(self)
+        # Attached tenant databases ordered from the least to the most
+        # recently used one.
+        self.attached_tenant_databases = OrderedDict()
+        # Qualifiers known not to be tenant databases, mostly table names.
+        self.non_tenant_qualifiers = set()
+        self.synchronized_tenant_databases_version = None
+        # Tenant database being replaced by `replacing_tenant_database`.
+        self.replaced_tenant_database = None
+
+    @classmethod
+    def tenant_databases_changed(cls):
+        with cls.tenant_databases_lock:
+            DatabaseWrapper.tenant_databases_version += 1
+
+    def get_tenant_databases_dir(self):
+        directory = self.settings_dict.get('TENANT_DATABASES_DIR')
+        if directory:
+            return directory
+        name = force_text(self.settings_dict['NAME'])
+        if name == ':memory:' or 'mode=memory' in name:
+            return os.path.join(tempfile.gettempdir(), 'tenancy-%s-%d' % (self.alias, os.getpid()))
+        return "%s.tenants" % name
+
+    def get_tenant_database_path(self, db_schema):
+        return os.path.join(self.get_tenant_databases_dir(), "%s.sqlite3" % db_schema)
+
+    def get_tenant_database_schemas(self):
+        try:
+            filenames = os.listdir(self.get_tenant_databases_dir())
+        except OSError:
+            return set()
+        return set(
+            filename[:-len('.sqlite3')] for filename in filenames if filename.endswith('.sqlite3')
+        )
+
+    def get_max_attached_databases(self):
+        return self.settings_dict.get('MAX_ATTACHED_DATABASES', 10)
+
+    def synchronize_tenant_databases(self):
+        """
+        Detach the tenant databases, which might have been deleted or replaced
+        by other connections of the process, for them to be attached again on
+        demand.
+        """
+        for db_schema in list(self.attached_tenant_databases):
+            if db_schema == self.replaced_tenant_database:
+                continue
+            self.connection.execute('DETACH DATABASE %s' % self.ops.quote_name(db_schema))
+            del self.attached_tenant_databases[db_schema]
+        self.non_tenant_qualifiers.clear()
+        self.synchronized_tenant_databases_version = DatabaseWrapper.tenant_databases_version
+
+    def get_new_connection(self, conn_params):
+        connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        self.attached_tenant_databases = OrderedDict()
+        self.non_tenant_qualifiers = set()
+        self.synchronized_tenant_databases_version = DatabaseWrapper.tenant_databases_version
+        return connection
+
+    def create_cursor(self, *args, **kwargs):
+        # Databases used by a transaction can't be detached until it ends.
+        if (self.synchronized_tenant_databases_version != DatabaseWrapper.tenant_databases_version and
+                not getattr(self.connection, 'in_transaction', True)):
+            self.synchronize_tenant_databases()
+        cursor = super(DatabaseWrapper, self).create_cursor(*args, **kwargs)
+        return TenantDatabasesCursor(cursor, self)
+
+    def use_tenant_databases(self, sql):
+        """
+        Attach the tenant databases referenced by `sql` and mark them as the
+        most recently used ones.
+        """
+        attached = self.attached_tenant_databases
+        db_schemas = set()
+        for name in self.qualifier_re.findall(sql):
+            if name in db_schemas or name in self.non_tenant_qualifiers:
+                continue
+            if name in attached:
+                attached[name] = attached.pop(name)
+            elif os.path.exists(self.get_tenant_database_path(name)):
+                self.attach(name, db_schemas)
+            else:
+                self.non_tenant_qualifiers.add(name)
+                continue
+            db_schemas.add(name)
+
+    def attach(self, db_schema, in_use=(), path=None):
+        """
+        Attach the database of a tenant, or the one at `path`, detaching the
+        least recently used one not `in_use` if the limit of attached
+        databases is reached.
+        """
+        attached = self.attached_tenant_databases
+        if len(attached) >= self.get_max_attached_databases():
+            quote_name = self.ops.quote_name
+            for candidate in list(attached):
+                if candidate in in_use:
+                    continue
+                try:
+                    self.connection.execute('DETACH DATABASE %s' % quote_name(candidate))
+                except base.Database.OperationalError:
+                    # The database is used by the current transaction.
+                    continue
+                del attached[candidate]
+                break
+            else:
+                raise base.Database.OperationalError(
+                    "Cannot attach the %s tenant database as the %d attached ones are in use." % (
+                        db_schema, len(attached)
+                    )
+                )
+        self.connection.execute(
+            'ATTACH DATABASE ? AS %s' % self.ops.quote_name(db_schema),
+            [path or self.get_tenant_database_path(db_schema)]
+        )
+        attached[db_schema] = None
+        self.non_tenant_qualifiers.discard(db_schema)
+
+    def attach_tenant_database(self, db_schema):
+        """
+        Create the database file of a tenant and attach it as `db_schema`.
+        """
+        try:
+            os.makedirs(self.get_tenant_databases_dir())
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.ensure_connection()
+        if db_schema not in self.attached_tenant_databases:
+            with self.wrap_database_errors:
+                self.attach(db_schema)
+        self.tenant_databases_changed()
+
+    @contextmanager
+    def replacing_tenant_database(self, db_schema):
+        """
+        Attach an empty database as `db_schema` for the duration of the block
+        and replace the database of the tenant by it once the block completes
+        successfully. The database of the tenant is left untouched otherwise.
+        """
+        self.ensure_connection()
+        quote_name = self.ops.quote_name
+        path = self.get_tenant_database_path(db_schema)
+        temporary_path = os.path.join(self.get_tenant_databases_dir(), "%s.replacement" % db_schema)
+        remove_database_files(temporary_path)
+        with self.wrap_database_errors:
+            if db_schema in self.attached_tenant_databases:
+                self.connection.execute('DETACH DATABASE %s' % quote_name(db_schema))
+                del self.attached_tenant_databases[db_schema]
+            self.attach(db_schema, path=temporary_path)
+        self.replaced_tenant_database = db_schema
+        try:
+            yield
+        except Exception:
+            with self.wrap_database_errors:
+                self.connection.execute('DETACH DATABASE %s' % quote_name(db_schema))
+            del self.attached_tenant_databases[db_schema]
+            remove_database_files(temporary_path)
+            raise
+        finally:
+            self.replaced_tenant_database = None
+        with self.wrap_database_errors:
+            self.connection.execute('DETACH DATABASE %s' % quote_name(db_schema))
+        del self.attached_tenant_databases[db_schema]
+        remove_database_files(path)
+        os.rename(temporary_path, path)
+        self.tenant_databases_changed()
+
+    def detach_tenant_database(self, db_schema, tombstone=None):
+        """
+        Detach the database of a tenant and remove its file. If a `tombstone`
+        is specified the file is renamed instead in order to be removed later
+        on by `remove_tenant_database_tombstones`.
+        """
+        self.ensure_connection()
+        if db_schema in self.attached_tenant_databases:
+            with self.wrap_database_errors:
+                self.connection.execute('DETACH DATABASE %s' % self.ops.quote_name(db_schema))
+            del self.attached_tenant_databases[db_schema]
+        path = self.get_tenant_database_path(db_schema)
+        if tombstone is not None:
+            os.rename(path, os.path.join(self.get_tenant_databases_dir(), "%s.tombstone" % tombstone))
+        remove_database_files(path)
+        self.tenant_databases_changed()
+
+    def remove_tenant_database_tombstones(self, limit=None):
+        """
+        Remove up to `limit` database files left behind by
+        `detach_tenant_database` and return their names.
+        """
+        directory = self.get_tenant_databases_dir()
+        try:
+            filenames = os.listdir(directory)
+        except OSError:
+            return []
+        tombstones = sorted(filename for filename in filenames if filename.endswith('.tombstone'))[:limit]
+        for tombstone in tombstones:
+            os.remove(os.path.join(directory, tombstone))
+        return [tombstone[:-len('.tombstone')] for tombstone in tombstones]
@@ -0,0 +1,65 @@
+"""
+Helpers for data migrations processing large tables of tenants, usually
+from the function of a tenant `RunPython` operation.
+
+    def backfill(apps, schema_editor):
+        Model = apps.get_model('app', 'Model')
+        for batch in iterate_keyset(Model.objects.filter(field=None)):
+            for obj in batch:
+                obj.field = compute(obj)
+            bulk_update(batch, ['field'])
+"""
+from __future__ import unicode_literals
+
+from django.db.models import Case, Value, When
+
+BATCH_SIZE = 1000
+
+
+def iterate_keyset(queryset, batch_size=BATCH_SIZE):
+    """
+    Yield lists of at most `batch_size` objects from `queryset` ordered by
+    primary key. Batches are retrieved by filtering against the last primary
+    key seen instead of using offsets, which keeps each query cheap and
+    allows objects to be altered or removed from the queryset between
+    batches.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_queryset[:batch_size])
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_pk = batch[-1].pk
+
+
+def bulk_update(objs, fields, batch_size=None):
+    """
+    Update the `fields` of `objs`, which must be instances of the same
+    model, in a single query per batch of `batch_size` objects and return
+    the number of updated rows.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    model = objs[0]._meta.concrete_model
+    opts = model._meta
+    fields = [opts.get_field(name) for name in fields]
+    using = objs[0]._state.db
+    batch_size = batch_size or len(objs)
+    updated = 0
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = {}
+        for field in fields:
+            updates[field.name] = Case(*[
+                When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field)) for obj in batch
+            ], output_field=field)
+        updated += model._base_manager.using(using).filter(
+            pk__in=[obj.pk for obj in batch]
+        ).update(**updates)
+    return updated
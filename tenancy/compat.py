@@ -36,6 +36,12 @@ else:
             return function(local, related, field)
         add_lazy_relation(model, field, related_model, operation)
 
+if django.VERSION >= (1, 9):
+    from django.db.transaction import on_commit  # noqa
+else:
+    def on_commit(func, using=None):
+        func()
+
 if django.VERSION >= (1, 10):
     private_only_attr = 'private_only'
 
@@ -54,3 +60,8 @@ else:
         return (
             proxy_opts.model for proxy_opts in opts.proxied_children if proxy_opts.model._deferred
         )
+
+if django.VERSION >= (1, 11):
+    from django.core.exceptions import EmptyResultSet  # noqa
+else:
+    from django.db.models.sql.datastructures import EmptyResultSet  # noqa
@@ -0,0 +1,338 @@
+"""
+Per-tenant query instrumentation enabled by pointing the
+`TENANCY_QUERY_COLLECTOR` setting to a `QueryCollector` subclass and/or by
+enabling the `TENANCY_SQL_COMMENTS` setting. Query budgets of tenants, see
+`tenancy.throttling`, are also enforced by this layer.
+
+Queries executed on a connection while a tenant is active on it, that is
+while it's exposed through `as_global`, `GlobalTenantMiddleware` or migrated
+by a tenant operation, are timed and reported to the collector. On PostgreSQL
+the `application_name` of the connection is also set to `tenancy:<db_schema>`
+before the first query of a tenant is executed for `pg_stat_activity` to show
+which tenant is running queries. The settings returned by the tenant's
+`get_session_settings()` are applied in the same round trip and reset before
+the first query executed once the tenant is no longer active.
+
+When `TENANCY_SQL_COMMENTS` is enabled these queries are also suffixed with a
+comment of the form `/*model='app.Model',tenant='name',view='view_name'*/`
+for slow query logs to attribute them. The keys are sorted and the values,
+which are URL encoded, only depend on the tenant, the queried tenant model and
+the view being processed. Trailing comments are ignored by the normalization
+of statements performed by `pg_stat_statements`.
+"""
+from __future__ import unicode_literals
+
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.encoding import force_text
+from django.utils.http import urlquote
+from django.utils.module_loading import import_string
+
+from .throttling import get_usage_tracker
+
+_collectors = {}
+_collectors_lock = threading.Lock()
+
+_commented_compilers = {}
+
+# Schema of the session state of connections which transaction was rolled back.
+ROLLED_BACK = object()
+
+
+class QueryCollector(object):
+    def record(self, db_schema, sql, duration):
+        """
+        Record that `sql` took `duration` seconds to execute for the tenant
+        using the `db_schema` schema.
+        """
+        raise NotImplementedError
+
+
+class TenantQueryStats(object):
+    def __init__(self, slowest_count):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_count = slowest_count
+        # Heap of `(duration, sql)` tuples.
+        self._slowest = []
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        if len(self._slowest) < self.slowest_count:
+            heapq.heappush(self._slowest, (duration, sql))
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (duration, sql))
+
+    @property
+    def slowest(self):
+        """
+        Return the slowest `(duration, sql)` statements, slowest first.
+        """
+        return sorted(self._slowest, reverse=True)
+
+
+class MemoryQueryCollector(QueryCollector):
+    """
+    Collector aggregating the number of queries, their total duration and
+    the slowest statements of each tenant in memory.
+    """
+    slowest_count = 10
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, db_schema, sql, duration):
+        with self.lock:
+            stats = self.stats.get(db_schema)
+            if stats is None:
+                stats = self.stats[db_schema] = TenantQueryStats(self.slowest_count)
+            stats.add(sql, duration)
+
+    def get_stats(self, db_schema):
+        with self.lock:
+            return self.stats.get(db_schema)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+def get_query_collector():
+    """
+    Return the collector specified by `TENANCY_QUERY_COLLECTOR` or `None`
+    if instrumentation is disabled.
+    """
+    from .settings import QUERY_COLLECTOR
+    if not QUERY_COLLECTOR:
+        return None
+    with _collectors_lock:
+        try:
+            return _collectors[QUERY_COLLECTOR]
+        except KeyError:
+            collector = _collectors[QUERY_COLLECTOR] = import_string(QUERY_COLLECTOR)()
+            return collector
+
+
+class InstrumentedCursor(object):
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cursor.__exit__(*args)
+
+    def _apply_session_settings(self, db_schema, session_settings):
+        connection = self.connection
+        if connection.vendor != 'postgresql':
+            return
+        # The names of all the settings ever applied on the session are kept
+        # around since rolled back transactions might not have reverted them.
+        previous_schema, applied_names = getattr(connection, 'tenancy_session_state', None) or (None, frozenset())
+        if previous_schema == db_schema:
+            return
+        if db_schema is not None:
+            session_settings = dict(session_settings, application_name="tenancy:%s" % db_schema)
+        sql, params = get_session_settings_sql(session_settings, applied_names)
+        self.cursor.execute(sql, params)
+        connection.tenancy_session_state = (db_schema, applied_names.union(session_settings))
+
+    def _record(self, method, sql, params):
+        instrumentation = getattr(self.connection, 'tenancy_instrumentation', None)
+        if instrumentation is None:
+            self._apply_session_settings(None, {})
+            return method(sql, params)
+        tenant = instrumentation.tenant
+        db_schema = tenant.db_schema
+        self._apply_session_settings(db_schema, instrumentation.session_settings)
+        statement = sql
+        if instrumentation.comments:
+            comment = get_sql_comment(self.connection, tenant)
+            # Comments go through parameters interpolation if any.
+            statement = "%s %s" % (sql, comment if params is None else comment.replace('%', '%%'))
+        collector, budget = instrumentation.collector, instrumentation.budget
+        if collector is None and budget is None:
+            return method(statement, params)
+        tracker = None
+        if budget is not None:
+            tracker = get_usage_tracker()
+            tracker.acquire(db_schema, budget)
+        start = time.time()
+        try:
+            return method(statement, params)
+        finally:
+            duration = time.time() - start
+            if tracker is not None:
+                tracker.release(db_schema, budget, duration)
+            if collector is not None:
+                collector.record(db_schema, sql, duration)
+
+    def execute(self, sql, params=None):
+        return self._record(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._record(self.cursor.executemany, sql, param_list)
+
+
+@receiver(connection_created, dispatch_uid='tenancy.instrumentation')
+def reset_session_state(connection, **kwargs):
+    connection.tenancy_session_state = None
+
+
+def get_session_settings_sql(session_settings, reset_names=()):
+    """
+    Return the `(sql, params)` statement setting the PostgreSQL
+    `session_settings` and resetting the `reset_names` ones that are not part
+    of them in a single round trip. Unknown setting names make the statement
+    fail.
+    """
+    values = sorted(session_settings.items())
+    values.extend((name, None) for name in sorted(set(reset_names).difference(session_settings)))
+    sql = (
+        "SELECT set_config(v.name, COALESCE(v.value, s.reset_val), false) "
+        "FROM (VALUES %s) AS v (name, value) LEFT JOIN pg_settings s ON s.name = v.name" % (
+            ', '.join(['(%s, %s)'] * len(values))
+        )
+    )
+    params = []
+    for name, value in values:
+        params.extend([name, None if value is None else force_text(value)])
+    return sql, params
+
+
+def get_sql_comment(connection, tenant):
+    """
+    Return the comment attributing the queries executed on `connection` to
+    `tenant`, the tenant model being queried and the view being processed.
+    """
+    tags = {'tenant': ','.join(force_text(value) for value in tenant.natural_key())}
+    model = getattr(connection, 'tenancy_query_model', None)
+    for_tenant_model = getattr(model, '_for_tenant_model', None)
+    if for_tenant_model is not None:
+        opts = for_tenant_model._meta
+        tags['model'] = "%s.%s" % (opts.app_label, opts.object_name)
+    view_name = getattr(connection, 'tenancy_view_name', None)
+    if view_name:
+        tags['view'] = view_name
+    # Quoting prevents values from terminating the comment.
+    return "/*%s*/" % ','.join(
+        "%s='%s'" % (key, urlquote(value, safe='')) for key, value in sorted(tags.items())
+    )
+
+
+class CommentedCompilerMixin(object):
+    """
+    Compiler mixin exposing the model being queried to the cursors of the
+    connection for it to be mentioned in SQL comments.
+    """
+
+    def execute_sql(self, *args, **kwargs):
+        connection = self.connection
+        previous = getattr(connection, 'tenancy_query_model', None)
+        connection.tenancy_query_model = self.query.model
+        try:
+            return super(CommentedCompilerMixin, self).execute_sql(*args, **kwargs)
+        finally:
+            connection.tenancy_query_model = previous
+
+
+def get_commented_compiler(compiler):
+    try:
+        return _commented_compilers[compiler]
+    except KeyError:
+        commented_compiler = _commented_compilers[compiler] = type(
+            str("Commented%s" % compiler.__name__), (CommentedCompilerMixin, compiler), {}
+        )
+        return commented_compiler
+
+
+class Instrumentation(object):
+    def __init__(self, tenant, collector=None, comments=False, budget=None, session_settings=None):
+        self.tenant = tenant
+        self.collector = collector
+        self.comments = comments
+        self.budget = budget
+        self.session_settings = session_settings or {}
+
+
+def _instrument_connection(connection):
+    for name in ('make_cursor', 'make_debug_cursor'):
+        make_cursor = getattr(connection, name)
+
+        def wrapper(cursor, make_cursor=make_cursor):
+            return InstrumentedCursor(make_cursor(cursor), connection)
+        setattr(connection, name, wrapper)
+
+    def wrap_rollback(rollback):
+        def wrapper(*args):
+            # Settings altered in a transaction are reverted when it's rolled
+            # back, the applied ones must all be set again.
+            state = getattr(connection, 'tenancy_session_state', None)
+            if state is not None:
+                connection.tenancy_session_state = (ROLLED_BACK, state[1])
+            return rollback(*args)
+        return wrapper
+    for name in ('_rollback', '_savepoint_rollback'):
+        setattr(connection, name, wrap_rollback(getattr(connection, name)))
+    ops = connection.ops
+    compiler = ops.compiler
+
+    def compiler_wrapper(compiler_name):
+        return get_commented_compiler(compiler(compiler_name))
+    ops.compiler = compiler_wrapper
+
+
+def activate_instrumentation(connection, tenant):
+    """
+    Attribute the queries executed on `connection` to `tenant` until
+    `deactivate_instrumentation` is called with the returned value.
+    """
+    from .settings import SQL_COMMENTS
+    previous = getattr(connection, 'tenancy_instrumentation', None)
+    collector = get_query_collector()
+    # Historical tenant models used by migrations don't define any budget or
+    # session settings.
+    get_query_budget = getattr(tenant, 'get_query_budget', None)
+    budget = None if get_query_budget is None else get_query_budget()
+    get_session_settings = getattr(tenant, 'get_session_settings', None)
+    session_settings = None
+    if get_session_settings is not None and connection.vendor == 'postgresql':
+        session_settings = get_session_settings()
+    if collector is None and not SQL_COMMENTS and budget is None and not session_settings:
+        return previous
+    # `django.db.connection` is a proxy hence the flag.
+    if not getattr(connection, 'tenancy_instrumented', False):
+        _instrument_connection(connection)
+        connection.tenancy_instrumented = True
+    connection.tenancy_instrumentation = Instrumentation(
+        tenant, collector, SQL_COMMENTS, budget, session_settings
+    )
+    return previous
+
+
+def deactivate_instrumentation(connection, previous):
+    connection.tenancy_instrumentation = previous
+
+
+@contextmanager
+def instrument_tenant(connection, tenant):
+    previous = activate_instrumentation(connection, tenant)
+    try:
+        yield
+    finally:
+        deactivate_instrumentation(connection, previous)
@@ -0,0 +1,152 @@
+from __future__ import unicode_literals
+
+from django.apps.registry import Apps
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.six import iteritems
+from django.utils.timezone import now
+
+from .versions import get_migration_loader
+
+
+def get_running_migration(operation, app_label):
+    """
+    Return the migration of `app_label` `operation` is part of and the index
+    of the operation or `None` if it's not part of any migration.
+
+    Migrations share their operations with the migration modules they are
+    loaded from which allows them to be found by identity.
+    """
+    loader = get_migration_loader()
+    for (migration_app_label, _name), migration in iteritems(loader.disk_migrations):
+        if migration_app_label != app_label:
+            continue
+        for index, migration_operation in enumerate(migration.operations):
+            if migration_operation is operation:
+                return migration, index
+
+
+class MigrationJournal(object):
+    """
+    Deals with storing the outcome of tenant operations for each tenant in
+    order to allow interrupted migrations to resume where they stopped.
+
+    Like `MigrationRecorder` the table is created on demand and queried
+    through a floating model.
+    """
+    FORWARDS = 'forwards'
+    BACKWARDS = 'backwards'
+
+    APPLIED = 'applied'
+    FAILED = 'failed'
+    # Tenants left out of a staged rollout.
+    SKIPPED = 'skipped'
+
+    @python_2_unicode_compatible
+    class Entry(models.Model):
+        tenant = models.CharField(max_length=255)
+        app = models.CharField(max_length=255)
+        name = models.CharField(max_length=255)
+        operation = models.PositiveIntegerField()
+        direction = models.CharField(max_length=10)
+        status = models.CharField(max_length=10)
+        duration = models.FloatField(null=True)
+        recorded = models.DateTimeField(default=now)
+
+        class Meta:
+            apps = Apps()
+            app_label = 'tenancy'
+            db_table = 'tenancy_migration_journal'
+            unique_together = ('tenant', 'app', 'name', 'operation')
+
+        def __str__(self):
+            return "Operation %d of migration %s for %s %s for %s" % (
+                self.operation, self.name, self.app, self.status, self.tenant
+            )
+
+    def __init__(self, connection, migration=None, operation=None, direction=FORWARDS):
+        self.connection = connection
+        self.migration = migration
+        self.operation = operation
+        self.direction = direction
+
+    @classmethod
+    def for_operation(cls, operation, app_label, connection, backwards=False, required=False):
+        """
+        Return a journal bound to the migration of `app_label` `operation` is
+        part of if `TENANCY_MIGRATION_JOURNAL` is enabled or it's `required`.
+        """
+        from .settings import MIGRATION_JOURNAL
+        if not (MIGRATION_JOURNAL or required):
+            return
+        running = get_running_migration(operation, app_label)
+        if running is None:
+            return
+        migration, index = running
+        return cls(connection, migration, index, cls.BACKWARDS if backwards else cls.FORWARDS)
+
+    @property
+    def entries(self):
+        return self.Entry.objects.using(self.connection.alias)
+
+    def has_table(self):
+        with self.connection.cursor() as cursor:
+            tables = self.connection.introspection.table_names(cursor)
+        return self.Entry._meta.db_table in tables
+
+    def ensure_schema(self, schema_editor):
+        if not self.has_table():
+            schema_editor.create_model(self.Entry)
+
+    def get_operation_entries(self):
+        return self.entries.filter(
+            app=self.migration.app_label, name=self.migration.name, operation=self.operation
+        )
+
+    def is_applied(self, tenant):
+        return self.get_operation_entries().filter(
+            tenant=tenant.db_schema, direction=self.direction, status=self.APPLIED
+        ).exists()
+
+    def get_skipped_tenants(self):
+        """
+        Return the schemas of the tenants the operation was skipped for.
+        """
+        return set(self.get_operation_entries().filter(
+            direction=self.direction, status=self.SKIPPED
+        ).values_list('tenant', flat=True))
+
+    def has_skipped_tenants(self):
+        """
+        Return whether or not tenants were left out of staged rollouts and
+        haven't been resumed yet.
+        """
+        return self.has_table() and self.entries.filter(
+            direction=self.FORWARDS, status=self.SKIPPED
+        ).exists()
+
+    def get_lagging_tenants(self):
+        """
+        Return the schemas of the tenants other operations were skipped for
+        which are lagging behind the operation.
+        """
+        return set(self.entries.filter(
+            direction=self.FORWARDS, status=self.SKIPPED
+        ).exclude(
+            app=self.migration.app_label, name=self.migration.name, operation=self.operation
+        ).values_list('tenant', flat=True))
+
+    def record(self, tenant, status, duration=None):
+        entries = self.get_operation_entries().filter(tenant=tenant.db_schema)
+        entries.delete()
+        self.entries.create(
+            tenant=tenant.db_schema, app=self.migration.app_label, name=self.migration.name,
+            operation=self.operation, direction=self.direction, status=status, duration=duration,
+        )
+
+    def clear(self, tenant):
+        """
+        Forget about all the operations applied to a tenant.
+        """
+        if self.has_table():
+            self.entries.filter(tenant=tenant.db_schema).delete()
@@ -1,18 +1,145 @@
 from __future__ import unicode_literals
 
+import datetime
 import logging
 import re
+import uuid
 
+from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
-from django.db import connections, router
+from django.db import (
+    DEFAULT_DB_ALIAS, DatabaseError, connections, router, transaction,
+)
+from django.db.models import DO_NOTHING, Q
+from django.utils import timezone
 
 from .. import signals
-from ..compat import get_remote_field
+from ..compat import get_remote_field, on_commit
+from ..journal import MigrationJournal
+from ..utils import uses_attached_databases
+from ..versions import TenantSchemaVersions
 
+# Token substituted to tenants' schema in cached DDL templates.
+SCHEMA_PLACEHOLDER = '__tenancy_schema__'
 
-def create_tenant_schema(tenant, using=None):
+_schema_ddl_templates = {}
+
+# Prefix of the schemas, tables or databases of tenants waiting to be purged.
+TOMBSTONE_PREFIX = 'tenancy_tombstone_'
+
+
+def clear_schema_ddl_cache():
+    """
+    Discard the DDL templates cached by `create_tenant_schema`. This must be
+    called whenever the tenant models state is altered.
+    """
+    _schema_ddl_templates.clear()
+
+
+def collect_tenant_schema_ddl(tenant, connection, models):
+    """
+    Generate the DDL statements required to create the tables of the specified
+    tenant models through the schema editor without executing them.
+    """
+    quote_name = connection.ops.quote_name
+    from ..settings import SCHEMA_AUTHORIZATION
+    quoted_schema = quote_name(tenant.db_schema)
+    with connection.schema_editor(collect_sql=True) as editor:
+        for model in models:
+            opts = model._meta
+            editor.create_model(model)
+            if connection.vendor == 'postgresql' and SCHEMA_AUTHORIZATION:
+                quoted_tables = [quote_name(opts.db_table)] + [
+                    quote_name(get_remote_field(m2m).through._meta.db_table)
+                    for m2m in opts.many_to_many
+                    if get_remote_field(m2m).through._meta.auto_created
+                ]
+                editor.deferred_sql.extend(
+                    "ALTER TABLE %s OWNER TO %s" % (
+                        quoted_table, quoted_schema
+                    ) for quoted_table in quoted_tables
+                )
+        if connection.vendor == 'postgresql':
+            altered_statements = []
+            # Our "db_table" hack to allow specifying a schema interferes with
+            # index and constraint creation.
+            create_index_re = re.compile('CREATE INDEX %s' % re.escape("%s." % quoted_schema))
+            add_constraint_re = re.compile(r'ADD CONSTRAINT "([^\s]+)" ')
+            for statement in editor.deferred_sql:
+                if statement.startswith('CREATE INDEX'):
+                    statement = create_index_re.sub('CREATE INDEX ', statement)
+                elif 'ADD CONSTRAINT' in statement:
+                    statement = add_constraint_re.sub(
+                        lambda match: 'ADD CONSTRAINT "%s" ' % match.group(1).replace('"', '_'),
+                        statement
+                    )
+                altered_statements.append(statement)
+            editor.deferred_sql = altered_statements
+    return editor.collected_sql
+
+
+def get_tenant_schema_ddl(tenant, connection, models):
+    """
+    Return the DDL statements required to create the tables of the specified
+    tenant models.
+
+    Since the generated statements only differ between tenants by their schema
+    they are computed once per process and cached as templates where the
+    schema qualifying, or prefixing, table names is replaced by a placeholder.
+    Statements referring to the schema in any other way, such as identifiers
+    Django derived from the qualified table names, are not cached. The cache is
+    cleared when tenant migrations are run.
+    """
+    from ..settings import SCHEMA_AUTHORIZATION, SCHEMA_DDL_CACHE
+    schema = tenant.db_schema
+    key = (
+        connection.alias, SCHEMA_AUTHORIZATION,
+        tuple(model._for_tenant_model for model in models),
+    )
+    try:
+        templates = _schema_ddl_templates[key]
+    except KeyError:
+        statements = collect_tenant_schema_ddl(tenant, connection, models)
+        if not SCHEMA_DDL_CACHE:
+            return statements
+        quote_name = connection.ops.quote_name
+        quoted_schema = quote_name(schema)
+        # See `db_schema_table` for how table names refer to the schema.
+        if connection.vendor == 'postgresql' or uses_attached_databases(connection):
+            tokens = ["%s." % quoted_schema, "OWNER TO %s" % quoted_schema]
+        else:
+            tokens = [quote_name("%s_" % schema)[:-1]]
+        # Make sure the tokens can't be confused with one of the tenant models
+        # identifiers before replacing the schema they contain.
+        identifiers = set()
+        for model in models:
+            opts = model._for_tenant_model._meta
+            through_opts = [get_remote_field(m2m).through._meta for m2m in opts.local_many_to_many]
+            for model_opts in [opts] + through_opts:
+                identifiers.add(model_opts.db_table)
+                identifiers.update(field.column for field in model_opts.local_fields)
+        if any(schema in identifier for identifier in identifiers):
+            return statements
+        templates = []
+        for statement in statements:
+            if SCHEMA_PLACEHOLDER in statement:
+                return statements
+            for token in tokens:
+                statement = statement.replace(token, token.replace(schema, SCHEMA_PLACEHOLDER))
+            if schema in statement:
+                return statements
+            templates.append(statement)
+        _schema_ddl_templates[key] = tuple(templates)
+        return statements
+    return [template.replace(SCHEMA_PLACEHOLDER, schema) for template in templates]
+
+
+def create_tenant_schema(tenant, using=None, populate=None):
     """
     CREATE the tables associated with a tenant's models.
+
+    If specified, `populate` is called with the tenant and the connection
+    once the tables are created but before their indexes and constraints.
     """
     logger = logging.getLogger('tenancy.management.create_tenant_schema')
     tenant_class = tenant.__class__
@@ -36,6 +163,10 @@ def create_tenant_schema(tenant, using=None):
             create_schema = "CREATE SCHEMA %s"
         logger.info("Creating schema %s ..." % schema)
         connection.cursor().execute(create_schema % quoted_schema)
+    elif uses_attached_databases(connection):
+        schema = tenant.db_schema
+        logger.info("Attaching database %s ..." % schema)
+        connection.attach_tenant_database(schema)
 
     signals.post_schema_creation.send(
         sender=tenant_class, tenant=tenant, using=using
@@ -45,69 +176,315 @@ def create_tenant_schema(tenant, using=None):
         sender=tenant_class, tenant=tenant, using=using
     )
 
+    models = []
+    for model in tenant.models:
+        # Has the side effect of creating the required `ContentType`.
+        ContentType.objects.get_for_model(model)
+        # Avoid further processing we're dealing with an unmanaged model or
+        # one proxying another.
+        opts = model._meta
+        if not opts.managed or opts.proxy or opts.auto_created:
+            continue
+        if not router.allow_migrate(connection.alias, model):
+            continue
+        logger.debug(
+            "Processing %s.%s model" % (opts.app_label, opts.object_name)
+        )
+        if connection.vendor == 'postgresql' or uses_attached_databases(connection):
+            table_name = "%s.%s" % (
+                schema, model._for_tenant_model._meta.db_table
+            )
+        else:
+            table_name = opts.db_table
+        logger.info("Creating table %s ..." % table_name)
+        for m2m in opts.many_to_many:
+            through_opts = get_remote_field(m2m).through._meta
+            if through_opts.auto_created:
+                logger.info("Creating table %s ..." % through_opts.db_table)
+        models.append(model)
+
+    from ..settings import UNQUALIFIED_TABLES
+    unqualified = UNQUALIFIED_TABLES and connection.vendor == 'postgresql'
+    if unqualified:
+        # Unqualified tables are created in the first schema of the path.
+        connection.set_tenant_schema(schema)
+    statements = get_tenant_schema_ddl(tenant, connection, models)
+    deferred_statements = []
+    if populate is not None:
+        # Loading data is faster before indexes and constraints are created.
+        deferred_statements = [
+            statement for statement in statements if not statement.startswith('CREATE TABLE')
+        ]
+        statements = [statement for statement in statements if statement.startswith('CREATE TABLE')]
+    with connection.schema_editor() as editor:
+        for statement in statements:
+            editor.execute(statement, None)
+        if populate is not None:
+            populate(tenant, connection)
+            for statement in deferred_statements:
+                editor.execute(statement, None)
+        if unqualified:
+            connection.set_tenant_schema(None)
+        from ..settings import SCHEMA_VERSIONS
+        if SCHEMA_VERSIONS:
+            # Tenant operations of the migrations the tables already reflect
+            # can be skipped for this tenant.
+            versions = TenantSchemaVersions(connection)
+            versions.ensure_schema(editor)
+    if SCHEMA_VERSIONS:
+        versions.record(tenant)
+
+    signals.post_models_creation.send(
+        sender=tenant_class, tenant=tenant, using=using
+    )
+
+
+def request_tenant_provisioning(tenant, using=None):
+    """
+    Notify provisioning workers that a tenant's schema must be created once
+    the current transaction is committed.
+    """
+    tenant_class = tenant.__class__
+    using = using or router.db_for_write(tenant_class, instance=tenant)
+
+    def send():
+        signals.provisioning_requested.send(
+            sender=tenant_class, tenant=tenant, using=using
+        )
+    on_commit(send, using=using)
+
+
+def _get_stale_provisioning(tenant_class):
+    """
+    Return the filter matching tenants which provisioning was claimed by a
+    worker that didn't complete it in time or `None` if they must never be
+    claimed again.
+    """
+    from ..settings import PROVISIONING_STALE_TIMEOUT
+    if PROVISIONING_STALE_TIMEOUT is None:
+        return None
+    return Q(
+        provisioning_state=tenant_class.PROVISIONING_IN_PROGRESS,
+        provisioning_started_at__lt=timezone.now() - datetime.timedelta(seconds=PROVISIONING_STALE_TIMEOUT),
+    )
+
+
+def provision_tenant(tenant, using=None):
+    """
+    Create the schema of a tenant pending provisioning. Return whether or not
+    the tenant was claimed by this call since concurrent workers might be
+    attempting to provision it.
+
+    Tenants which provisioning is stale, see `TENANCY_PROVISIONING_STALE_TIMEOUT`,
+    are taken over and the schema left behind by the previous worker dropped.
+    """
+    logger = logging.getLogger('tenancy.management.provision_tenant')
+    tenant_class = tenant.__class__
+    using = using or router.db_for_write(tenant_class, instance=tenant)
+    tenants = tenant_class._base_manager.using(using).filter(pk=tenant.pk)
+    started_at = timezone.now()
+    claim = {
+        'provisioning_state': tenant_class.PROVISIONING_IN_PROGRESS,
+        'provisioning_started_at': started_at,
+    }
+    claimed = tenants.filter(provisioning_state=tenant_class.PROVISIONING_PENDING).update(**claim)
+    if not claimed:
+        stale = _get_stale_provisioning(tenant_class)
+        if stale is None or not tenants.filter(stale).update(**claim):
+            return False
+        logger.warning("Taking over the stale provisioning of tenant %r." % (tenant.natural_key(),))
+        # The schema might have been partially created.
+        try:
+            with transaction.atomic(using):
+                drop_tenant_schema(tenant, using=using)
+        except DatabaseError:
+            pass
+    tenant.provisioning_state = tenant_class.PROVISIONING_IN_PROGRESS
+    tenant.provisioning_started_at = started_at
+    try:
+        create_tenant_schema(tenant, using=using)
+    except Exception:
+        logger.exception("Failed to provision tenant %r." % (tenant.natural_key(),))
+        tenant.provisioning_state = tenant_class.PROVISIONING_FAILED
+        tenants.update(provisioning_state=tenant.provisioning_state)
+        raise
+    tenant.provisioning_state = tenant_class.PROVISIONING_READY
+    tenants.update(provisioning_state=tenant.provisioning_state)
+    return True
+
+
+def provision_pending_tenants(tenant_class, using=None, limit=None):
+    """
+    Provision the schema of tenants pending provisioning, or which
+    provisioning is stale, and return the number of provisioned ones.
+    Failures are logged and don't prevent other tenants from being
+    provisioned.
+    """
+    pending = Q(provisioning_state=tenant_class.PROVISIONING_PENDING)
+    stale = _get_stale_provisioning(tenant_class)
+    if stale is not None:
+        pending |= stale
+    tenants = tenant_class._base_manager.filter(pending).order_by('pk')
+    if using:
+        tenants = tenants.using(using)
+    if limit:
+        tenants = tenants[:limit]
+    provisioned = 0
+    for tenant in tenants:
+        try:
+            if provision_tenant(tenant, using=using):
+                provisioned += 1
+        except Exception:
+            continue
+    return provisioned
+
+
+def _has_related_objects(queryset, exclude=()):
+    """
+    Return whether or not objects of models other than `exclude` reference
+    the objects of `queryset`. Like the deletion collector relationships that
+    don't act on deletion, such as the ones of tenant model references, are
+    ignored.
+    """
+    for related_object in queryset.model._meta.get_fields(include_hidden=True):
+        if not (related_object.auto_created and not related_object.concrete and
+                (related_object.one_to_many or related_object.one_to_one)):
+            continue
+        if get_remote_field(related_object.field).on_delete is DO_NOTHING:
+            continue
+        related_model = related_object.related_model
+        if related_model in exclude:
+            continue
+        related_objects = related_model._base_manager.using(queryset.db).filter(**{
+            "%s__in" % related_object.field.name: queryset
+        })
+        if related_objects.exists():
+            return True
+    return False
+
+
+def _delete_tenant_content_types(tenant, raw=False):
+    content_types = ContentType.objects.filter(
+        pk__in=[
+            ct.pk for ct in ContentType.objects.get_for_models(
+                *tenant.models, for_concrete_models=False
+            ).values()
+        ]
+    )
+    if raw and apps.is_installed('django.contrib.auth'):
+        from django.contrib.auth.models import Permission
+        permissions = Permission.objects.filter(content_type__in=content_types)
+        # Auto-created many-to-many relationships to permissions, such as
+        # `User.user_permissions`, must be deleted along them.
+        permission_fields = [
+            related_object.field for related_object in Permission._meta.get_fields(include_hidden=True)
+            if related_object.many_to_many and related_object.auto_created and
+            get_remote_field(related_object.field).through._meta.auto_created
+        ]
+        raw = not (
+            _has_related_objects(content_types, set(tenant.models) | {Permission}) or
+            _has_related_objects(permissions, [get_remote_field(field).through for field in permission_fields])
+        )
+    elif raw:
+        permissions = None
+        raw = not _has_related_objects(content_types, set(tenant.models))
+    if not raw:
+        content_types.delete()
+        return
+    # Bypass the collector since it issues a query per related object.
+    if permissions is not None:
+        for field in permission_fields:
+            through_objects = get_remote_field(field).through._base_manager.using(permissions.db).filter(**{
+                "%s__in" % field.m2m_reverse_field_name(): permissions
+            })
+            through_objects._raw_delete(through_objects.db)
+        permissions._raw_delete(permissions.db)
+    content_types._raw_delete(content_types.db)
+
+
+def bury_tenant_schema(tenant, connection):
+    """
+    Rename the schema of a tenant to a tombstone in order to free it without
+    holding the locks required to DROP its tables.
+    """
+    logger = logging.getLogger('tenancy.management.bury_tenant_schema')
+    quote_name = connection.ops.quote_name
+    schema = tenant.db_schema
+    tombstone = "%s%s" % (TOMBSTONE_PREFIX, uuid.uuid4().hex)
+    logger.info("Renaming schema %s to %s ..." % (schema, tombstone))
+    if connection.vendor == 'postgresql':
+        connection.cursor().execute(
+            "ALTER SCHEMA %s RENAME TO %s" % (quote_name(schema), quote_name(tombstone))
+        )
+    else:
+        connection.detach_tenant_database(schema, tombstone=tombstone)
+    return tombstone
+
+
+def purge_tenant_tombstones(using=DEFAULT_DB_ALIAS, batch_size=50):
+    """
+    DROP up to `batch_size` tables left behind by tenants dropped with
+    `TENANCY_DEFERRED_SCHEMA_DROP` enabled. Return the number of purged
+    objects which is zero when there's nothing left to purge.
+    """
+    logger = logging.getLogger('tenancy.management.purge_tenant_tombstones')
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    if uses_attached_databases(connection):
+        tombstones = connection.remove_tenant_database_tombstones(batch_size)
+        for tombstone in tombstones:
+            logger.info("Removed database %s." % tombstone)
+        return len(tombstones)
+    elif connection.vendor != 'postgresql':
+        return 0
+    pattern = "%s%%" % TOMBSTONE_PREFIX.replace('_', '\\_')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT schemaname, tablename FROM pg_tables WHERE schemaname LIKE %s "
+            "ORDER BY schemaname, tablename LIMIT %s", [pattern, batch_size]
+        )
+        tables = cursor.fetchall()
+        # Each table is dropped in its own transaction to keep locks short.
+        for schema, table in tables:
+            logger.info("Dropping table %s.%s ..." % (schema, table))
+            cursor.execute("DROP TABLE IF EXISTS %s.%s CASCADE" % (quote_name(schema), quote_name(table)))
+        if tables:
+            return len(tables)
+        # Drop the remaining emptied schemas.
+        cursor.execute(
+            "SELECT nspname FROM pg_namespace WHERE nspname LIKE %s LIMIT %s", [pattern, batch_size]
+        )
+        schemas = [row[0] for row in cursor.fetchall()]
+        for schema in schemas:
+            logger.info("Dropping schema %s ..." % schema)
+            cursor.execute("DROP SCHEMA %s CASCADE" % quote_name(schema))
+    return len(schemas)
+
+
+def delete_tenant_tables(tenant, connection):
+    """
+    DROP the tables of a tenant's models one by one, as done when they can't
+    be dropped all at once with their schema or database.
+    """
     with connection.schema_editor() as editor:
         for model in tenant.models:
-            # Has the side effect of creating the required `ContentType`.
-            ContentType.objects.get_for_model(model)
-            # Avoid further processing we're dealing with an unmanaged model or
-            # one proxying another.
             opts = model._meta
             if not opts.managed or opts.proxy or opts.auto_created:
                 continue
             if not router.allow_migrate(connection.alias, model):
                 continue
-            logger.debug(
-                "Processing %s.%s model" % (opts.app_label, opts.object_name)
-            )
-            if connection.vendor == 'postgresql':
-                table_name = "%s.%s" % (
-                    schema, model._for_tenant_model._meta.db_table
-                )
-            else:
-                table_name = opts.db_table
-            logger.info("Creating table %s ..." % table_name)
-            auto_created_tables = []
-            for m2m in opts.many_to_many:
-                through_opts = get_remote_field(m2m).through._meta
-                if through_opts.auto_created:
-                    logger.info("Creating table %s ..." % through_opts.db_table)
-                    auto_created_tables.append(through_opts.db_table)
-            editor.create_model(model)
-            if connection.vendor == 'postgresql' and SCHEMA_AUTHORIZATION:
-                quoted_tables = [quote_name(opts.db_table)] + [
-                    quote_name(db_table) for db_table in auto_created_tables
-                ]
-                editor.deferred_sql.extend(
-                    "ALTER TABLE %s OWNER TO %s" % (
-                        quoted_table, quoted_schema
-                    ) for quoted_table in quoted_tables
-                )
-        if connection.vendor == 'postgresql':
-            altered_statements = []
-            # Our "db_table" hack to allow specifying a schema interferes with
-            # index and constraint creation.
-            create_index_re = re.compile('CREATE INDEX %s' % re.escape("%s." % quoted_schema))
-            add_constraint_re = re.compile('ADD CONSTRAINT "([^\s]+)" ')
-            for statement in editor.deferred_sql:
-                if statement.startswith('CREATE INDEX'):
-                    statement = create_index_re.sub('CREATE INDEX ', statement)
-                elif 'ADD CONSTRAINT' in statement:
-                    statement = add_constraint_re.sub(
-                        lambda match: 'ADD CONSTRAINT "%s" ' % match.group(1).replace('"', '_'),
-                        statement
-                    )
-                altered_statements.append(statement)
-            editor.deferred_sql = altered_statements
-
-    signals.post_models_creation.send(
-        sender=tenant_class, tenant=tenant, using=using
-    )
+            editor.delete_model(model)
 
 
 def drop_tenant_schema(tenant, using=None):
     """
     DROP the tables associated with a tenant's models.
+
+    When `TENANCY_DEFERRED_SCHEMA_DROP` is enabled on PostgreSQL or with
+    attached SQLite databases the schema is only renamed to a tombstone that
+    must be purged later on through `purge_tenant_tombstones`.
     """
+    from ..settings import DEFERRED_SCHEMA_DROP, MIGRATION_JOURNAL, SCHEMA_VERSIONS
     tenant_class = tenant.__class__
     using = using or router.db_for_write(tenant_class, instance=tenant)
     connection = connections[using]
@@ -117,27 +494,30 @@ def drop_tenant_schema(tenant, using=None):
         sender=tenant_class, tenant=tenant, using=using
     )
 
-    ContentType.objects.filter(
-        pk__in=[
-            ct.pk for ct in ContentType.objects.get_for_models(
-                *tenant.models, for_concrete_models=False
-            ).values()
-        ]
-    ).delete()
+    deferred = DEFERRED_SCHEMA_DROP and (
+        connection.vendor == 'postgresql' or uses_attached_databases(connection)
+    )
 
-    if connection.vendor == 'postgresql':
+    # The collector would delete the objects referencing the content types of
+    # every tenant in a single transaction which can't involve more attached
+    # databases than the connection can hold.
+    _delete_tenant_content_types(tenant, raw=deferred or uses_attached_databases(connection))
+
+    if deferred:
+        bury_tenant_schema(tenant, connection)
+    elif connection.vendor == 'postgresql':
         connection.cursor().execute(
             "DROP SCHEMA %s CASCADE" % quote_name(tenant.db_schema)
         )
+    elif uses_attached_databases(connection):
+        connection.detach_tenant_database(tenant.db_schema)
     else:
-        with connection.schema_editor() as editor:
-            for model in tenant.models:
-                opts = model._meta
-                if not opts.managed or opts.proxy or opts.auto_created:
-                    continue
-                if not router.allow_migrate(connection.alias, model):
-                    continue
-                editor.delete_model(model)
+        delete_tenant_tables(tenant, connection)
+
+    if MIGRATION_JOURNAL:
+        MigrationJournal(connection).clear(tenant)
+    if SCHEMA_VERSIONS:
+        TenantSchemaVersions(connection).clear(tenant)
 
     tenant_class._default_manager._remove_from_cache(tenant)
     ContentType.objects.clear_cache()
@@ -0,0 +1,64 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .. import provision_pending_tenants
+from ... import get_tenant_model
+from ...models import AbstractProvisionedTenant
+from .createtenant import CommandLoggingHandler
+
+
+class Command(BaseCommand):
+    help = 'Provision the schema of tenants pending provisioning.'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--loop', action='store_true', dest='loop', default=False,
+            help='Keep polling for tenants pending provisioning.'
+        )
+        parser.add_argument(
+            '--interval', type=float, dest='interval', default=5,
+            help='Number of seconds to wait between polls when looping.'
+        )
+        parser.add_argument(
+            '--limit', type=int, dest='limit', default=None,
+            help='Maximum number of tenants to provision per poll.'
+        )
+        parser.add_argument(
+            '--database', dest='database', default=None,
+            help='Nominates a database to provision tenants from.'
+        )
+
+    def handle(self, *args, **options):
+        tenant_model = get_tenant_model()
+        if not issubclass(tenant_model, AbstractProvisionedTenant):
+            opts = tenant_model._meta
+            raise CommandError(
+                "The tenant model %s.%s doesn't keep track of its provisioning "
+                "state." % (opts.app_label, opts.object_name)
+            )
+
+        handler = CommandLoggingHandler(
+            self.stdout._out, self.stderr._out, int(options['verbosity'])
+        )
+        logger = logging.getLogger('tenancy')
+        logger.setLevel(handler.level)
+        logger.addHandler(handler)
+        try:
+            while True:
+                provisioned = provision_pending_tenants(
+                    tenant_model, using=options['database'], limit=options['limit']
+                )
+                if provisioned:
+                    logger.info("Provisioned %d tenant(s)." % provisioned)
+                if not options['loop']:
+                    break
+                if not provisioned:
+                    time.sleep(options['interval'])
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
@@ -0,0 +1,50 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from .. import purge_tenant_tombstones
+from .createtenant import CommandLoggingHandler
+
+
+class Command(BaseCommand):
+    help = 'Drop the schemas of tenants deleted with TENANCY_DEFERRED_SCHEMA_DROP enabled.'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=50,
+            help='Maximum number of tables to drop per batch.'
+        )
+        parser.add_argument(
+            '--interval', type=float, dest='interval', default=0,
+            help='Number of seconds to wait between batches.'
+        )
+        parser.add_argument(
+            '--database', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to purge tombstones from.'
+        )
+
+    def handle(self, *args, **options):
+        handler = CommandLoggingHandler(
+            self.stdout._out, self.stderr._out, int(options['verbosity'])
+        )
+        logger = logging.getLogger('tenancy')
+        logger.setLevel(handler.level)
+        logger.addHandler(handler)
+        try:
+            purged = 0
+            while True:
+                batch = purge_tenant_tombstones(options['database'], options['batch_size'])
+                if not batch:
+                    break
+                purged += batch
+                if options['interval']:
+                    time.sleep(options['interval'])
+            logger.info("Purged %d tombstone object(s)." % purged)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
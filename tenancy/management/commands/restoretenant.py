@@ -0,0 +1,57 @@
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.six.moves import input
+
+from ..snapshot import restore_tenant
+from .createtenant import CommandLoggingHandler
+from .createtenantsuperuser import TenantAction
+
+
+class Command(BaseCommand):
+    help = 'Replace the tables of a tenant by the ones of an archive written by snapshottenant.'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('path', help='Path of the archive to restore.')
+        parser.add_argument(
+            'tenant', nargs='+', action=TenantAction,
+            help='Specifies the tenant to use by natural key.'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false', dest='interactive', default=True,
+            help='Tells Django to NOT prompt the user for input of any kind.'
+        )
+        parser.add_argument(
+            '--database', dest='database', default=None,
+            help='Nominates a database to restore the tenant to.'
+        )
+
+    def handle(self, *args, **options):
+        tenant = options['tenant']
+        if options['interactive']:
+            confirm = input(
+                "You have requested a restore of tenant %r.\nThis will IRREVERSIBLY "
+                "DESTROY all of its current data.\nAre you sure you want to do this? "
+                "(yes/no): " % (tenant.natural_key(),)
+            )
+            if confirm != 'yes':
+                raise CommandError('Restore cancelled.')
+
+        handler = CommandLoggingHandler(
+            self.stdout._out, self.stderr._out, int(options['verbosity'])
+        )
+        logger = logging.getLogger('tenancy')
+        logger.setLevel(handler.level)
+        logger.addHandler(handler)
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                restore_tenant(tenant, fileobj, using=options['database'])
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
@@ -0,0 +1,39 @@
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from ..snapshot import snapshot_tenant
+from .createtenant import CommandLoggingHandler
+from .createtenantsuperuser import TenantAction
+
+
+class Command(BaseCommand):
+    help = 'Write an archive of the tables of a tenant.'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument('path', help='Path of the archive to write.')
+        parser.add_argument(
+            'tenant', nargs='+', action=TenantAction,
+            help='Specifies the tenant to use by natural key.'
+        )
+        parser.add_argument(
+            '--database', dest='database', default=None,
+            help='Nominates a database to snapshot the tenant from.'
+        )
+
+    def handle(self, *args, **options):
+        handler = CommandLoggingHandler(
+            self.stdout._out, self.stderr._out, int(options['verbosity'])
+        )
+        logger = logging.getLogger('tenancy')
+        logger.setLevel(handler.level)
+        logger.addHandler(handler)
+        try:
+            with open(options['path'], 'wb') as fileobj:
+                snapshot_tenant(options['tenant'], fileobj, using=options['database'])
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
@@ -0,0 +1,110 @@
+from __future__ import unicode_literals
+
+import argparse
+import logging
+from functools import partial
+
+from django.core.management import call_command, get_commands
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import force_text
+from django.utils.module_loading import import_string
+from django.utils.six import StringIO
+
+from ... import get_tenant_model
+from ...parallel import TenantExecutionError, map_tenants
+from .createtenant import CommandLoggingHandler
+from .tenantmigrate import add_selection_arguments, get_selector
+
+
+def execute(target, arguments, tenant):
+    """
+    Run the `target` management command or call the callable it's the
+    dotted path of with `tenant` and return its output.
+    """
+    if '.' in target:
+        result = import_string(target)(tenant, *arguments)
+        return None if result is None else force_text(result)
+    output = StringIO()
+    call_command(target, *arguments, stdout=output, stderr=output)
+    return output.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a management command or calls a callable for each tenant while '
+        'it is exposed as the global tenant.'
+    )
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            'target', help='Name of the management command to run or dotted path of a callable '
+                           'to call with the tenant.'
+        )
+        parser.add_argument(
+            'arguments', nargs=argparse.REMAINDER,
+            help='Arguments passed to the management command or the callable.'
+        )
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=1,
+            help='Number of tenants processed concurrently.'
+        )
+        parser.add_argument(
+            '--mode', choices=('thread', 'process'), dest='mode', default='thread',
+            help='Whether tenants are processed concurrently by threads or processes.'
+        )
+        parser.add_argument(
+            '--database', dest='database', default=None,
+            help='Nominates a database to retrieve tenants from.'
+        )
+        add_selection_arguments(parser, 'process')
+
+    def progress(self, tenant, error, done, total):
+        logger = logging.getLogger('tenancy')
+        natural_key = tuple(tenant.natural_key())
+        if error is None:
+            logger.info("[%d/%d] Processed tenant %r." % (done, total, natural_key))
+        else:
+            logger.error("[%d/%d] Failed to process tenant %r: %s" % (done, total, natural_key, error))
+
+    def handle(self, *args, **options):
+        target = options['target']
+        if '.' in target:
+            try:
+                import_string(target)
+            except ImportError as e:
+                raise CommandError("Cannot import '%s': %s" % (target, e))
+        elif target not in get_commands():
+            raise CommandError("Unknown command: '%s'" % target)
+        queryset = get_tenant_model()._default_manager.using(options['database'])
+        tenants = list(queryset)
+        selector = get_selector(options)
+        if selector is not None:
+            tenants = selector.select(queryset, tenants)
+
+        handler = CommandLoggingHandler(
+            self.stdout._out, self.stderr._out, int(options['verbosity'])
+        )
+        logger = logging.getLogger('tenancy')
+        logger.setLevel(handler.level)
+        logger.addHandler(handler)
+        try:
+            function = partial(execute, target, list(options['arguments']))
+            try:
+                results = map_tenants(
+                    function, tenants, workers=options['workers'], mode=options['mode'],
+                    progress=self.progress,
+                )
+            except TenantExecutionError as e:
+                self.write_results(tenants, e.results)
+                raise CommandError("%d of %d tenant(s) failed." % (len(e.errors), len(tenants)))
+            self.write_results(tenants, results)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+
+    def write_results(self, tenants, results):
+        for tenant, result in zip(tenants, results):
+            if result:
+                self.stdout.write("%r:" % (tuple(tenant.natural_key()),))
+                self.stdout.write(result.rstrip('\n'))
@@ -0,0 +1,176 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import CommandError
+from django.core.management.commands.migrate import Command as MigrateCommand
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import AmbiguityError
+
+from ...rollout import TenantSelector, resume_tenant_migrations, select_tenants
+from ..plan import (
+    ROWS_PER_SECOND, TENANT_OVERHEAD, plan_tenant_migrations, project_duration,
+)
+
+
+def add_selection_arguments(parser, verb):
+    parser.add_argument(
+        '--tenant', nargs='+', action='append', dest='tenants', default=None,
+        help="Only %s the tenant specified by natural key, can be used multiple times." % verb
+    )
+    parser.add_argument(
+        '--tenant-filter', action='append', dest='tenant_filters', default=None,
+        help="Only %s the tenants matching a lookup=value filter, can be used multiple times." % verb
+    )
+    parser.add_argument(
+        '--shard', dest='shard', default=None,
+        help="Only %s the tenants of a shard specified as index/count, e.g. 0/4." % verb
+    )
+
+
+def get_selector(options):
+    """
+    Return the `TenantSelector` specified by the options added through
+    `add_selection_arguments` or `None`.
+    """
+    filters = {}
+    for tenant_filter in options['tenant_filters'] or ():
+        lookup, sep, value = tenant_filter.partition('=')
+        if not sep:
+            raise CommandError("Invalid tenant filter '%s', expected lookup=value." % tenant_filter)
+        filters[lookup] = value
+    shard = None
+    if options['shard']:
+        try:
+            index, count = (int(value) for value in options['shard'].split('/'))
+        except ValueError:
+            raise CommandError("Invalid shard '%s', expected index/count." % options['shard'])
+        if not 0 <= index < count:
+            raise CommandError("Invalid shard '%s', index must be lower than count." % options['shard'])
+        shard = (index, count)
+    if not (options['tenants'] or filters or shard):
+        return None
+    return TenantSelector(options['tenants'], filters, shard)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f TB" % size
+
+
+class Command(MigrateCommand):
+    help = (
+        'Updates database schema like migrate does, optionally on a subset of '
+        'the tenants, or reports the estimated cost of the tenant operations '
+        'to run with --plan.'
+    )
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--plan', action='store_true', dest='plan', default=False,
+            help='Report the tenant operations to run and their estimated cost instead of migrating.'
+        )
+        add_selection_arguments(parser, 'migrate')
+        parser.add_argument(
+            '--resume', action='store_true', dest='resume', default=False,
+            help='Migrate the tenants skipped by previous runs with tenant selection options.'
+        )
+        parser.add_argument(
+            '--concurrency', type=int, dest='concurrency', default=None,
+            help='Number of tenants migrated concurrently used to project durations. '
+                 'Defaults to TENANCY_MIGRATION_CONCURRENCY.'
+        )
+        parser.add_argument(
+            '--rows-per-second', type=float, dest='rows_per_second', default=ROWS_PER_SECOND,
+            help='Number of rows copied per second by operations rewriting tables.'
+        )
+        parser.add_argument(
+            '--tenant-overhead', type=float, dest='tenant_overhead', default=TENANT_OVERHEAD,
+            help='Number of seconds required to run an operation against an empty tenant.'
+        )
+
+    def get_targets(self, executor, app_label, migration_name):
+        loader = executor.loader
+        if app_label is None:
+            return loader.graph.leaf_nodes()
+        if app_label not in loader.migrated_apps:
+            raise CommandError("App '%s' does not have migrations." % app_label)
+        if migration_name is None:
+            return [key for key in loader.graph.leaf_nodes() if key[0] == app_label]
+        if migration_name == 'zero':
+            return [(app_label, None)]
+        try:
+            migration = loader.get_migration_by_prefix(app_label, migration_name)
+        except AmbiguityError:
+            raise CommandError(
+                "More than one migration matches '%s' in app '%s'. Please be more specific." % (
+                    migration_name, app_label
+                )
+            )
+        except KeyError:
+            raise CommandError(
+                "Cannot find a migration matching '%s' from app '%s'." % (migration_name, app_label)
+            )
+        return [(app_label, migration.name)]
+
+    def handle(self, *args, **options):
+        selector = get_selector(options)
+        if options['resume']:
+            return self.resume(selector, **options)
+        if not options['plan']:
+            if selector is None:
+                return super(Command, self).handle(*args, **options)
+            with select_tenants(selector):
+                return super(Command, self).handle(*args, **options)
+        return self.plan(**options)
+
+    def resume(self, selector, **options):
+        resumed = resume_tenant_migrations(connections[options['database']], selector)
+        if int(options['verbosity']) >= 1:
+            if not resumed:
+                self.stdout.write('No tenant migrations to resume.')
+            for app_label, name in resumed:
+                self.stdout.write("Resumed %s.%s" % (app_label, name))
+
+    def plan(self, **options):
+        from ...settings import MIGRATION_CONCURRENCY
+        verbosity = int(options['verbosity'])
+        concurrency = options['concurrency'] or MIGRATION_CONCURRENCY
+        executor = MigrationExecutor(connections[options['database']])
+        targets = self.get_targets(executor, options['app_label'], options['migration_name'])
+        plans = plan_tenant_migrations(
+            executor, targets, options['rows_per_second'], options['tenant_overhead']
+        )
+        if not plans:
+            self.stdout.write('No tenant operations to perform.')
+            return
+        total = 0
+        migration = None
+        for plan in plans:
+            if plan.migration is not migration:
+                migration = plan.migration
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    "%s %s.%s:" % ('Unapply' if plan.backwards else 'Apply', migration.app_label, migration.name)
+                ))
+            durations = plan.get_durations()
+            duration = project_duration(durations, concurrency)
+            total += duration
+            description = plan.operation.describe()
+            if plan.table:
+                description += " on %s" % plan.table
+            if plan.rewrites_table:
+                description += ' (may rewrite the table)'
+            self.stdout.write("  %s" % description)
+            details = "%d tenant(s), %d row(s)" % (len(plan.tenants), plan.rows)
+            if plan.size is not None:
+                details += ", %s" % format_size(plan.size)
+            self.stdout.write("    %s, estimated %.1fs" % (details, duration))
+            if verbosity >= 2:
+                for (tenant, rows, _size), tenant_duration in zip(plan.tenants, durations):
+                    self.stdout.write("    %s: %d row(s), estimated %.2fs" % (
+                        tenant.db_schema, rows, tenant_duration
+                    ))
+        self.stdout.write("Estimated duration: %.1fs with a concurrency of %d." % (total, concurrency))
@@ -0,0 +1,176 @@
+from __future__ import unicode_literals
+
+import heapq
+
+from django.db.backends.utils import truncate_name
+from django.db.migrations import operations
+
+from .. import get_tenant_model
+from ..models import db_schema_table
+from ..operations import OnlineAddField, TenantOperation
+from ..versions import TenantSchemaVersions
+
+# Default assumptions used to turn table statistics into durations.
+ROWS_PER_SECOND = 100000
+TENANT_OVERHEAD = 0.05
+
+
+class TenantOperationPlan(object):
+    """
+    Estimated cost of applying or unapplying a tenant operation to each
+    tenant. The `tenants` attribute is a list of `(tenant, rows, size)`
+    tuples where `size` is `None` when it can't be determined.
+    """
+
+    def __init__(self, migration, operation, backwards, table, tenants, rewrites_table=False,
+                 rows_per_second=ROWS_PER_SECOND, tenant_overhead=TENANT_OVERHEAD):
+        self.migration = migration
+        self.operation = operation
+        self.backwards = backwards
+        self.table = table
+        self.tenants = tenants
+        self.rewrites_table = rewrites_table
+        self.rows_per_second = rows_per_second
+        self.tenant_overhead = tenant_overhead
+
+    @property
+    def rows(self):
+        return sum(rows for _tenant, rows, _size in self.tenants)
+
+    @property
+    def size(self):
+        sizes = [size for _tenant, _rows, size in self.tenants if size is not None]
+        return sum(sizes) if sizes else None
+
+    def get_durations(self):
+        """
+        Return the estimated number of seconds required to migrate each tenant.
+        """
+        return [
+            self.tenant_overhead + (rows / float(self.rows_per_second) if self.rewrites_table else 0)
+            for _tenant, rows, _size in self.tenants
+        ]
+
+
+def rewrites_table(operation, connection, backwards=False):
+    """
+    Return whether or not `operation` might have to rewrite the table it
+    alters, and hold an exclusive lock on it, for its whole duration.
+    """
+    if isinstance(operation, operations.AlterField):
+        return True
+    if connection.vendor == 'sqlite':
+        # Columns are altered by copying the table.
+        return isinstance(operation, (operations.AddField, operations.RemoveField, operations.RenameField))
+    if isinstance(operation, OnlineAddField):
+        # Columns are added as nullable and backfilled in batches.
+        return False
+    if isinstance(operation, operations.AddField) and not backwards:
+        field = operation.field
+        return not field.null and field.has_default()
+    return False
+
+
+def get_operation_table(operation, app_label, state, connection, backwards=False):
+    """
+    Return the name of the table altered by `operation` in `state` or `None`
+    if it doesn't alter a table.
+    """
+    model_name = getattr(operation, 'model_name_lower', None)
+    if model_name is None:
+        if isinstance(operation, operations.RenameModel):
+            model_name = operation.new_name_lower if backwards else operation.old_name_lower
+        else:
+            model_name = getattr(operation, 'name_lower', None)
+    model_state = state.models.get((app_label, model_name)) if model_name else None
+    if model_state is None:
+        return None
+    db_table = model_state.options.get('db_table')
+    if not db_table:
+        db_table = truncate_name("%s_%s" % (app_label, model_name), connection.ops.max_name_length())
+    return db_table
+
+
+def get_table_statistics(connection, tenants, table):
+    """
+    Return a list of `(tenant, rows, size)` tuples for the table of each
+    tenant. PostgreSQL planner statistics are used when available and rows
+    are counted otherwise.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT n.nspname, c.reltuples, pg_total_relation_size(c.oid) "
+                "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE c.relkind = 'r' AND c.relname = %s AND n.nspname = ANY(%s)",
+                [table, [tenant.db_schema for tenant in tenants]]
+            )
+            statistics = dict((schema, (int(max(rows, 0)), size)) for schema, rows, size in cursor.fetchall())
+        return [(tenant,) + statistics.get(tenant.db_schema, (0, 0)) for tenant in tenants]
+    quote_name = connection.ops.quote_name
+    table_names = set(connection.introspection.table_names())
+    statistics = []
+    with connection.cursor() as cursor:
+        for tenant in tenants:
+            tenant_table = db_schema_table(tenant, table)
+            rows = 0
+            if tenant_table in table_names:
+                cursor.execute("SELECT COUNT(*) FROM %s" % quote_name(tenant_table))
+                rows = cursor.fetchone()[0]
+            statistics.append((tenant, rows, None))
+    return statistics
+
+
+def plan_tenant_migrations(executor, targets, rows_per_second=ROWS_PER_SECOND,
+                           tenant_overhead=TENANT_OVERHEAD):
+    """
+    Return a list of `TenantOperationPlan` for the tenant operations that
+    would be run by migrating to `targets`.
+    """
+    from ..settings import SCHEMA_VERSIONS
+    connection = executor.connection
+    loader = executor.loader
+    all_tenants = list(get_tenant_model()._base_manager.all())
+    versions = TenantSchemaVersions(connection) if SCHEMA_VERSIONS else None
+    plans = []
+    for migration, backwards in executor.migration_plan(targets):
+        key = (migration.app_label, migration.name)
+        tenants = all_tenants
+        if versions is not None and not backwards:
+            # Tenants created after the migration are skipped.
+            current = versions.get_current_tenants(loader.graph, key)
+            tenants = [tenant for tenant in all_tenants if tenant.db_schema not in current]
+        # Like the executor, tables are looked up in the state they're in
+        # before the operation is applied or after it when it's unapplied.
+        operation_states = []
+        state = loader.project_state(key, at_end=False)
+        for operation in migration.operations:
+            new_state = state.clone()
+            operation.state_forwards(migration.app_label, new_state)
+            operation_states.append((operation, new_state if backwards else state))
+            state = new_state
+        if backwards:
+            operation_states.reverse()
+        for operation, state in operation_states:
+            if isinstance(operation, TenantOperation) and tenants:
+                table = get_operation_table(operation, migration.app_label, state, connection, backwards)
+                if table is None:
+                    statistics = [(tenant, 0, None) for tenant in tenants]
+                else:
+                    statistics = get_table_statistics(connection, tenants, table)
+                plans.append(TenantOperationPlan(
+                    migration, operation, backwards, table, statistics,
+                    rewrites_table(operation, connection, backwards), rows_per_second, tenant_overhead,
+                ))
+    return plans
+
+
+def project_duration(durations, concurrency=1):
+    """
+    Return the wall-clock time required to process tasks of the specified
+    `durations` on `concurrency` workers pulling tasks from a shared queue.
+    """
+    workers = [0] * max(concurrency, 1)
+    for duration in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + duration)
+    return max(workers)
@@ -0,0 +1,228 @@
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import decimal
+import io
+import json
+import logging
+import tarfile
+import tempfile
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.utils import six
+
+from . import create_tenant_schema, delete_tenant_tables
+from ..compat import get_remote_field
+from ..utils import uses_attached_databases
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = 'manifest.json'
+
+# Number of rows fetched or inserted at once when COPY is not available.
+ROWS_BATCH_SIZE = 500
+
+binary_types = (six.binary_type, memoryview, getattr(six.moves.builtins, 'buffer', memoryview))
+
+
+def get_snapshot_models(tenant, connection):
+    """
+    Return a mapping of labels to the tenant models stored in snapshots.
+    """
+    models = {}
+    for model in tenant.models:
+        opts = model._meta
+        if not opts.managed or opts.proxy:
+            continue
+        if not router.allow_migrate(connection.alias, model):
+            continue
+        for_tenant_opts = model._for_tenant_model._meta
+        models["%s.%s" % (for_tenant_opts.app_label, for_tenant_opts.model_name)] = model
+    return models
+
+
+def get_columns(model):
+    return [field.column for field in model._meta.local_concrete_fields]
+
+
+def _add_member(archive, name, fileobj):
+    fileobj.seek(0, io.SEEK_END)
+    info = tarfile.TarInfo(name)
+    info.size = fileobj.tell()
+    fileobj.seek(0)
+    archive.addfile(info, fileobj)
+
+
+def _encode_value(value):
+    if isinstance(value, binary_types):
+        return {'base64': base64.b64encode(bytes(value)).decode('ascii')}
+    elif isinstance(value, (datetime.date, datetime.time, decimal.Decimal)):
+        return six.text_type(value)
+    return value
+
+
+def _decode_value(connection, value):
+    if isinstance(value, dict):
+        return connection.Database.Binary(base64.b64decode(value['base64']))
+    return value
+
+
+def dump_table(connection, cursor, model, data):
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ', '.join(quote_name(column) for column in get_columns(model))
+    if connection.vendor == 'postgresql':
+        cursor.copy_expert("COPY %s (%s) TO STDOUT" % (table, columns), data)
+        return
+    cursor.execute("SELECT %s FROM %s" % (columns, table))
+    while True:
+        rows = cursor.fetchmany(ROWS_BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            data.write(json.dumps([_encode_value(value) for value in row]).encode('utf-8'))
+            data.write(b'\n')
+
+
+def load_table(connection, cursor, model, data):
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = get_columns(model)
+    quoted_columns = ', '.join(quote_name(column) for column in columns)
+    if connection.vendor == 'postgresql':
+        cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table, quoted_columns), data)
+        return
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (table, quoted_columns, ', '.join(['%s'] * len(columns)))
+    rows = []
+    for line in data:
+        rows.append([_decode_value(connection, value) for value in json.loads(line.decode('utf-8'))])
+        if len(rows) == ROWS_BATCH_SIZE:
+            cursor.executemany(sql, rows)
+            rows = []
+    if rows:
+        cursor.executemany(sql, rows)
+
+
+def snapshot_tenant(tenant, fileobj, using=None):
+    """
+    Write a gzipped tar archive of the tables of a tenant to `fileobj`.
+
+    Tables are streamed with COPY on PostgreSQL and row by row elsewhere.
+    """
+    logger = logging.getLogger('tenancy.management.snapshot_tenant')
+    using = using or router.db_for_read(tenant.__class__, instance=tenant)
+    connection = connections[using]
+    models = get_snapshot_models(tenant, connection)
+    content_types = ContentType.objects.db_manager(using)
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'vendor': connection.vendor,
+        'tables': [
+            {'model': label, 'columns': get_columns(model)} for label, model in sorted(models.items())
+        ],
+        'content_types': dict(
+            (content_types.get_for_model(model, for_concrete_model=False).pk, label)
+            for label, model in models.items()
+        ),
+    }
+    repeatable_read = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with tarfile.open(fileobj=fileobj, mode='w:gz') as archive:
+        _add_member(archive, MANIFEST_NAME, io.BytesIO(json.dumps(manifest).encode('utf-8')))
+        # Dump all tables from the same snapshot of the database.
+        with transaction.atomic(using), connection.cursor() as cursor:
+            if repeatable_read:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            for table in manifest['tables']:
+                model = models[table['model']]
+                logger.info("Dumping table %s ..." % model._meta.db_table)
+                with tempfile.TemporaryFile() as data:
+                    dump_table(connection, cursor, model, data)
+                    _add_member(archive, "tables/%s" % table['model'], data)
+
+
+def restore_tenant(tenant, fileobj, using=None):
+    """
+    Replace the schema of a tenant by the one of an archive written by
+    `snapshot_tenant`. The tables are re-created and loaded before their
+    indexes and constraints are created. The schema of the tenant is left
+    untouched if the archive fails to be loaded.
+
+    Only the tables are dropped, the content types of the tenant models and
+    the objects referencing them such as permissions are preserved.
+    """
+    logger = logging.getLogger('tenancy.management.restore_tenant')
+    tenant_class = tenant.__class__
+    using = using or router.db_for_write(tenant_class, instance=tenant)
+    connection = connections[using]
+    archive = tarfile.open(fileobj=fileobj, mode='r:*')
+    manifest = json.loads(archive.extractfile(MANIFEST_NAME).read().decode('utf-8'))
+    if manifest['format'] != SNAPSHOT_FORMAT:
+        raise ValueError("Unsupported snapshot format %r." % manifest['format'])
+    if manifest['vendor'] != connection.vendor:
+        raise ValueError(
+            "Snapshots taken on %s can't be restored on %s." % (manifest['vendor'], connection.vendor)
+        )
+    models = get_snapshot_models(tenant, connection)
+    for table in manifest['tables']:
+        model = models.get(table['model'])
+        if model is None or get_columns(model) != table['columns']:
+            raise ValueError(
+                "The %s table of the snapshot doesn't match the current state of "
+                "the tenant models." % table['model']
+            )
+
+    def populate(tenant, connection):
+        with connection.cursor() as cursor:
+            for table in manifest['tables']:
+                model = models[table['model']]
+                logger.info("Loading table %s ..." % model._meta.db_table)
+                load_table(connection, cursor, model, archive.extractfile("tables/%s" % table['model']))
+            remap_content_types(connection, cursor, models, manifest['content_types'])
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(models.values())):
+                cursor.execute(sql)
+
+    if uses_attached_databases(connection):
+        # Databases can't be swapped in a transaction, the archive is loaded
+        # in a temporary database that replaces the tenant's one once loaded.
+        with connection.replacing_tenant_database(tenant.db_schema):
+            create_tenant_schema(tenant, using=using, populate=populate)
+        return
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("DROP SCHEMA %s CASCADE" % connection.ops.quote_name(tenant.db_schema))
+        else:
+            delete_tenant_tables(tenant, connection)
+        create_tenant_schema(tenant, using=using, populate=populate)
+
+
+def remap_content_types(connection, cursor, models, content_types):
+    """
+    Point the foreign keys to the content types of the tenant models of the
+    snapshot to the ones of the restored tenant.
+    """
+    manager = ContentType.objects.db_manager(connection.alias)
+    mapping = {}
+    for pk, label in content_types.items():
+        content_type = manager.get_for_model(models[label], for_concrete_model=False)
+        if int(pk) != content_type.pk:
+            mapping[int(pk)] = content_type.pk
+    if not mapping:
+        return
+    quote_name = connection.ops.quote_name
+    when = ' '.join(['WHEN %s THEN %s'] * len(mapping))
+    params = [value for item in mapping.items() for value in item]
+    for model in models.values():
+        for field in model._meta.local_concrete_fields:
+            remote_field = get_remote_field(field)
+            if remote_field is None or remote_field.model is not ContentType:
+                continue
+            column = quote_name(field.column)
+            cursor.execute(
+                "UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)" % (
+                    quote_name(model._meta.db_table), column, column, when, column,
+                    ', '.join(['%s'] * len(mapping))
+                ), params + list(mapping)
+            )
@@ -1,12 +1,18 @@
 from __future__ import unicode_literals
 
+import math
+
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.db import DEFAULT_DB_ALIAS, connections
-from django.http import Http404
+from django.http import Http404, HttpResponse
 
 from . import get_tenant_model
+from .instrumentation import (
+    activate_instrumentation, deactivate_instrumentation,
+)
 from .settings import HOST_NAME
+from .throttling import TenantOverBudget, get_usage_tracker
 
 try:
     from django.utils.deprecation import MiddlewareMixin
@@ -71,21 +77,88 @@ class GlobalTenantMiddleware(MiddlewareMixin):
         return connections[DEFAULT_DB_ALIAS]
 
     def pollute_global_state(self, tenant):
-        setattr(self.get_global_state(), self.attr_name, tenant)
+        global_state = self.get_global_state()
+        setattr(global_state, self.attr_name, tenant)
+        if tenant is not None:
+            global_state.tenancy_previous_instrumentation = activate_instrumentation(global_state, tenant)
 
     def clean_global_state(self):
         global_state = self.get_global_state()
         if hasattr(global_state, self.attr_name):
             delattr(global_state, self.attr_name)
+        global_state.tenancy_view_name = None
+        if hasattr(global_state, 'tenancy_previous_instrumentation'):
+            deactivate_instrumentation(global_state, global_state.tenancy_previous_instrumentation)
+            del global_state.tenancy_previous_instrumentation
 
     def process_request(self, request):
         self.pollute_global_state(
             getattr(request, self.attr_name, None)
         )
 
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Exposed for the queries to mention it in their SQL comments.
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            self.get_global_state().tenancy_view_name = resolver_match.view_name
+
     def process_response(self, request, response):
         self.clean_global_state()
         return response
 
     def process_exception(self, request, exception):
         self.clean_global_state()
+
+
+class TenantProvisioningMiddleware(MiddlewareMixin):
+    """
+    Middleware that prevents requests from accessing a tenant which schema is
+    not provisioned yet. Such requests are answered with a 503 asking clients
+    to retry after `TENANCY_PROVISIONING_RETRY_AFTER` seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TenantProvisioningMiddleware, self).__init__(*args, **kwargs)
+        self.attr_name = get_tenant_model().ATTR_NAME
+
+    def process_request(self, request):
+        tenant = getattr(request, self.attr_name, None)
+        if tenant is None or tenant.is_provisioned(refresh=True):
+            return
+        from .settings import PROVISIONING_RETRY_AFTER
+        response = HttpResponse('Tenant is being provisioned.', status=503)
+        response['Retry-After'] = PROVISIONING_RETRY_AFTER
+        return response
+
+
+class TenantThrottlingMiddleware(MiddlewareMixin):
+    """
+    Middleware that holds requests of tenants exceeding their query budget
+    for up to `QueryBudget.wait` seconds before answering them with a 503.
+    Requests exceeding it while being processed are answered the same way.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TenantThrottlingMiddleware, self).__init__(*args, **kwargs)
+        self.attr_name = get_tenant_model().ATTR_NAME
+
+    def throttled_response(self, exception):
+        response = HttpResponse('Tenant is over its query budget.', status=503)
+        response['Retry-After'] = max(int(math.ceil(exception.retry_after)), 1)
+        return response
+
+    def process_request(self, request):
+        tenant = getattr(request, self.attr_name, None)
+        if tenant is None:
+            return
+        budget = tenant.get_query_budget()
+        if budget is None:
+            return
+        try:
+            get_usage_tracker().admit(tenant.db_schema, budget)
+        except TenantOverBudget as exception:
+            return self.throttled_response(exception)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, TenantOverBudget):
+            return self.throttled_response(exception)
@@ -23,14 +23,19 @@ from .compat import (
     get_private_fields, get_remote_field, get_remote_field_model,
     lazy_related_operation, set_remote_field_model,
 )
-from .management import create_tenant_schema, drop_tenant_schema
+from .instrumentation import instrument_tenant
+from .management import (
+    create_tenant_schema, drop_tenant_schema, request_tenant_provisioning,
+)
 from .managers import (
     AbstractTenantManager, TenantManager, TenantModelManagerDescriptor,
 )
 from .signals import lazy_class_prepared
+from .throttling import QueryBudget
 from .utils import (
     clear_cached_properties, clear_opts_related_cache, disconnect_signals,
     get_model, receivers_for_model, remove_from_app_cache,
+    uses_attached_databases,
 )
 
 
@@ -88,6 +93,9 @@ class TenantModelsDescriptor(object):
                 return
         for model in models:
             model.destroy()
+        # Make sure destroyed models are not reused if the tenant's schema
+        # is created again.
+        instance.__dict__.pop(self.name, None)
 
 
 class AbstractTenant(models.Model):
@@ -102,9 +110,38 @@ class AbstractTenant(models.Model):
         created = not self.pk
         save = super(AbstractTenant, self).save(*args, **kwargs)
         if created:
-            create_tenant_schema(self)
+            self.provision()
         return save
 
+    def provision(self):
+        """
+        Provision the tenant's schema upon creation.
+        """
+        create_tenant_schema(self)
+
+    def is_provisioned(self, refresh=False):
+        """
+        Return whether or not the tenant's schema is ready to be used.
+        """
+        return True
+
+    def get_query_budget(self):
+        """
+        Return the `QueryBudget` the queries of this tenant are subject to or
+        `None`. Override to define per tenant budgets.
+        """
+        if settings.QUERY_BUDGET is None:
+            return None
+        return QueryBudget(**settings.QUERY_BUDGET)
+
+    def get_session_settings(self):
+        """
+        Return a dict of PostgreSQL settings, such as `work_mem` or
+        `statement_timeout`, to apply to the sessions of connections while
+        this tenant is active on them.
+        """
+        return {}
+
     def delete(self, *args, **kwargs):
         delete = super(AbstractTenant, self).delete(*args, **kwargs)
         drop_tenant_schema(self)
@@ -123,7 +160,8 @@ class AbstractTenant(models.Model):
         """
         setattr(connection, self.ATTR_NAME, self)
         try:
-            yield
+            with instrument_tenant(connection, self):
+                yield
         finally:
             delattr(connection, self.ATTR_NAME)
 
@@ -140,6 +178,62 @@ class AbstractTenant(models.Model):
         return "tenant_%s" % '_'.join(self.natural_key())
 
 
+class TenantNotProvisioned(Exception):
+    pass
+
+
+class AbstractProvisionedTenant(AbstractTenant):
+    """
+    Tenant keeping track of its schema provisioning state.
+
+    When the `TENANCY_ASYNC_PROVISIONING` setting is enabled the creation of
+    the schema is deferred to a background worker (see the `provisiontenants`
+    management command and the `provisioning_requested` signal) instead of
+    being performed on `save()`. Tenants which provisioning was claimed more
+    than `TENANCY_PROVISIONING_STALE_TIMEOUT` seconds ago by a worker that
+    didn't complete it can be claimed again by other workers.
+    """
+    PROVISIONING_PENDING = 'pending'
+    PROVISIONING_IN_PROGRESS = 'provisioning'
+    PROVISIONING_READY = 'ready'
+    PROVISIONING_FAILED = 'failed'
+    PROVISIONING_STATES = (
+        (PROVISIONING_PENDING, 'Pending'),
+        (PROVISIONING_IN_PROGRESS, 'Provisioning'),
+        (PROVISIONING_READY, 'Ready'),
+        (PROVISIONING_FAILED, 'Failed'),
+    )
+
+    provisioning_state = models.CharField(
+        max_length=12, choices=PROVISIONING_STATES, default=PROVISIONING_READY,
+        db_index=True, editable=False
+    )
+    # When the schema provisioning was claimed by a worker.
+    provisioning_started_at = models.DateTimeField(null=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self.pk and settings.ASYNC_PROVISIONING:
+            self.provisioning_state = self.PROVISIONING_PENDING
+        return super(AbstractProvisionedTenant, self).save(*args, **kwargs)
+
+    def provision(self):
+        if self.provisioning_state == self.PROVISIONING_PENDING:
+            request_tenant_provisioning(self)
+        else:
+            super(AbstractProvisionedTenant, self).provision()
+
+    def is_provisioned(self, refresh=False):
+        if refresh and self.provisioning_state != self.PROVISIONING_READY:
+            # Bypass the default manager as it might return a cached instance.
+            self.provisioning_state = self.__class__._base_manager.filter(
+                pk=self.pk
+            ).values_list('provisioning_state', flat=True).get()
+        return self.provisioning_state == self.PROVISIONING_READY
+
+
 class Tenant(AbstractTenant):
     name = models.CharField(unique=True, max_length=20)
 
@@ -183,7 +277,7 @@ def meta(Meta=None, **opts):
 
 
 def db_schema_table(tenant, db_table):
-    if connection.vendor == 'postgresql':
+    if connection.vendor == 'postgresql' or uses_attached_databases(connection):
         # See https://code.djangoproject.com/ticket/6148#comment:47
         return '%s\".\"%s' % (tenant.db_schema, db_table)
     else:
@@ -240,6 +334,7 @@ class TenantApps(object):
     def __init__(self, tenant, apps):
         self.apps = apps
         self.natural_key = tenant.natural_key()
+        self.db_schema = tenant.db_schema
 
     def get_models(self, *args, **kwargs):
         models = self.apps.get_models(*args, **kwargs)
@@ -573,9 +668,18 @@ class TenantModelBase(ModelBase):
         if model:
             return model
 
-        meta_attrs = {
+        if settings.UNQUALIFIED_TABLES and connection.vendor == 'postgresql':
+            if not hasattr(connection, 'set_tenant_schema'):
+                raise ImproperlyConfigured(
+                    'TENANCY_UNQUALIFIED_TABLES requires the tenancy.backends.postgresql backend.'
+                )
+            # Tables are resolved through the search path.
+            db_table = self._meta.db_table
+        else:
             # TODO: Use `db_schema` once django #6148 is fixed.
-            'db_table': db_schema_table(tenant, self._meta.db_table),
+            db_table = db_schema_table(tenant, self._meta.db_table)
+        meta_attrs = {
+            'db_table': db_table,
             'apps': TenantApps(tenant, getattr(reference.Meta, 'apps', apps)),
         }
 
@@ -667,6 +771,10 @@ class TenantModelDescriptor(object):
     def __get__(self, tenant, owner):
         if not tenant:
             return self
+        if not tenant.is_provisioned(refresh=True):
+            raise TenantNotProvisioned(
+                "The schema of tenant %r is not provisioned yet." % (tenant.natural_key(),)
+            )
         return tenant.models[self.model]._default_manager
 
 
@@ -16,6 +16,7 @@ from .. import get_tenant_model
 from ..compat import (
     get_remote_field, get_remote_field_model, set_remote_field_model,
 )
+from ..management import clear_schema_ddl_cache
 from ..models import (
     Reference, TenantApps, TenantModel, TenantModelBase, TenantSpecificModel,
     db_schema_table,
@@ -183,9 +184,15 @@ def unmanage_mutable_models(tenant, **kwargs):
     """
     Cleanup after our `manage_mutable_models` alteration.
     """
+    mutable = False
     for model in tenant.models:
         if issubclass(model, MutableModel):
             model._meta.managed = False
+            mutable = True
+    # Mutable models definition can be altered at any time so their DDL can't
+    # be cached.
+    if mutable:
+        clear_schema_ddl_cache()
 
 
 @receiver(pre_schema_deletion)
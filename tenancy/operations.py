@@ -1,33 +1,106 @@
 from __future__ import unicode_literals
 
+import copy
+import logging
+import time
 from contextlib import contextmanager
 from functools import partial
 
+import django
 from django.apps import apps
-from django.db.backends.utils import truncate_name
+from django.db import (
+    DatabaseError, NotSupportedError, connections, transaction,
+)
 from django.db.migrations import operations
 from django.db.migrations.operations.base import Operation
+from django.db.models import NOT_PROVIDED
 from django.utils import six
 from django.utils.six import iteritems
 
+from .batching import BATCH_SIZE, iterate_keyset
+from .instrumentation import instrument_tenant
+from .journal import MigrationJournal, get_running_migration
+from .management import clear_schema_ddl_cache
 from .models import Managed, db_schema_table
-from .utils import patch_connection_introspection
+from .parallel import run_for_tenants
+from .rollout import get_tenant_selection
+from .utils import (
+    ConstraintsCatalog, patch_connection_introspection,
+    uses_attached_databases,
+)
+from .versions import TenantSchemaVersions, get_migration_graph
+
+logger = logging.getLogger('tenancy.operations')
+
+
+@contextmanager
+def patch_schema_editor_execute(schema_editor, callback):
+    """
+    Call `callback(sql, params)` before each statement `schema_editor`
+    executes.
+    """
+    patched = 'execute' in schema_editor.__dict__
+    execute = schema_editor.execute
+
+    def wrapper(sql, params=()):
+        callback(sql, params)
+        return execute(sql, params)
+    schema_editor.execute = wrapper
+    try:
+        yield
+    finally:
+        if patched:
+            schema_editor.execute = execute
+        else:
+            del schema_editor.execute
 
 
 class TenantOperation(Operation):
+    # Whether or not the SQL executed by the operation only depends on the
+    # migration states and can be reused for all tenants.
+    reusable_sql = False
+    # Overrides TENANCY_MIGRATION_CONCURRENCY when specified.
+    concurrency = None
+    # Whether or not tenants migrated concurrently are migrated in their own
+    # transaction.
+    tenant_atomic = True
+
+    def __init__(self, *args, **kwargs):
+        # Number of tenants to migrate in each transaction.
+        self.chunk_size = kwargs.pop('chunk_size', None)
+        super(TenantOperation, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super(TenantOperation, self).deconstruct()
+        if self.chunk_size:
+            kwargs['chunk_size'] = self.chunk_size
+        return name, args, kwargs
+
     def get_tenant_model(self, app_label, from_state, to_state):
         raise NotImplementedError
 
     @contextmanager
-    def tenant_context(self, tenant, schema_editor):
+    def tenant_context(self, tenant, schema_editor, catalog=None):
         connection = schema_editor.connection
         cursor = connection.cursor()
         db_schema = tenant.db_schema
+        # Pooling backends keep track of the schema their connections point to.
+        set_tenant_schema = getattr(connection, 'set_tenant_schema', None)
         if connection.vendor == 'postgresql':
             sql = "SET search_path = %s, public" % schema_editor.connection.ops.quote_name(tenant.db_schema)
-            cursor.execute(sql)
+            if set_tenant_schema is None:
+                cursor.execute(sql)
+            else:
+                set_tenant_schema(db_schema)
             schema_editor.deferred_sql.append(sql)
-        with patch_connection_introspection(connection, db_schema):
+
+        def invalidate_catalog(sql, params):
+            # The cached constraints are stale once the schema is altered.
+            if catalog is not None:
+                catalog.invalidate(db_schema)
+        with patch_connection_introspection(connection, db_schema, catalog), \
+                patch_schema_editor_execute(schema_editor, invalidate_catalog), \
+                instrument_tenant(connection, tenant):
             setattr(schema_editor, 'tenant', tenant)
             try:
                 yield
@@ -35,55 +108,307 @@ class TenantOperation(Operation):
                 delattr(schema_editor, 'tenant')
         if connection.vendor == 'postgresql':
             sql = 'RESET search_path'
-            cursor.execute(sql)
+            if set_tenant_schema is None:
+                cursor.execute(sql)
+            else:
+                set_tenant_schema(None)
             schema_editor.deferred_sql.append(sql)
 
-    def _create_managed_state(self, tenant_model, connection, state):
+    def _get_managed_models(self, tenant_model, *states):
+        """
+        Return a mapping of the options of the models managed by `tenant_model`
+        rendered by `states` to their original `managed` and `db_table`.
+        """
         managed = Managed("%s.%s" % (tenant_model._meta.app_label, tenant_model._meta.object_name))
-        state.__dict__.pop('apps', None)
-        project_state = state.clone()
-        managed_models = []
-        for model_key, model_state in iteritems(project_state.models):
-            options = model_state.options
-            if options.get('managed') == managed:
-                db_table = options.get('db_table')
-                if not db_table:
-                    db_table = truncate_name("%s_%s" % model_key, connection.ops.max_name_length())
-                options.update(
-                    managed=True,
-                    db_table=db_table,
-                )
-                managed_models.append(model_key)
-        return project_state, managed_models
-
-    def _create_tenant_state(self, tenant, connection, state, managed_models):
-        if not managed_models or connection.vendor == 'postgresql':
-            return state
-        project_state = state.clone()
-        for model_key in managed_models:
-            model_state = project_state.models[model_key]
-            model_state.options['db_table'] = db_schema_table(tenant, model_state.options['db_table'])
-        return project_state
-
-    def tenant_operation(self, tenant_model, operation, app_label, schema_editor, from_state, to_state):
+        managed_models = {}
+        for state in states:
+            for model in state.apps.get_models(include_auto_created=True):
+                opts = model._meta
+                # Unaltered models are shared between states.
+                if opts not in managed_models and opts.managed == managed:
+                    managed_models[opts] = (opts.managed, opts.db_table)
+        return managed_models
+
+    @contextmanager
+    def _manage_models(self, managed_models):
+        """
+        Temporarily mark the tenant managed models as managed to allow schema
+        operations to be performed against them.
+        """
+        for opts in managed_models:
+            opts.managed = True
+        try:
+            yield
+        finally:
+            for opts, (managed, _db_table) in iteritems(managed_models):
+                opts.managed = managed
+
+    @contextmanager
+    def _tenant_models(self, tenant, connection, managed_models):
+        """
+        Temporarily point the tenant managed models to the tables of `tenant`.
+
+        The rendered models are altered in place instead of rendering a copy
+        of the project state for each tenant.
+        """
+        if connection.vendor == 'postgresql':
+            # Tables are resolved through the search path.
+            yield
+            return
+
+        def set_db_table(opts, db_table):
+            opts.db_table = db_table
+            # Query columns of fields are cached with the table name.
+            for field in opts.local_fields:
+                field.__dict__.pop('cached_col', None)
+        for opts, (_managed, db_table) in iteritems(managed_models):
+            set_db_table(opts, db_schema_table(tenant, db_table))
+        try:
+            yield
+        finally:
+            for opts, (_managed, db_table) in iteritems(managed_models):
+                set_db_table(opts, db_table)
+
+    def _select_tenants(self, journal, queryset, tenants, selector, resume):
+        """
+        Return the tenants to migrate according to the selection made through
+        `select_tenants` and record the other ones as skipped.
+
+        Tenants lagging behind because of previous selections keep being
+        skipped until they are resumed.
+        """
+        if resume:
+            skipped = journal.get_skipped_tenants()
+            tenants = [tenant for tenant in tenants if tenant.db_schema in skipped]
+        elif journal.direction == journal.FORWARDS:
+            tenants = self._exclude_lagging_tenants(journal, tenants)
+        if selector is None:
+            return tenants
+        selected = selector.select(queryset, tenants)
+        if not resume:
+            for tenant in tenants:
+                if tenant not in selected:
+                    journal.record(tenant, journal.SKIPPED)
+        return selected
+
+    def _exclude_lagging_tenants(self, journal, tenants):
+        """
+        Return `tenants` without the ones left out of the previous operations
+        by staged rollouts and record them as skipped.
+
+        Their schemas don't reflect the state the operation expects until the
+        previous operations are resumed.
+        """
+        lagging = journal.get_lagging_tenants()
+        for tenant in tenants:
+            if tenant.db_schema in lagging:
+                logger.info("Skipping tenant %s left out of previous operations." % tenant.db_schema)
+                journal.record(tenant, journal.SKIPPED)
+        return [tenant for tenant in tenants if tenant.db_schema not in lagging]
+
+    def _exclude_current_tenants(self, app_label, connection, tenants, backwards):
+        """
+        Return `tenants` without the ones whose schema was created from a
+        state that already includes the running migration when
+        `TENANCY_SCHEMA_VERSIONS` is enabled.
+
+        The recorded versions of these tenants are forgotten when the
+        migration is unapplied since their schema no longer reflects it.
+        """
+        from .settings import SCHEMA_VERSIONS
+        if not SCHEMA_VERSIONS:
+            return tenants
+        running = get_running_migration(self, app_label)
+        if running is None:
+            return tenants
+        migration, _index = running
+        versions = TenantSchemaVersions(connection)
+        graph = get_migration_graph()
+        current = versions.get_current_tenants(graph, (migration.app_label, migration.name))
+        if backwards:
+            versions.forget(current)
+            return tenants
+        for schema in current:
+            logger.info("Skipping tenant %s created after the migration." % schema)
+        return [tenant for tenant in tenants if tenant.db_schema not in current]
+
+    def get_concurrency(self, schema_editor):
+        """
+        Return the number of tenants that can be migrated concurrently.
+
+        Tenants are migrated on their own connection and transaction when the
+        operation's `concurrency` or `TENANCY_MIGRATION_CONCURRENCY` is greater
+        than one which is only allowed on PostgreSQL for non-atomic migrations
+        since workers could otherwise be blocked by the locks held by the
+        migration transaction.
+        """
+        from .settings import MIGRATION_CONCURRENCY
         connection = schema_editor.connection
+        if (connection.vendor != 'postgresql' or schema_editor.collect_sql or
+                connection.in_atomic_block):
+            return 1
+        return self.concurrency or MIGRATION_CONCURRENCY
+
+    def get_chunk_size(self, schema_editor):
+        """
+        Return the number of tenants to migrate in each transaction or `None`
+        if they shouldn't be committed in chunks.
+
+        Chunks can only be committed when the operation isn't already part of
+        a transaction, that is when it's part of a non-atomic migration.
+        """
+        if (not self.chunk_size or schema_editor.collect_sql or
+                schema_editor.connection.in_atomic_block):
+            return None
+        return self.chunk_size
+
+    def can_reuse_sql(self, schema_editor):
+        """
+        Return whether or not the SQL executed for the first tenant can be
+        replayed for the other ones instead of running the operation again.
+
+        This is only allowed on PostgreSQL where tables are resolved through
+        the search path and the statements are the same for all tenants when
+        `TENANCY_MIGRATION_REUSE_SQL` is enabled. Operations that introspect
+        the database to generate their SQL are never reused.
+        """
+        from .settings import MIGRATION_REUSE_SQL
+        return (
+            MIGRATION_REUSE_SQL and self.reusable_sql and
+            schema_editor.connection.vendor == 'postgresql' and not schema_editor.collect_sql
+        )
+
+    def _capture_sql(self, operation, app_label, schema_editor, from_state, to_state):
+        """
+        Run `operation` and return the statements it executed and deferred.
+        """
+        statements = []
+        deferred_sql_count = len(schema_editor.deferred_sql)
+        with patch_schema_editor_execute(schema_editor, lambda sql, params: statements.append((sql, params))):
+            operation(app_label, schema_editor, from_state, to_state)
+        return statements, schema_editor.deferred_sql[deferred_sql_count:]
+
+    def _replay_sql(self, schema_editor, statements, deferred_sql):
+        """
+        Execute statements captured by `_capture_sql` sending up to
+        `TENANCY_MIGRATION_SQL_BATCH_SIZE` of them at once when they don't
+        have parameters.
+        """
+        from .settings import MIGRATION_SQL_BATCH_SIZE
+        batch = []
+        with schema_editor.connection.cursor() as cursor:
+            def execute_batch():
+                if batch:
+                    cursor.execute(';\n'.join(batch))
+                    del batch[:]
+            for sql, params in statements:
+                if params or '%' in sql:
+                    execute_batch()
+                    cursor.execute(sql, params)
+                    continue
+                batch.append(sql)
+                if len(batch) >= MIGRATION_SQL_BATCH_SIZE:
+                    execute_batch()
+            execute_batch()
+        schema_editor.deferred_sql.extend(deferred_sql)
+
+    def tenant_operation(self, tenant_model, operation, app_label, schema_editor, from_state, to_state,
+                         backwards=False):
+        connection = schema_editor.connection
+        # The tenant models DDL might not reflect their state anymore.
+        clear_schema_ddl_cache()
         global_tenant_model = apps.get_model(tenant_model._meta.app_label, tenant_model._meta.model_name)
         get_db_schema = global_tenant_model.db_schema.fget
         get_natural_key = global_tenant_model.natural_key
         if six.PY2:
             get_natural_key = get_natural_key.im_func
-        tenants = list(tenant_model._base_manager.all())
-        # Small optimization to avoid creating model states if not required.
+        queryset = tenant_model._base_manager.all()
+        tenants = list(queryset)
+        # Small optimization to avoid rendering model states if not required.
         if tenants:
-            managed_from = self._create_managed_state(tenant_model, connection, from_state)
-            managed_to = self._create_managed_state(tenant_model, connection, to_state)
+            managed_models = self._get_managed_models(tenant_model, from_state, to_state)
             for tenant in tenants:
                 tenant.natural_key = partial(get_natural_key, tenant)
                 tenant.db_schema = get_db_schema(tenant)
-                tenant_from_state = self._create_tenant_state(tenant, connection, *managed_from)
-                tenant_to_state = self._create_tenant_state(tenant, connection, *managed_to)
-                with self.tenant_context(tenant, schema_editor):
-                    operation(app_label, schema_editor, tenant_from_state, tenant_to_state)
+            catalog = None
+            if connection.vendor == 'postgresql':
+                # Constraints of all tenants are introspected at once if needed.
+                catalog = ConstraintsCatalog(tenant.db_schema for tenant in tenants)
+            concurrency = self.get_concurrency(schema_editor)
+            # Statements executed for the first tenant when they can be reused.
+            sql_template = [] if concurrency < 2 and self.can_reuse_sql(schema_editor) else None
+            selection = get_tenant_selection()
+            journal = None
+            if not schema_editor.collect_sql:
+                tenants = self._exclude_current_tenants(app_label, connection, tenants, backwards)
+                # Staged rollouts rely on the journal to track skipped tenants
+                # which must keep being skipped until they are resumed.
+                if selection is None and not backwards and MigrationJournal(connection).has_skipped_tenants():
+                    selection = (None, False)
+                journal = MigrationJournal.for_operation(
+                    self, app_label, connection, backwards, required=selection is not None
+                )
+            if journal is not None:
+                journal.ensure_schema(schema_editor)
+                if selection is not None:
+                    tenants = self._select_tenants(journal, queryset, tenants, *selection)
+
+            def migrate_tenant(tenant, schema_editor, record_failure=True):
+                if journal is not None and journal.is_applied(tenant):
+                    logger.info("Skipping already migrated tenant %s." % tenant.db_schema)
+                    return
+                start = time.time()
+                try:
+                    with self._tenant_models(tenant, connection, managed_models):
+                        with self.tenant_context(tenant, schema_editor, catalog):
+                            if sql_template:
+                                self._replay_sql(schema_editor, *sql_template[0])
+                            elif sql_template is not None:
+                                sql_template.append(self._capture_sql(
+                                    operation, app_label, schema_editor, from_state, to_state
+                                ))
+                            else:
+                                operation(app_label, schema_editor, from_state, to_state)
+                except Exception:
+                    # Failures can only be recorded outside of transactions
+                    # since they are about to be rolled back.
+                    if record_failure and journal is not None and not schema_editor.connection.in_atomic_block:
+                        journal.record(tenant, journal.FAILED, time.time() - start)
+                    raise
+                if journal is not None:
+                    journal.record(tenant, journal.APPLIED, time.time() - start)
+
+            if concurrency > 1:
+                def migrate_tenant_concurrently(tenant):
+                    start = time.time()
+                    try:
+                        kwargs = {} if self.tenant_atomic else {'atomic': False}
+                        with connections[connection.alias].schema_editor(**kwargs) as tenant_schema_editor:
+                            migrate_tenant(tenant, tenant_schema_editor, record_failure=False)
+                    except Exception:
+                        # Recorded once the tenant transaction and its
+                        # deferred statements are done with.
+                        if journal is not None:
+                            journal.record(tenant, journal.FAILED, time.time() - start)
+                        raise
+                with self._manage_models(managed_models):
+                    run_for_tenants(tenants, migrate_tenant_concurrently, concurrency)
+                return
+            chunk_size = self.get_chunk_size(schema_editor)
+            with self._manage_models(managed_models):
+                if chunk_size is None:
+                    for tenant in tenants:
+                        migrate_tenant(tenant, schema_editor)
+                    return
+                for index in range(0, len(tenants), chunk_size):
+                    deferred_sql_count = len(schema_editor.deferred_sql)
+                    with transaction.atomic(connection.alias):
+                        for tenant in tenants[index:index + chunk_size]:
+                            migrate_tenant(tenant, schema_editor)
+                        # Statements deferred by the chunk must be committed with it.
+                        for sql in schema_editor.deferred_sql[deferred_sql_count:]:
+                            schema_editor.execute(sql)
+                    del schema_editor.deferred_sql[deferred_sql_count:]
 
     def database_forwards(self, app_label, schema_editor, from_state, to_state):
         tenant_model = self.get_tenant_model(app_label, from_state, to_state)
@@ -93,7 +418,9 @@ class TenantOperation(Operation):
     def database_backwards(self, app_label, schema_editor, from_state, to_state):
         tenant_model = self.get_tenant_model(app_label, to_state, from_state)
         operation = super(TenantOperation, self).database_backwards
-        self.tenant_operation(tenant_model, operation, app_label, schema_editor, from_state, to_state)
+        self.tenant_operation(
+            tenant_model, operation, app_label, schema_editor, from_state, to_state, backwards=True
+        )
 
 
 class TenantModelOperation(TenantOperation):
@@ -107,7 +434,7 @@ class TenantModelOperation(TenantOperation):
 
 
 class CreateModel(TenantModelOperation, operations.CreateModel):
-    pass
+    reusable_sql = True
 
 
 class DeleteModel(TenantModelOperation, operations.DeleteModel):
@@ -140,7 +467,7 @@ class TenantModelFieldOperation(TenantModelOperation):
 
 
 class AddField(TenantModelFieldOperation, operations.AddField):
-    pass
+    reusable_sql = True
 
 
 class RemoveField(TenantModelFieldOperation, operations.RemoveField):
@@ -155,6 +482,256 @@ class RenameField(TenantModelFieldOperation, operations.RenameField):
     pass
 
 
+class OnlineFieldOperationMixin(object):
+    """
+    Base class for field operations backfilling columns in batches of
+    `batch_size` rows, sleeping `throttle` seconds between batches, instead
+    of relying on a single statement that locks the whole tenant table.
+
+    The operations must be part of non-atomic migrations for the column to be
+    added or altered, each batch to be backfilled and the constraints to be
+    applied in their own transactions instead of holding a lock on the table
+    for the whole backfill.
+    """
+    reusable_sql = False
+    tenant_atomic = False
+
+    def __init__(self, *args, **kwargs):
+        self.batch_size = kwargs.pop('batch_size', BATCH_SIZE)
+        self.throttle = kwargs.pop('throttle', 0)
+        super(OnlineFieldOperationMixin, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super(OnlineFieldOperationMixin, self).deconstruct()
+        if self.batch_size != BATCH_SIZE:
+            kwargs['batch_size'] = self.batch_size
+        if self.throttle:
+            kwargs['throttle'] = self.throttle
+        return name, args, kwargs
+
+    def backfill(self, model, field, value, schema_editor):
+        """
+        Set the column of `field` to `value` for the rows of `model` where it's
+        NULL and return the number of updated rows.
+        """
+        manager = model._base_manager.db_manager(schema_editor.connection.alias)
+        queryset = manager.filter(**{"%s__isnull" % field.name: True}).only('pk')
+        updated = 0
+        for batch in iterate_keyset(queryset, self.batch_size):
+            if updated and self.throttle:
+                time.sleep(self.throttle)
+            updated += manager.filter(pk__in=[obj.pk for obj in batch]).update(**{field.name: value})
+        return updated
+
+    def online_forwards(self, app_label, schema_editor, from_state, to_state):
+        raise NotImplementedError
+
+    def get_chunk_size(self, schema_editor):
+        # Tenants can't be grouped in transactions.
+        return None
+
+    def check_atomic(self, schema_editor):
+        if schema_editor.connection.in_atomic_block and not schema_editor.collect_sql:
+            raise NotSupportedError(
+                '%s cannot be executed inside a transaction, set atomic = False on '
+                'the migration.' % self.__class__.__name__
+            )
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.check_atomic(schema_editor)
+        tenant_model = self.get_tenant_model(app_label, from_state, to_state)
+        self.tenant_operation(tenant_model, self.online_forwards, app_label, schema_editor, from_state, to_state)
+
+
+class OnlineAddField(OnlineFieldOperationMixin, AddField):
+    """
+    Add a field with a default by adding its column as nullable, which
+    doesn't rewrite the table, before backfilling it and applying its
+    constraints.
+    """
+
+    def online_forwards(self, app_label, schema_editor, from_state, to_state):
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            return
+        from_model = from_state.apps.get_model(app_label, self.model_name)
+        field = to_model._meta.get_field(self.name)
+        default = field.default if self.preserve_default else self.field.default
+        if default is NOT_PROVIDED or field.many_to_many:
+            return operations.AddField.database_forwards(self, app_label, schema_editor, from_state, to_state)
+        nullable_field = field.clone()
+        nullable_field.null = True
+        nullable_field.default = NOT_PROVIDED
+        nullable_field.set_attributes_from_name(field.name)
+        nullable_field.model = to_model
+        schema_editor.add_field(from_model, nullable_field)
+        self.backfill(to_model, field, default() if callable(default) else default, schema_editor)
+        schema_editor.alter_field(to_model, nullable_field, field)
+
+
+class OnlineAlterField(OnlineFieldOperationMixin, AlterField):
+    """
+    Alter a nullable field to a non-nullable one with a default by
+    backfilling its NULL values before applying its constraints.
+    """
+
+    def online_forwards(self, app_label, schema_editor, from_state, to_state):
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            return
+        from_model = from_state.apps.get_model(app_label, self.model_name)
+        from_field = from_model._meta.get_field(self.name)
+        to_field = to_model._meta.get_field(self.name)
+        default = to_field.default if self.preserve_default else self.field.default
+        connection = schema_editor.connection
+        # Values can only be backfilled if the column type is left untouched.
+        if (from_field.null and not to_field.null and default is not NOT_PROVIDED and
+                from_field.db_type(connection) == to_field.db_type(connection)):
+            self.backfill(from_model, from_field, default() if callable(default) else default, schema_editor)
+        if not self.preserve_default:
+            to_field.default = self.field.default
+        schema_editor.alter_field(from_model, from_field, to_field)
+        if not self.preserve_default:
+            to_field.default = NOT_PROVIDED
+
+
+if django.VERSION >= (1, 11):
+    class AddIndexConcurrently(TenantModelOperation, operations.AddIndex):
+        """
+        Create an index on the table of each tenant without blocking writes
+        by relying on `CREATE INDEX CONCURRENTLY` on PostgreSQL, which must be
+        part of a non-atomic migration.
+
+        Indexes left invalid by a failed build are dropped and built again up
+        to `retries` times. Tenants are migrated concurrently according to
+        `concurrency` or `TENANCY_MIGRATION_CONCURRENCY`.
+        """
+        tenant_atomic = False
+
+        def __init__(self, *args, **kwargs):
+            self.concurrency = kwargs.pop('concurrency', None)
+            self.retries = kwargs.pop('retries', 1)
+            super(AddIndexConcurrently, self).__init__(*args, **kwargs)
+
+        def deconstruct(self):
+            name, args, kwargs = super(AddIndexConcurrently, self).deconstruct()
+            if self.concurrency:
+                kwargs['concurrency'] = self.concurrency
+            if self.retries != 1:
+                kwargs['retries'] = self.retries
+            return name, args, kwargs
+
+        def describe(self):
+            return "Create index %s on field(s) %s of model %s concurrently" % (
+                self.index.name, ', '.join(self.index.fields), self.model_name
+            )
+
+        def get_operation_model_state(self, app_label, from_state, to_state):
+            return to_state.models[app_label, self.model_name.lower()]
+
+        def get_chunk_size(self, schema_editor):
+            # Indexes can't be created concurrently in a transaction.
+            return None
+
+        def get_index(self, schema_editor):
+            """
+            Return the index to create for the tenant being migrated.
+
+            Index names are only unique per schema on PostgreSQL and attached
+            databases, they are prefixed by the tenant schema like tables
+            otherwise.
+            """
+            connection = schema_editor.connection
+            if connection.vendor == 'postgresql' or uses_attached_databases(connection):
+                return self.index
+            index = copy.copy(self.index)
+            index.name = "%s_%s" % (schema_editor.tenant.db_schema, self.index.name)
+            return index
+
+        def is_index_valid(self, schema_editor, name):
+            """
+            Return whether or not the index `name` of the tenant being migrated
+            is valid or `None` if it doesn't exist.
+            """
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT i.indisvalid FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "WHERE n.nspname = %s AND c.relname = %s",
+                    [schema_editor.tenant.db_schema, name]
+                )
+                row = cursor.fetchone()
+            return row[0] if row else None
+
+        def create_index(self, app_label, schema_editor, from_state, to_state):
+            model = to_state.apps.get_model(app_label, self.model_name)
+            connection = schema_editor.connection
+            if not self.allow_migrate_model(connection.alias, model):
+                return
+            index = self.get_index(schema_editor)
+            if connection.vendor != 'postgresql':
+                schema_editor.add_index(model, index)
+                return
+            # Statement objects are returned on Django >= 2.0.
+            sql = six.text_type(index.create_sql(model, schema_editor))
+            sql = sql.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+            if schema_editor.collect_sql:
+                schema_editor.execute(sql)
+                return
+            for attempt in range(self.retries + 1):
+                valid = self.is_index_valid(schema_editor, index.name)
+                if valid:
+                    return
+                elif valid is False:
+                    logger.warning("Dropping invalid index %s of tenant %s." % (
+                        index.name, schema_editor.tenant.db_schema
+                    ))
+                    schema_editor.execute("DROP INDEX CONCURRENTLY %s" % schema_editor.quote_name(index.name))
+                try:
+                    schema_editor.execute(sql)
+                except DatabaseError:
+                    if attempt == self.retries:
+                        raise
+                    logger.exception("Failed to create index %s of tenant %s, retrying." % (
+                        index.name, schema_editor.tenant.db_schema
+                    ))
+            if not self.is_index_valid(schema_editor, index.name):
+                raise DatabaseError("Index %s of tenant %s is invalid." % (index.name, schema_editor.tenant.db_schema))
+
+        def remove_index(self, app_label, schema_editor, from_state, to_state):
+            model = from_state.apps.get_model(app_label, self.model_name)
+            connection = schema_editor.connection
+            if not self.allow_migrate_model(connection.alias, model):
+                return
+            index = self.get_index(schema_editor)
+            if connection.vendor != 'postgresql':
+                schema_editor.remove_index(model, index)
+                return
+            schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS %s" % schema_editor.quote_name(index.name))
+
+        def check_atomic(self, schema_editor):
+            connection = schema_editor.connection
+            if (connection.vendor == 'postgresql' and connection.in_atomic_block and
+                    not schema_editor.collect_sql):
+                raise NotSupportedError(
+                    'AddIndexConcurrently cannot be executed inside a transaction, '
+                    'set atomic = False on the migration.'
+                )
+
+        def database_forwards(self, app_label, schema_editor, from_state, to_state):
+            self.check_atomic(schema_editor)
+            tenant_model = self.get_tenant_model(app_label, from_state, to_state)
+            self.tenant_operation(tenant_model, self.create_index, app_label, schema_editor, from_state, to_state)
+
+        def database_backwards(self, app_label, schema_editor, from_state, to_state):
+            self.check_atomic(schema_editor)
+            tenant_model = self.get_tenant_model(app_label, to_state, from_state)
+            self.tenant_operation(
+                tenant_model, self.remove_index, app_label, schema_editor, from_state, to_state, backwards=True
+            )
+
+
 class TenantSpecialOperation(TenantOperation):
     def __init__(self, tenant_model, *args, **kwargs):
         self.tenant_model = tenant_model
@@ -166,8 +743,16 @@ class TenantSpecialOperation(TenantOperation):
 
 
 class RunPython(TenantSpecialOperation, operations.RunPython):
-    pass
+    def __init__(self, *args, **kwargs):
+        self.concurrency = kwargs.pop('concurrency', None)
+        super(RunPython, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, args, kwargs = super(RunPython, self).deconstruct()
+        if self.concurrency:
+            kwargs['concurrency'] = self.concurrency
+        return name, args, kwargs
 
 
 class RunSQL(TenantSpecialOperation, operations.RunSQL):
-    pass
+    reusable_sql = True
@@ -0,0 +1,223 @@
+from __future__ import unicode_literals
+
+import logging
+import multiprocessing
+import threading
+import traceback
+from functools import partial
+
+import django
+from django.apps import apps
+from django.db import connections
+from django.utils.encoding import force_text
+from django.utils.six.moves import queue
+
+from . import pool
+
+# Connections inherited by processes spawned by `map_tenants`.
+_inherited_connections = []
+
+
+class TenantExecutionError(Exception):
+    """
+    Raised once all tenants were processed by `run_for_tenants` or
+    `map_tenants` if some of them failed. The `errors` attribute is a list of
+    `(tenant, exception)` tuples and the `results` one the list of results
+    returned by `map_tenants`, `None` for the failed tenants.
+    """
+
+    def __init__(self, errors, results=None):
+        self.errors = errors
+        self.results = results
+        super(TenantExecutionError, self).__init__(
+            "%d tenant(s) failed: %s" % (
+                len(errors), '; '.join("%r: %s" % (tenant.natural_key(), error) for tenant, error in errors)
+            )
+        )
+
+
+class TenantProcessError(Exception):
+    """
+    Error standing for the one raised while processing a tenant in a child
+    process of `map_tenants` since exceptions can't always be pickled.
+    """
+
+    def __init__(self, class_path, message, traceback):
+        self.class_path = class_path
+        self.message = message
+        self.traceback = traceback
+        super(TenantProcessError, self).__init__(class_path, message, traceback)
+
+    def __str__(self):
+        return "%s: %s" % (self.class_path, self.message)
+
+
+def run_for_tenants(tenants, function, concurrency=1):
+    """
+    Call `function(tenant)` for each tenant using up to `concurrency` threads
+    each relying on their own database connections. Errors are collected and
+    raised as a `TenantExecutionError` once all tenants were processed.
+
+    When `concurrency` is lower than 2 tenants are processed serially in the
+    current thread and the first error is raised immediately.
+    """
+    tenants = list(tenants)
+    concurrency = min(concurrency, len(tenants))
+    if concurrency < 2:
+        for tenant in tenants:
+            function(tenant)
+        return
+    logger = logging.getLogger('tenancy.parallel')
+
+    def call(item):
+        index, tenant = item
+        try:
+            function(tenant)
+        except Exception as e:
+            logger.exception("Failed to process tenant %r." % (tenant.natural_key(),))
+            return index, None, e
+        return index, None, None
+    errors = sorted(
+        (index, error) for index, _result, error in _map_threads(call, list(enumerate(tenants)), concurrency)
+        if error is not None
+    )
+    if errors:
+        raise TenantExecutionError([(tenants[index], error) for index, error in errors])
+
+
+def _call(function, item, picklable_errors=False):
+    index, tenant = item
+    try:
+        with tenant.as_global():
+            return index, function(tenant), None
+    except Exception as e:
+        if not picklable_errors:
+            return index, None, e
+        # Exceptions requiring extra constructor arguments can't be unpickled.
+        return index, None, (
+            "%s.%s" % (e.__class__.__module__, e.__class__.__name__),
+            force_text(e), force_text(traceback.format_exc()),
+        )
+
+
+def _map_threads(call, items, workers):
+    pending = queue.Queue()
+    for item in items:
+        pending.put(item)
+    done = queue.Queue()
+
+    def worker():
+        try:
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                done.put(call(item))
+        finally:
+            # Connections are thread local and would be leaked otherwise.
+            for connection in connections.all():
+                connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for _ in range(len(items)):
+            yield done.get()
+    finally:
+        for thread in threads:
+            thread.join()
+
+
+def _init_process():
+    # Spawned processes must set up Django.
+    if not apps.ready:
+        django.setup()
+    # Connections inherited from the parent process must neither be used nor
+    # closed as closing them would terminate the parent's sessions.
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+    connections._connections = threading.local()
+    # The same goes for the idle connections of the pools.
+    for connection_pool in pool._pools.values():
+        _inherited_connections.extend(connection for connection, _schema in connection_pool.idle)
+    pool._pools = {}
+    pool._pools_lock = threading.Lock()
+
+
+def _get_process_context():
+    """
+    Return the multiprocessing context processes are started from, forking
+    them when possible.
+    """
+    # Python 2 always forks processes on POSIX systems.
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _detach(tenant):
+    # Tenant instances cache their tenant models which can't be pickled.
+    field_names = [field.attname for field in tenant._meta.concrete_fields]
+    return tenant.from_db(tenant._state.db, field_names, [getattr(tenant, name) for name in field_names])
+
+
+def _map_processes(function, items, workers):
+    pool = _get_process_context().Pool(workers, initializer=_init_process)
+    call = partial(_call, function, picklable_errors=True)
+    try:
+        for index, result, error in pool.imap_unordered(call, [(index, _detach(tenant)) for index, tenant in items]):
+            yield index, result, (None if error is None else TenantProcessError(*error))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def map_tenants(function, tenants, workers=1, mode='thread', progress=None):
+    """
+    Return the list of the results of `function(tenant)` for each of
+    `tenants`, each call happening while the tenant is exposed through
+    `as_global`. Up to `workers` tenants are processed concurrently by
+    threads or, when `mode` is `'process'`, by processes, forked when the
+    platform allows it, in which case `function`, `tenants` and results must
+    be picklable and errors are reported as `TenantProcessError`.
+
+    Errors are collected and raised as a `TenantExecutionError` once all
+    tenants were processed. When specified `progress(tenant, error, done,
+    total)` is called from the current thread each time a tenant is done.
+    """
+    if mode not in ('thread', 'process'):
+        raise ValueError("Invalid mode %r, expected 'thread' or 'process'." % mode)
+    tenants = list(tenants)
+    items = list(enumerate(tenants))
+    call = partial(_call, function)
+    workers = min(workers, len(tenants))
+    if workers < 2:
+        calls = (call(item) for item in items)
+    elif mode == 'thread':
+        calls = _map_threads(call, items, workers)
+    else:
+        calls = _map_processes(function, items, workers)
+    results = [None] * len(tenants)
+    errors = {}
+    for done, (index, result, error) in enumerate(calls, start=1):
+        tenant = tenants[index]
+        if error is None:
+            results[index] = result
+        else:
+            errors[index] = error
+        if progress is not None:
+            progress(tenant, error, done, len(tenants))
+    if errors:
+        raise TenantExecutionError(
+            [(tenants[index], error) for index, error in sorted(errors.items())], results
+        )
+    return results
@@ -0,0 +1,134 @@
+"""
+Process wide pools of database connections remembering the tenant schema
+each of them was left pinned to, see `tenancy.backends.postgresql`.
+
+Idle connections pinned to the schema of the tenant a connection is requested
+for are handed back first since they don't require their session state to be
+altered, they are only checked through the pool's `check` function. Other
+connections are reset through the pool's `reset` function before being reused
+by a different tenant. Connections failing to be checked or reset are
+discarded.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger('tenancy.pool')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool(object):
+    def __init__(self, size=10, reset=None, close=None, check=None):
+        # Maximum number of idle connections kept around.
+        self.size = size
+        self.reset = reset
+        self.check = check
+        self._close = close or (lambda connection: connection.close())
+        self.lock = threading.Lock()
+        # List of `(connection, schema)` tuples ordered from the least to the
+        # most recently released.
+        self.idle = []
+        self.counters = Counter()
+
+    def acquire(self, schema=None):
+        """
+        Return an idle `(connection, schema)` tuple or `None` if a new
+        connection must be opened.
+
+        A connection pinned to `schema` is checked and returned if available,
+        otherwise the least recently released connection is reset and returned
+        with a `None` schema.
+        """
+        pooled = None
+        with self.lock:
+            if not self.idle:
+                self.counters['misses'] += 1
+                return None
+            if schema is not None:
+                for index in reversed(range(len(self.idle))):
+                    if self.idle[index][1] == schema:
+                        self.counters['hits'] += 1
+                        pooled = self.idle.pop(index)
+                        break
+            if pooled is None:
+                pooled = (self.idle.pop(0)[0], None)
+                self.counters['resets'] += 1
+        connection, pinned_schema = pooled
+        action, function = ('reset', self.reset) if pinned_schema is None else ('check', self.check)
+        if function is not None:
+            try:
+                function(connection)
+            except Exception:
+                logger.exception('Failed to %s pooled connection.' % action)
+                self.discard(connection)
+                return self.acquire(schema)
+        return pooled
+
+    def release(self, connection, schema=None):
+        """
+        Return `connection` to the pool, `schema` should be `None` unless the
+        session state of the connection is known to be pinned to it.
+        """
+        with self.lock:
+            self.idle.append((connection, schema))
+            if len(self.idle) <= self.size:
+                return
+            connection, _schema = self.idle.pop(0)
+        self.discard(connection)
+
+    def discard(self, connection):
+        with self.lock:
+            self.counters['discarded'] += 1
+        try:
+            self._close(connection)
+        except Exception:
+            logger.exception('Failed to close pooled connection.')
+
+    def clear(self):
+        """
+        Close all the idle connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _schema in idle:
+            self.discard(connection)
+
+    def get_metrics(self):
+        """
+        Return a dict of the pool's counters along its number of idle
+        connections and how many of them are pinned to a schema.
+        """
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics['idle'] = len(self.idle)
+            metrics['pinned'] = sum(1 for _connection, schema in self.idle if schema is not None)
+        for name in ('hits', 'misses', 'resets', 'discarded'):
+            metrics.setdefault(name, 0)
+        return metrics
+
+
+def get_pool(alias, **kwargs):
+    """
+    Return the process wide pool of the `alias` connections, creating it with
+    `kwargs` if it doesn't exist yet.
+    """
+    with _pools_lock:
+        try:
+            return _pools[alias]
+        except KeyError:
+            pool = _pools[alias] = ConnectionPool(**kwargs)
+            return pool
+
+
+def clear_pools():
+    """
+    Close the idle connections of all the pools.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.clear()
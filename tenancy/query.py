@@ -0,0 +1,69 @@
+"""
+Cross-tenant queries compiling a queryset against the tables of many tenants
+into a single `UNION ALL` statement.
+"""
+from __future__ import unicode_literals
+
+from django.db import NotSupportedError, connections
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE
+
+from .compat import EmptyResultSet
+
+# Number of tenants queried by each statement.
+CHUNK_SIZE = 100
+
+
+def union_all(tenants, get_queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yield `(natural_key, row)` tuples for the rows returned by the queryset
+    returned by `get_queryset(tenant)` for each of `tenants` where `row` is
+    a dict keyed by column names. Tenants are queried by chunks of
+    `chunk_size` tenants, each of them through a single statement.
+
+    This is best used with `values()` querysets, for example
+
+        union_all(Tenant.objects.all(), lambda tenant: tenant.orders.values(
+            'status'
+        ).annotate(total=Sum('amount')))
+
+    Values are returned as provided by the database adapter as the database
+    converters of the fields are not applied.
+    """
+    from .settings import UNQUALIFIED_TABLES
+    tenants = list(tenants)
+    for start in range(0, len(tenants), chunk_size):
+        chunk = tenants[start:start + chunk_size]
+        statements, params = [], []
+        using = None
+        for index, tenant in enumerate(chunk):
+            queryset = get_queryset(tenant)
+            if using is None:
+                using = queryset.db
+                connection = connections[using]
+                if UNQUALIFIED_TABLES and connection.vendor == 'postgresql':
+                    raise NotSupportedError(
+                        'Cross-tenant queries are not supported with unqualified tenant tables.'
+                    )
+            elif queryset.db != using:
+                raise ValueError(
+                    "All querysets must use the same database, %r uses %r instead of %r." % (
+                        tenant.natural_key(), queryset.db, using
+                    )
+                )
+            try:
+                sql, query_params = queryset.query.get_compiler(using).as_sql()
+            except EmptyResultSet:
+                continue
+            statements.append("SELECT %d AS %s, %s.* FROM (%s) %s" % (
+                index, connection.ops.quote_name('tenancy_index'), connection.ops.quote_name('tenancy_union'),
+                sql, connection.ops.quote_name('tenancy_union'),
+            ))
+            params.extend(query_params)
+        if not statements:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(' UNION ALL '.join(statements), params)
+            columns = [column[0] for column in cursor.description[1:]]
+            for rows in iter(lambda: cursor.fetchmany(GET_ITERATOR_CHUNK_SIZE), []):
+                for row in rows:
+                    yield chunk[row[0]].natural_key(), dict(zip(columns, row[1:]))
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+
+import threading
+import zlib
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.migration import Migration
+
+from .journal import MigrationJournal
+
+_selection = threading.local()
+
+
+class TenantSelector(object):
+    """
+    Select the tenants tenant operations are applied to by natural keys,
+    queryset filters and shard. Tenants must match all the specified
+    criteria to be selected.
+    """
+
+    def __init__(self, natural_keys=None, filters=None, shard=None):
+        self.natural_keys = set(tuple(key) for key in natural_keys) if natural_keys else None
+        self.filters = filters or {}
+        # A `(index, count)` tuple.
+        self.shard = shard
+
+    @staticmethod
+    def get_shard(tenant, count):
+        return (zlib.crc32(tenant.db_schema.encode('utf-8')) & 0xffffffff) % count
+
+    def select(self, queryset, tenants):
+        """
+        Return the selected tenants from `tenants` which must be instances
+        retrieved from `queryset`.
+        """
+        selected_pks = None
+        if self.filters:
+            selected_pks = set(queryset.filter(**self.filters).values_list('pk', flat=True))
+        return [
+            tenant for tenant in tenants
+            if (selected_pks is None or tenant.pk in selected_pks) and
+            (self.natural_keys is None or tuple(tenant.natural_key()) in self.natural_keys) and
+            (self.shard is None or self.get_shard(tenant, self.shard[1]) == self.shard[0])
+        ]
+
+
+@contextmanager
+def select_tenants(selector=None, resume=False):
+    """
+    Restrict the tenant operations run in this thread to the tenants
+    selected by `selector`. Tenants left out are recorded as skipped in the
+    migration journal.
+
+    When `resume` is `True` only the tenants previously skipped are
+    migrated.
+    """
+    previous = getattr(_selection, 'value', None)
+    _selection.value = (selector, resume)
+    try:
+        yield
+    finally:
+        _selection.value = previous
+
+
+def get_tenant_selection():
+    """
+    Return the `(selector, resume)` tuple of the active `select_tenants`
+    context or `None`.
+    """
+    return getattr(_selection, 'value', None)
+
+
+class ResumedMigration(Migration):
+    """
+    An applied migration of which only the tenant operations are applied.
+    """
+
+    def __init__(self, migration):
+        super(ResumedMigration, self).__init__(migration.name, migration.app_label)
+        # The same operations must be used for the journal to find them.
+        self.operations = migration.operations
+        self.atomic = getattr(migration, 'atomic', True)
+
+    def apply(self, project_state, schema_editor, collect_sql=False):
+        from .operations import TenantOperation
+        for operation in self.operations:
+            old_state = project_state.clone()
+            operation.state_forwards(self.app_label, project_state)
+            if not isinstance(operation, TenantOperation):
+                continue
+            if not self.atomic and getattr(operation, 'atomic', False):
+                with transaction.atomic(schema_editor.connection.alias):
+                    operation.database_forwards(self.app_label, schema_editor, old_state, project_state)
+            else:
+                operation.database_forwards(self.app_label, schema_editor, old_state, project_state)
+        return project_state
+
+
+def resume_tenant_migrations(connection, selector=None):
+    """
+    Apply the tenant operations of the applied migrations to the tenants
+    that were skipped when they were run with a selector and return the
+    keys of the resumed migrations.
+    """
+    journal = MigrationJournal(connection)
+    if not journal.has_table():
+        return []
+    pending = set(journal.entries.filter(
+        direction=journal.FORWARDS, status=journal.SKIPPED
+    ).values_list('app', 'name'))
+    loader = MigrationLoader(connection)
+    resumed = []
+    for leaf in loader.graph.leaf_nodes():
+        for key in loader.graph.forwards_plan(leaf):
+            if key not in pending or key in resumed or key not in loader.applied_migrations:
+                continue
+            migration = ResumedMigration(loader.graph.nodes[key])
+            state = loader.project_state(key, at_end=False)
+            # Only non-atomic migrations must specify it on Django < 1.10.
+            kwargs = {} if migration.atomic else {'atomic': False}
+            with connection.schema_editor(**kwargs) as schema_editor:
+                with select_tenants(selector, resume=True):
+                    migration.apply(state, schema_editor)
+            resumed.append(key)
+    return resumed
@@ -15,3 +15,31 @@ except ValueError:
 HOST_NAME = getattr(settings, 'TENANCY_HOST_NAME', 'tenant')
 
 SCHEMA_AUTHORIZATION = getattr(settings, 'TENANCY_SCHEMA_AUTHORIZATION', False)
+
+SCHEMA_DDL_CACHE = getattr(settings, 'TENANCY_SCHEMA_DDL_CACHE', True)
+
+ASYNC_PROVISIONING = getattr(settings, 'TENANCY_ASYNC_PROVISIONING', False)
+
+PROVISIONING_RETRY_AFTER = getattr(settings, 'TENANCY_PROVISIONING_RETRY_AFTER', 5)
+
+PROVISIONING_STALE_TIMEOUT = getattr(settings, 'TENANCY_PROVISIONING_STALE_TIMEOUT', 3600)
+
+DEFERRED_SCHEMA_DROP = getattr(settings, 'TENANCY_DEFERRED_SCHEMA_DROP', False)
+
+MIGRATION_CONCURRENCY = getattr(settings, 'TENANCY_MIGRATION_CONCURRENCY', 1)
+
+MIGRATION_JOURNAL = getattr(settings, 'TENANCY_MIGRATION_JOURNAL', False)
+
+MIGRATION_REUSE_SQL = getattr(settings, 'TENANCY_MIGRATION_REUSE_SQL', False)
+
+MIGRATION_SQL_BATCH_SIZE = getattr(settings, 'TENANCY_MIGRATION_SQL_BATCH_SIZE', 1)
+
+SCHEMA_VERSIONS = getattr(settings, 'TENANCY_SCHEMA_VERSIONS', False)
+
+UNQUALIFIED_TABLES = getattr(settings, 'TENANCY_UNQUALIFIED_TABLES', False)
+
+QUERY_COLLECTOR = getattr(settings, 'TENANCY_QUERY_COLLECTOR', None)
+
+SQL_COMMENTS = getattr(settings, 'TENANCY_SQL_COMMENTS', False)
+
+QUERY_BUDGET = getattr(settings, 'TENANCY_QUERY_BUDGET', None)
@@ -31,3 +31,5 @@ post_models_creation = Signal(providing_args=['tenant', 'using'])
 
 pre_schema_deletion = Signal(providing_args=['tenant', 'using'])
 post_schema_deletion = Signal(providing_args=['tenant', 'using'])
+
+provisioning_requested = Signal(providing_args=['tenant', 'using'])
@@ -0,0 +1,153 @@
+"""
+Per-tenant admission control preventing a tenant from saturating the
+database shared with the others.
+
+The database time spent executing the queries of each tenant over a sliding
+window and the number of queries each of them is concurrently executing are
+tracked by the instrumented cursors of `tenancy.instrumentation` according
+to the `QueryBudget` returned by `AbstractTenant.get_query_budget()`, which
+is built from the `TENANCY_QUERY_BUDGET` setting by default.
+
+Queries of tenants exceeding their budget wait for up to `QueryBudget.wait`
+seconds for the budget to be freed before `TenantOverBudget` is raised.
+Requests can also be held before being processed by enabling
+`TenantThrottlingMiddleware`. Keep in mind that usage is tracked per process.
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import deque
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+class TenantOverBudget(Exception):
+    def __init__(self, message, retry_after):
+        super(TenantOverBudget, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class QueryBudget(object):
+    def __init__(self, db_time=None, window=60, concurrent_queries=None, wait=0):
+        # Seconds of database time allowed over the last `window` seconds.
+        self.db_time = db_time
+        self.window = window
+        self.concurrent_queries = concurrent_queries
+        # Seconds to wait for the budget to be freed before giving up.
+        self.wait = wait
+
+
+class TenantUsage(object):
+    def __init__(self):
+        # Queue of `(end, duration)` tuples of the queries executed in the
+        # window ordered by their end time.
+        self.queries = deque()
+        self.db_time = 0.0
+        self.concurrent_queries = 0
+
+    def expire(self, now, window):
+        queries = self.queries
+        while queries and queries[0][0] <= now - window:
+            self.db_time -= queries.popleft()[1]
+        if not queries:
+            # Avoid accumulating floating point errors.
+            self.db_time = 0.0
+
+    def check(self, budget, now):
+        """
+        Return a `TenantOverBudget` exception if this usage exceeds `budget`.
+        """
+        if budget.concurrent_queries is not None and self.concurrent_queries >= budget.concurrent_queries:
+            return TenantOverBudget(
+                "%d concurrent queries are already executing." % self.concurrent_queries, 1
+            )
+        if budget.db_time is not None:
+            self.expire(now, budget.window)
+            if self.db_time >= budget.db_time:
+                retry_after = (self.queries[0][0] + budget.window - now) if self.queries else budget.window
+                return TenantOverBudget(
+                    "%.3f seconds of database time were used over the last %s seconds." % (
+                        self.db_time, budget.window
+                    ), retry_after
+                )
+
+
+class TenantUsageTracker(object):
+    poll_interval = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.usages = {}
+
+    def _get_usage(self, db_schema):
+        usage = self.usages.get(db_schema)
+        if usage is None:
+            usage = self.usages[db_schema] = TenantUsage()
+        return usage
+
+    def _wait(self, db_schema, budget, acquire):
+        deadline = time.time() + budget.wait
+        while True:
+            now = time.time()
+            with self.lock:
+                usage = self._get_usage(db_schema)
+                exceeded = usage.check(budget, now)
+                if exceeded is None:
+                    if acquire:
+                        usage.concurrent_queries += 1
+                    return
+            if now >= deadline:
+                raise exceeded
+            time.sleep(min(self.poll_interval, max(deadline - now, 0)))
+
+    def admit(self, db_schema, budget):
+        """
+        Wait for the tenant using `db_schema` to be within its `budget`.
+        """
+        self._wait(db_schema, budget, acquire=False)
+
+    def acquire(self, db_schema, budget):
+        """
+        Wait for the tenant using `db_schema` to be within its `budget` and
+        account for a query starting to execute.
+        """
+        self._wait(db_schema, budget, acquire=True)
+
+    def release(self, db_schema, budget, duration):
+        """
+        Account for a query started through `acquire` that took `duration`
+        seconds to execute.
+        """
+        with self.lock:
+            usage = self._get_usage(db_schema)
+            usage.concurrent_queries -= 1
+            if budget.db_time is not None:
+                now = time.time()
+                usage.queries.append((now, duration))
+                usage.db_time += duration
+                usage.expire(now, budget.window)
+
+    def get_usage(self, db_schema):
+        """
+        Return the database time accounted in the window of the tenant using
+        `db_schema` and the number of queries it's concurrently executing.
+        """
+        with self.lock:
+            usage = self.usages.get(db_schema)
+            if usage is None:
+                return 0.0, 0
+            return usage.db_time, usage.concurrent_queries
+
+    def reset(self):
+        with self.lock:
+            self.usages.clear()
+
+
+def get_usage_tracker():
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = TenantUsageTracker()
+        return _tracker
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import threading
 from contextlib import contextmanager
 from itertools import chain
 
@@ -131,9 +132,146 @@ def clear_cached_properties(instance):
             instance.__dict__.pop(attr)
 
 
+def get_schemas_constraints(cursor, schemas, table_name=None):
+    """
+    Retrieve any constraints or keys (unique, pk, fk, check, index) across
+    one or more columns of the tables of `schemas`, or only of the table
+    named `table_name`, in a mapping keyed by `(schema, table_name)`. Also
+    retrieve the definition of expression-based indexes.
+    """
+    tables = {}
+    params = [list(schemas)]
+    if table_name is not None:
+        params.append(table_name)
+
+    def condition(table_column):
+        sql = 'ns.nspname = ANY(%s)'
+        if table_name is not None:
+            sql += " AND %s = %%s" % table_column
+        return sql
+    # Loop over the key table, collecting things as constraints. The column
+    # array must return column names in the same order in which they were
+    # created.
+    # The subquery containing generate_series can be replaced with
+    # "WITH ORDINALITY" when support for PostgreSQL 9.3 is dropped.
+    cursor.execute("""
+        SELECT
+            ns.nspname,
+            cl.relname,
+            c.conname,
+            array(
+                SELECT attname
+                FROM (
+                    SELECT unnest(c.conkey) AS colid,
+                           generate_series(1, array_length(c.conkey, 1)) AS arridx
+                ) AS cols
+                JOIN pg_attribute AS ca ON cols.colid = ca.attnum
+                WHERE ca.attrelid = c.conrelid
+                ORDER BY cols.arridx
+            ),
+            c.contype,
+            (SELECT fkc.relname || '.' || fka.attname
+            FROM pg_attribute AS fka
+            JOIN pg_class AS fkc ON fka.attrelid = fkc.oid
+            WHERE fka.attrelid = c.confrelid AND fka.attnum = c.confkey[1])
+        FROM pg_constraint AS c
+        JOIN pg_class AS cl ON c.conrelid = cl.oid
+        JOIN pg_namespace AS ns ON cl.relnamespace = ns.oid
+        WHERE %s
+    """ % condition('cl.relname'), params)
+    for schema, table, constraint, columns, kind, used_cols in cursor.fetchall():
+        tables.setdefault((schema, table), {})[constraint] = {
+            "columns": columns,
+            "primary_key": kind == "p",
+            "unique": kind in ["p", "u"],
+            "foreign_key": tuple(used_cols.split(".", 1)) if kind == "f" else None,
+            "check": kind == "c",
+            "index": False,
+            "definition": None,
+        }
+    # Now get indexes
+    cursor.execute("""
+        SELECT
+            nspname, tablename, indexname, array_agg(attname ORDER BY arridx), indisunique, indisprimary,
+            array_agg(ordering ORDER BY arridx), amname, exprdef, s2.attoptions
+        FROM (
+            SELECT
+                ns.nspname, c.relname as tablename, c2.relname as indexname, idx.*, attr.attname, am.amname,
+                CASE
+                    WHEN idx.indexprs IS NOT NULL THEN
+                        pg_get_indexdef(idx.indexrelid)
+                END AS exprdef,
+                CASE am.amname
+                    WHEN 'btree' THEN
+                        CASE (option & 1)
+                            WHEN 1 THEN 'DESC' ELSE 'ASC'
+                        END
+                END as ordering,
+                c2.reloptions as attoptions
+            FROM (
+                SELECT *
+                FROM pg_index i, unnest(i.indkey, i.indoption) WITH ORDINALITY koi(key, option, arridx)
+            ) idx
+            LEFT JOIN pg_class c ON idx.indrelid = c.oid
+            LEFT JOIN pg_class c2 ON idx.indexrelid = c2.oid
+            LEFT JOIN pg_am am ON c2.relam = am.oid
+            LEFT JOIN pg_attribute attr ON attr.attrelid = c.oid AND attr.attnum = idx.key
+            LEFT JOIN pg_catalog.pg_namespace ns ON c.relnamespace = ns.oid
+            WHERE %s
+        ) s2
+        GROUP BY nspname, tablename, indexname, indisunique, indisprimary, amname, exprdef, attoptions;
+    """ % condition('c.relname'), params)
+    for schema, table, index, columns, unique, primary, orders, type_, definition, options in cursor.fetchall():
+        constraints = tables.setdefault((schema, table), {})
+        if index not in constraints:
+            constraints[index] = {
+                "columns": columns if columns != [None] else [],
+                "orders": orders if orders != [None] else [],
+                "primary_key": primary,
+                "unique": unique,
+                "foreign_key": None,
+                "check": False,
+                "index": True,
+                "type": type_,
+                "definition": definition,
+            }
+    return tables
+
+
+class ConstraintsCatalog(object):
+    """
+    Constraints of the tables of many schemas loaded at once on the first
+    lookup in order to avoid querying the catalog for each table.
+
+    Schemas must be invalidated once their tables are altered for their
+    constraints to be retrieved from the database again.
+    """
+
+    def __init__(self, schemas):
+        self.schemas = set(schemas)
+        self.tables = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, schema):
+        with self.lock:
+            self.schemas.discard(schema)
+
+    def get_constraints(self, cursor, schema, table_name):
+        """
+        Return the constraints of a table or `None` if they are not cached.
+        """
+        with self.lock:
+            if schema not in self.schemas:
+                return None
+            if self.tables is None:
+                self.tables = get_schemas_constraints(cursor, self.schemas)
+            return dict(self.tables.get((schema, table_name), {}))
+
+
 class SchemaConstraints(object):
-    def __init__(self, schema):
+    def __init__(self, schema, catalog=None):
         self.schema = schema
+        self.catalog = catalog
 
     def __call__(self, cursor, table_name):
         """
@@ -141,100 +279,29 @@ class SchemaConstraints(object):
         one or more columns. Also retrieve the definition of expression-based
         indexes.
         """
-        constraints = {}
-        # Loop over the key table, collecting things as constraints. The column
-        # array must return column names in the same order in which they were
-        # created.
-        # The subquery containing generate_series can be replaced with
-        # "WITH ORDINALITY" when support for PostgreSQL 9.3 is dropped.
-        cursor.execute("""
-            SELECT
-                c.conname,
-                array(
-                    SELECT attname
-                    FROM (
-                        SELECT unnest(c.conkey) AS colid,
-                               generate_series(1, array_length(c.conkey, 1)) AS arridx
-                    ) AS cols
-                    JOIN pg_attribute AS ca ON cols.colid = ca.attnum
-                    WHERE ca.attrelid = c.conrelid
-                    ORDER BY cols.arridx
-                ),
-                c.contype,
-                (SELECT fkc.relname || '.' || fka.attname
-                FROM pg_attribute AS fka
-                JOIN pg_class AS fkc ON fka.attrelid = fkc.oid
-                WHERE fka.attrelid = c.confrelid AND fka.attnum = c.confkey[1])
-            FROM pg_constraint AS c
-            JOIN pg_class AS cl ON c.conrelid = cl.oid
-            JOIN pg_namespace AS ns ON cl.relnamespace = ns.oid
-            WHERE ns.nspname = %s AND cl.relname = %s
-        """, [self.schema, table_name])
-        for constraint, columns, kind, used_cols in cursor.fetchall():
-            constraints[constraint] = {
-                "columns": columns,
-                "primary_key": kind == "p",
-                "unique": kind in ["p", "u"],
-                "foreign_key": tuple(used_cols.split(".", 1)) if kind == "f" else None,
-                "check": kind == "c",
-                "index": False,
-                "definition": None,
-            }
-        # Now get indexes
-        cursor.execute("""
-            SELECT
-                indexname, array_agg(attname ORDER BY arridx), indisunique, indisprimary,
-                array_agg(ordering ORDER BY arridx), amname, exprdef, s2.attoptions
-            FROM (
-                SELECT
-                    c2.relname as indexname, idx.*, attr.attname, am.amname,
-                    CASE
-                        WHEN idx.indexprs IS NOT NULL THEN
-                            pg_get_indexdef(idx.indexrelid)
-                    END AS exprdef,
-                    CASE am.amname
-                        WHEN 'btree' THEN
-                            CASE (option & 1)
-                                WHEN 1 THEN 'DESC' ELSE 'ASC'
-                            END
-                    END as ordering,
-                    c2.reloptions as attoptions
-                FROM (
-                    SELECT *
-                    FROM pg_index i, unnest(i.indkey, i.indoption) WITH ORDINALITY koi(key, option, arridx)
-                ) idx
-                LEFT JOIN pg_class c ON idx.indrelid = c.oid
-                LEFT JOIN pg_class c2 ON idx.indexrelid = c2.oid
-                LEFT JOIN pg_am am ON c2.relam = am.oid
-                LEFT JOIN pg_attribute attr ON attr.attrelid = c.oid AND attr.attnum = idx.key
-                LEFT JOIN pg_catalog.pg_namespace ns ON c.relnamespace = ns.oid
-                WHERE ns.nspname = %s AND c.relname = %s
-            ) s2
-            GROUP BY indexname, indisunique, indisprimary, amname, exprdef, attoptions;
-        """, [self.schema, table_name])
-        for index, columns, unique, primary, orders, type_, definition, options in cursor.fetchall():
-            if index not in constraints:
-                constraints[index] = {
-                    "columns": columns if columns != [None] else [],
-                    "orders": orders if orders != [None] else [],
-                    "primary_key": primary,
-                    "unique": unique,
-                    "foreign_key": None,
-                    "check": False,
-                    "index": True,
-                    "type": type_,
-                    "definition": definition,
-                }
-        return constraints
+        if self.catalog is not None:
+            constraints = self.catalog.get_constraints(cursor, self.schema, table_name)
+            if constraints is not None:
+                return constraints
+        tables = get_schemas_constraints(cursor, [self.schema], table_name)
+        return tables.get((self.schema, table_name), {})
 
 
 @contextmanager
-def patch_connection_introspection(connection, schema):
+def patch_connection_introspection(connection, schema, catalog=None):
     if connection.vendor == 'postgresql':
         get_constraints = connection.introspection.get_constraints
-        connection.introspection.get_constraints = SchemaConstraints(schema)
+        connection.introspection.get_constraints = SchemaConstraints(schema, catalog)
     try:
         yield
     finally:
         if connection.vendor == 'postgresql':
             connection.introspection.get_constraints = get_constraints
+
+
+def uses_attached_databases(connection):
+    """
+    Return whether or not tenants are stored in their own SQLite database
+    attached to `connection` as a schema.
+    """
+    return getattr(connection.features, 'uses_attached_tenant_databases', False)
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+from django.apps.registry import Apps
+from django.db import models
+from django.db.migrations.loader import MigrationLoader
+from django.utils.encoding import python_2_unicode_compatible
+
+_migration_loader = []
+
+
+def get_migration_loader():
+    """
+    Return the migration loader of the process. It's only loaded once since
+    loading it imports all the migration modules and the tenant models only
+    reflect the migrations that were on disk when the process started anyway.
+    """
+    if not _migration_loader:
+        _migration_loader.append(MigrationLoader(None, ignore_no_migrations=True))
+    return _migration_loader[0]
+
+
+def get_migration_graph():
+    return get_migration_loader().graph
+
+
+def clear_migration_loader():
+    """
+    Discard the migration loader loaded by `get_migration_loader`.
+    """
+    del _migration_loader[:]
+
+
+class TenantSchemaVersions(object):
+    """
+    Deals with storing the migrations reflected by the schema of each tenant
+    when it was created from the current state of the tenant models.
+
+    The leaf nodes of the migration graph are stored since the models are
+    expected to be in the state they describe. Tenant operations of these
+    migrations and their dependencies are then skipped for the tenant.
+    """
+
+    @python_2_unicode_compatible
+    class Version(models.Model):
+        tenant = models.CharField(max_length=255)
+        app = models.CharField(max_length=255)
+        name = models.CharField(max_length=255)
+
+        class Meta:
+            apps = Apps()
+            app_label = 'tenancy'
+            db_table = 'tenancy_schema_version'
+            unique_together = ('tenant', 'app')
+
+        def __str__(self):
+            return "Schema of %s created at migration %s for %s" % (self.tenant, self.name, self.app)
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def versions(self):
+        return self.Version.objects.using(self.connection.alias)
+
+    def has_table(self):
+        with self.connection.cursor() as cursor:
+            tables = self.connection.introspection.table_names(cursor)
+        return self.Version._meta.db_table in tables
+
+    def ensure_schema(self, schema_editor):
+        if not self.has_table():
+            schema_editor.create_model(self.Version)
+
+    def record(self, tenant):
+        """
+        Record the schema of `tenant` as being up to date with the migrations
+        the tenant models of the process reflect.
+        """
+        graph = get_migration_graph()
+        self.clear(tenant)
+        self.versions.bulk_create(
+            self.Version(tenant=tenant.db_schema, app=app_label, name=name)
+            for app_label, name in graph.leaf_nodes()
+        )
+
+    def get_current_tenants(self, graph, key):
+        """
+        Return the schemas of the tenants created after the migration `key`
+        of `graph` was written.
+        """
+        if not self.has_table():
+            return set()
+        plans = {}
+        current = set()
+        for tenant, app_label, name in self.versions.values_list('tenant', 'app', 'name'):
+            node = (app_label, name)
+            if node not in plans:
+                plans[node] = set(graph.forwards_plan(node)) if node in graph.nodes else set()
+            if key in plans[node]:
+                current.add(tenant)
+        return current
+
+    def forget(self, tenants):
+        """
+        Forget about the versions of the schemas of `tenants`, usually
+        because migrations they reflect were unapplied.
+        """
+        if self.has_table():
+            self.versions.filter(tenant__in=tenants).delete()
+
+    def clear(self, tenant):
+        if self.has_table():
+            self.versions.filter(tenant=tenant.db_schema).delete()
@@ -9,7 +9,8 @@ from django.db import models
 from django.db.models.fields.related import ForeignObject
 
 from tenancy.compat import private_only_attr
-from tenancy.models import Tenant, TenantModel
+from tenancy.managers import TenantManager
+from tenancy.models import AbstractProvisionedTenant, Tenant, TenantModel
 from tenancy.utils import model_sender_signals
 
 from .managers import ManagerOtherSubclass, ManagerSubclass
@@ -20,6 +21,22 @@ class NonTenantModel(models.Model):
         app_label = 'tests'
 
 
+class ProvisionedTenant(AbstractProvisionedTenant):
+    """
+    Tenant model used to test provisioning states. It's not configured as the
+    tenant model so its schema must never actually be created.
+    """
+    name = models.CharField(unique=True, max_length=20)
+
+    objects = TenantManager()
+
+    class Meta:
+        app_label = 'tests'
+
+    def natural_key(self):
+        return (self.name,)
+
+
 class AbstractNonTenant(models.Model):
     hidden_non_tenant = models.ForeignKey(NonTenantModel, on_delete=models.CASCADE, null=True)
 
@@ -0,0 +1,8 @@
+from . import *  # NOQA
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'tenancy.backends.postgresql',
+        'NAME': 'tenancy'
+    }
+}
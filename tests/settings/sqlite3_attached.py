@@ -0,0 +1,7 @@
+from . import *  # NOQA
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'tenancy.backends.sqlite3',
+    }
+}
@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+
+import os
+import threading
+from unittest import skipUnless
+
+from django.db import connection, connections, transaction
+from django.db.models import CharField, Value
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from tenancy.models import Tenant
+from tenancy.utils import uses_attached_databases
+
+from .models import RelatedTenantModel, SpecificModel
+from .utils import TenancyTestCase
+
+
+@skipUnless(uses_attached_databases(connection), 'Requires the tenancy.backends.sqlite3 backend.')
+class AttachedDatabasesTest(TenancyTestCase):
+    def test_database_file(self):
+        path = connection.get_tenant_database_path(self.tenant.db_schema)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.tenant.specificmodels.count(), 0)
+        self.assertIn(self.tenant.db_schema, connection.attached_tenant_databases)
+        self.tenant.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertNotIn(self.tenant.db_schema, connection.attached_tenant_databases)
+
+    def test_isolated_tables(self):
+        tenant_model = self.tenant.specificmodels.model
+        other_tenant_model = self.other_tenant.specificmodels.model
+        tenant_model.objects.create()
+        self.assertEqual(tenant_model.objects.count(), 1)
+        self.assertEqual(other_tenant_model.objects.count(), 0)
+        with connection.cursor() as cursor:
+            main_tables = set(
+                name for name, in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            )
+        self.assertNotIn(SpecificModel._meta.db_table, main_tables)
+        self.assertNotIn(tenant_model._meta.db_table, main_tables)
+
+    def test_foreign_keys(self):
+        specific = self.tenant.specificmodels.create()
+        related = self.tenant.related_tenant_models.create(fk=specific)
+        related.m2m.add(specific)
+        self.assertEqual(list(specific.fks.all()), [related])
+        self.assertEqual(list(RelatedTenantModel.for_tenant(self.tenant).objects.filter(m2m=specific)), [related])
+
+    def test_synchronization(self):
+        tenants = {}
+
+        def attached():
+            connections['default'].ensure_connection()
+            tenants['before'] = set(connections['default'].attached_tenant_databases)
+            tenants['tenant'] = Tenant.objects.create(name='thread')
+            tenants['after'] = set(connections['default'].attached_tenant_databases)
+            connections['default'].close()
+
+        thread = threading.Thread(target=attached)
+        thread.start()
+        thread.join()
+        # The tenants cache is thread local.
+        tenant = Tenant.objects.get(pk=tenants['tenant'].pk)
+        # Tenant databases are attached on demand.
+        self.assertEqual(tenants['before'], set())
+        self.assertEqual(tenants['after'], {tenant.db_schema})
+        self.assertNotIn(tenant.db_schema, connection.attached_tenant_databases)
+        self.assertEqual(tenant.specificmodels.count(), 0)
+        self.assertIn(tenant.db_schema, connection.attached_tenant_databases)
+        tenant.delete()
+
+    def test_many_tenants(self):
+        max_attached = connection.get_max_attached_databases()
+        tenants = [Tenant.objects.create(name="tenant%d" % i) for i in range(max_attached + 2)]
+        for tenant in tenants:
+            tenant.specificmodels.create()
+        for tenant in tenants:
+            self.assertEqual(tenant.specificmodels.count(), 1)
+        # The least recently used databases are detached.
+        self.assertEqual(list(connection.attached_tenant_databases), [
+            tenant.db_schema for tenant in tenants[-max_attached:]
+        ])
+        self.assertEqual(
+            set(table.name.split('"."')[0] for table in connection.introspection.get_table_list(
+                connection.cursor()
+            ) if '"."' in table.name),
+            set(tenant.db_schema for tenant in tenants + [self.tenant, self.other_tenant])
+        )
+
+
+@skipUnless(hasattr(connection, 'set_tenant_schema'), 'Requires the tenancy.backends.postgresql backend.')
+class PooledDatabaseTest(TenancyTestCase):
+    def test_set_tenant_schema(self):
+        with CaptureQueriesContext(connection) as queries:
+            connection.set_tenant_schema(self.tenant.db_schema)
+            connection.set_tenant_schema(self.tenant.db_schema)
+            connection.set_tenant_schema(None)
+        self.assertEqual(len(queries), 2)
+
+    def test_to_positional_placeholders(self):
+        from tenancy.backends.postgresql.base import to_positional_placeholders
+        self.assertEqual(
+            to_positional_placeholders("SELECT %s WHERE name LIKE '%%a' AND id = %s"),
+            ("SELECT $1 WHERE name LIKE '%a' AND id = $2", 2)
+        )
+
+    @override_settings(TENANCY_UNQUALIFIED_TABLES=True)
+    def test_unqualified_tables(self):
+        tenant = Tenant.objects.create(name='unqualified')
+        other_tenant = Tenant.objects.create(name='other_unqualified')
+        model = tenant.specificmodels.model
+        self.assertEqual(model._meta.db_table, SpecificModel._meta.db_table)
+        model.objects.create()
+        self.assertEqual(model.objects.count(), 1)
+        self.assertEqual(other_tenant.specificmodels.count(), 0)
+        self.assertEqual(connection.tenant_schema, other_tenant.db_schema)
+
+    def test_prepared_statements(self):
+        model = self.tenant.specificmodels.model
+        connection.settings_dict['PREPARE_THRESHOLD'] = 2
+        try:
+            for _ in range(3):
+                list(model.objects.filter(pk=1))
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM pg_prepared_statements')
+                self.assertEqual(cursor.fetchone()[0], 1)
+        finally:
+            del connection.settings_dict['PREPARE_THRESHOLD']
+
+    def test_unpreparable_statements(self):
+        # PostgreSQL can't infer the type of the parameter of the annotation.
+        queryset = self.tenant.specificmodels.annotate(value=Value('value', output_field=CharField()))
+        self.tenant.specificmodels.create()
+        connection.settings_dict['PREPARE_THRESHOLD'] = 2
+        try:
+            with transaction.atomic():
+                for _ in range(3):
+                    self.assertEqual([obj.value for obj in queryset], ['value'])
+                self.assertEqual(self.tenant.specificmodels.count(), 1)
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM pg_prepared_statements')
+                self.assertEqual(cursor.fetchone()[0], 0)
+        finally:
+            del connection.settings_dict['PREPARE_THRESHOLD']
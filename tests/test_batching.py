@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tenancy.batching import bulk_update, iterate_keyset
+from tenancy.models import Tenant
+
+from .models import NonTenantModel
+from .utils import TenancyTestCase
+
+
+class BatchingTest(TenancyTestCase):
+    def setUp(self):
+        super(BatchingTest, self).setUp()
+        self.model = self.tenant.specificmodels.model
+        self.objs = [self.model.objects.create() for _ in range(5)]
+
+    def test_iterate_keyset(self):
+        batches = list(iterate_keyset(self.model.objects.all(), 2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual([obj.pk for batch in batches for obj in batch], [obj.pk for obj in self.objs])
+
+    def test_iterate_keyset_altered(self):
+        # Altering objects out of the queryset doesn't skip any of them.
+        seen = []
+        for batch in iterate_keyset(self.model.objects.filter(date=None), 2):
+            seen.extend(obj.pk for obj in batch)
+            self.model.objects.filter(pk__in=[obj.pk for obj in batch]).update(date=datetime.date.today())
+        self.assertEqual(seen, [obj.pk for obj in self.objs])
+
+    def test_bulk_update(self):
+        non_tenant = NonTenantModel.objects.create()
+        for day, obj in enumerate(self.objs, start=1):
+            obj.date = datetime.date(2000, 1, day)
+            obj.non_tenant = non_tenant
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk_update(self.objs, ['date', 'non_tenant'], batch_size=3), 5)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(
+            list(self.model.objects.order_by('pk').values_list('date', 'non_tenant')),
+            [(datetime.date(2000, 1, day), non_tenant.pk) for day in range(1, 6)]
+        )
+        # Other tenants are not affected.
+        other_model = Tenant.objects.get(name='other_tenant').specificmodels.model
+        self.assertFalse(other_model.objects.exists())
+
+    def test_bulk_update_empty(self):
+        self.assertEqual(bulk_update([], ['date']), 0)
@@ -5,6 +5,8 @@ from unittest import skipUnless
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.db import connection, connections, router, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
 from django.db.transaction import atomic
 from django.db.utils import DatabaseError
 from django.test.testcases import TransactionTestCase
@@ -12,8 +14,10 @@ from django.test.utils import override_settings
 from django.utils.six import StringIO
 
 from tenancy.compat import get_remote_field
-from tenancy.models import Tenant, TenantModelBase
+from tenancy.management.plan import plan_tenant_migrations, project_duration
+from tenancy.models import Tenant, TenantModelBase, db_schema_table
 from tenancy.signals import post_schema_deletion, pre_schema_creation
+from tenancy.utils import uses_attached_databases
 
 from .utils import TenancyTestCase, mock_inputs
 
@@ -44,7 +48,7 @@ class CreateTenantCommandTest(TransactionTestCase):
         stdout.seek(0)
         connection = connections[tenant._state.db]
         try:
-            if connection.vendor == 'postgresql':
+            if connection.vendor == 'postgresql' or uses_attached_databases(connection):
                 self.assertIn(tenant.db_schema, stdout.readline())
             for model in TenantModelBase.references:
                 if not model._meta.proxy and not model._meta.auto_created:
@@ -157,3 +161,106 @@ class SchemaAuthorizationTest(TenancyTestCase):
             transaction.savepoint_rollback(sid, db)
             cursor.execute('RESET ROLE')
             transaction.commit(db)
+
+
+@override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.parallel_add_field'})
+class TenantMigrateCommandTest(TenancyTestCase):
+    def setUp(self):
+        super(TenantMigrateCommandTest, self).setUp()
+        call_command('tenantmigrate', 'tests', '0001', interactive=False, stdout=StringIO())
+
+    def tearDown(self):
+        call_command('tenantmigrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        super(TenantMigrateCommandTest, self).tearDown()
+        MigrationRecorder(connection).flush()
+
+    def test_plan(self):
+        table_name = 'tests_parallel'
+        if connection.vendor != 'postgresql':
+            table_name = db_schema_table(self.tenant, table_name)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SET search_path = %s" % self.tenant.db_schema)
+            for _ in range(3):
+                cursor.execute("INSERT INTO %s DEFAULT VALUES" % connection.ops.quote_name(table_name))
+            if connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE tests_parallel')
+                cursor.execute('RESET search_path')
+        stdout = StringIO()
+        call_command(
+            'tenantmigrate', 'tests', plan=True, concurrency=2, rows_per_second=1, tenant_overhead=1,
+            verbosity=2, stdout=stdout
+        )
+        output = stdout.getvalue()
+        self.assertIn('Apply tests.0002_add_field:', output)
+        self.assertIn('Add field added to Parallel on tests_parallel (may rewrite the table)', output)
+        self.assertIn('2 tenant(s), 3 row(s)', output)
+        self.assertIn("%s: 3 row(s), estimated 4.00s" % self.tenant.db_schema, output)
+        self.assertIn("%s: 0 row(s), estimated 1.00s" % self.other_tenant.db_schema, output)
+        self.assertIn('Estimated duration: 4.0s with a concurrency of 2.', output)
+        # Nothing was migrated.
+        self.assertNotIn(('tests', '0002_add_field'), MigrationRecorder(connection).applied_migrations())
+
+    def test_plan_nothing(self):
+        stdout = StringIO()
+        call_command('tenantmigrate', 'tests', '0001', plan=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'No tenant operations to perform.\n')
+
+    def test_project_duration(self):
+        self.assertEqual(project_duration([3, 1, 1, 1], 2), 3)
+        self.assertEqual(project_duration([1, 1, 3], 2), 4)
+        self.assertEqual(project_duration([1, 1, 3], 1), 5)
+
+
+@override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.plan'})
+class PlanTenantMigrationsTest(TenancyTestCase):
+    def tearDown(self):
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        super(PlanTenantMigrationsTest, self).tearDown()
+        MigrationRecorder(connection).flush()
+
+    def test_backwards(self):
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        plans = plan_tenant_migrations(MigrationExecutor(connection), [('tests', '0001_create_model')])
+        # Tables are looked up in the state each operation leaves behind.
+        self.assertEqual(
+            [(type(plan.operation).__name__, plan.backwards, plan.table) for plan in plans],
+            [('RenameModel', True, 'tests_replanned'), ('AddField', True, 'tests_planned')]
+        )
+
+
+def tenant_name(tenant, suffix=''):
+    return tenant.name + suffix
+
+
+class TenantExecCommandTest(TenancyTestCase):
+    def test_callable(self):
+        stdout = StringIO()
+        call_command('tenantexec', 'tests.test_commands.tenant_name', '!', stdout=stdout, verbosity=0)
+        output = stdout.getvalue()
+        self.assertIn("('tenant',):\ntenant!\n", output)
+        self.assertIn("('other_tenant',):\nother_tenant!\n", output)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('tenantexec', 'check', tenants=[['tenant']], stdout=stdout, verbosity=0)
+        self.assertIn("('tenant',):\nSystem check identified no issues", stdout.getvalue())
+        self.assertNotIn('other_tenant', stdout.getvalue())
+
+    def test_progress(self):
+        stdout = StringIO()
+        call_command('tenantexec', 'tests.test_commands.tenant_name', workers=2, stdout=stdout)
+        self.assertIn('[2/2] Processed tenant', stdout.getvalue())
+
+    def test_failure(self):
+        stderr = StringIO()
+        with self.assertRaisesMessage(CommandError, '2 of 2 tenant(s) failed.'):
+            call_command('tenantexec', 'tests.test_commands.tenant_name', '1', '2', stderr=stderr)
+        # Errors are only reported once.
+        self.assertEqual(stderr.getvalue().count("Failed to process tenant ('tenant',)"), 1)
+
+    def test_unknown_target(self):
+        with self.assertRaisesMessage(CommandError, "Unknown command: 'unknown'"):
+            call_command('tenantexec', 'unknown')
+        with self.assertRaisesMessage(CommandError, "Cannot import 'tests.unknown'"):
+            call_command('tenantexec', 'tests.unknown')
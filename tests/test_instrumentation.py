@@ -0,0 +1,172 @@
+from __future__ import unicode_literals
+
+from unittest import skipUnless
+
+from django.db import DatabaseError, connection, transaction
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from tenancy.instrumentation import (
+    MemoryQueryCollector, TenantQueryStats, get_query_collector,
+    get_session_settings_sql, get_sql_comment, instrument_tenant,
+)
+from tenancy.models import Tenant
+
+from .client import TenantClient
+from .models import SpecificModel
+from .utils import MIDDLEWARE_SETTING, TenancyTestCase
+
+COLLECTOR = 'tenancy.instrumentation.MemoryQueryCollector'
+
+
+class TenantQueryStatsTest(TenancyTestCase):
+    def test_slowest(self):
+        stats = TenantQueryStats(slowest_count=2)
+        for duration in (0.1, 0.3, 0.2):
+            stats.add("SELECT %s" % duration, duration)
+        self.assertEqual(stats.count, 3)
+        self.assertAlmostEqual(stats.duration, 0.6)
+        self.assertEqual(stats.slowest, [(0.3, 'SELECT 0.3'), (0.2, 'SELECT 0.2')])
+
+
+@override_settings(TENANCY_QUERY_COLLECTOR=COLLECTOR)
+class InstrumentationTest(TenancyTestCase):
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.collector = get_query_collector()
+
+    def tearDown(self):
+        self.collector.reset()
+        super(InstrumentationTest, self).tearDown()
+
+    def test_collector(self):
+        self.assertIsInstance(self.collector, MemoryQueryCollector)
+        self.assertIs(get_query_collector(), self.collector)
+
+    def test_as_global(self):
+        with self.tenant.as_global():
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        stats = self.collector.get_stats(self.tenant.db_schema)
+        self.assertEqual(stats.count, 1)
+        self.assertIn('SELECT COUNT', stats.slowest[0][1])
+        self.assertIsNone(self.collector.get_stats(self.other_tenant.db_schema))
+        # Queries executed once the tenant is deactivated are not recorded.
+        SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertEqual(self.collector.get_stats(self.tenant.db_schema).count, 1)
+
+    def test_nested(self):
+        with instrument_tenant(connection, self.tenant):
+            with instrument_tenant(connection, self.other_tenant):
+                SpecificModel.for_tenant(self.other_tenant).objects.count()
+            SpecificModel.for_tenant(self.tenant).objects.count()
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertEqual(self.collector.get_stats(self.tenant.db_schema).count, 2)
+        self.assertEqual(self.collector.get_stats(self.other_tenant.db_schema).count, 1)
+
+    @override_settings(
+        ROOT_URLCONF='tests.urls',
+        **{MIDDLEWARE_SETTING: ['tenancy.middleware.GlobalTenantMiddleware']}
+    )
+    def test_middleware(self):
+        response = TenantClient(self.tenant).get('/global')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(getattr(connection, 'tenancy_instrumentation', None))
+
+    @override_settings(TENANCY_QUERY_COLLECTOR=None)
+    def test_disabled(self):
+        self.assertIsNone(get_query_collector())
+        with self.tenant.as_global():
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertIsNone(self.collector.get_stats(self.tenant.db_schema))
+
+
+@override_settings(TENANCY_SQL_COMMENTS=True)
+class SQLCommentsTest(TenancyTestCase):
+    def tearDown(self):
+        connection.tenancy_view_name = None
+        super(SQLCommentsTest, self).tearDown()
+
+    def test_get_sql_comment(self):
+        connection.tenancy_view_name = 'app:view'
+        self.assertEqual(
+            get_sql_comment(connection, Tenant(name="*/'")),
+            "/*tenant='%2A%2F%27',view='app%3Aview'*/"
+        )
+
+    def test_tenant_model(self):
+        with CaptureQueriesContext(connection) as queries, self.tenant.as_global():
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertTrue(queries[0]['sql'].endswith(" /*model='tests.SpecificModel',tenant='tenant'*/"))
+        # Comments are removed when the tenant is deactivated.
+        with CaptureQueriesContext(connection) as queries:
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertNotIn('/*', queries[0]['sql'])
+
+    def test_params(self):
+        with CaptureQueriesContext(connection) as queries, instrument_tenant(connection, Tenant(name='100%')):
+            SpecificModel.for_tenant(self.tenant).objects.filter(pk=1).exists()
+            Tenant.objects.filter(name='%').exists()
+        self.assertTrue(queries[0]['sql'].endswith(" /*model='tests.SpecificModel',tenant='100%25'*/"))
+        self.assertTrue(queries[1]['sql'].endswith(" /*tenant='100%25'*/"))
+
+    @override_settings(TENANCY_SQL_COMMENTS=False)
+    def test_disabled(self):
+        with CaptureQueriesContext(connection) as queries, self.tenant.as_global():
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertNotIn('/*', queries[0]['sql'])
+
+
+class SessionSettingsSQLTest(SimpleTestCase):
+    def test_get_session_settings_sql(self):
+        sql, params = get_session_settings_sql(
+            {'work_mem': '64MB', 'statement_timeout': 1000}, ['work_mem', 'lock_timeout']
+        )
+        self.assertIn('(VALUES (%s, %s), (%s, %s), (%s, %s))', sql)
+        self.assertEqual(params, ['statement_timeout', '1000', 'work_mem', '64MB', 'lock_timeout', None])
+
+
+class SessionSettingsTest(TenancyTestCase):
+    def setUp(self):
+        super(SessionSettingsTest, self).setUp()
+        self.tenant.get_session_settings = lambda: {'work_mem': '12MB'}
+
+    def show(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW %s" % name)
+            return cursor.fetchone()[0]
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    def test_as_global(self):
+        default = self.show('work_mem')
+        with self.tenant.as_global():
+            self.assertEqual(self.show('work_mem'), '12MB')
+            self.assertEqual(self.show('application_name'), "tenancy:%s" % self.tenant.db_schema)
+        self.assertEqual(self.show('work_mem'), default)
+        self.assertEqual(connection.tenancy_session_state[0], None)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    def test_rollback(self):
+        default = self.show('work_mem')
+        with self.tenant.as_global():
+            self.assertEqual(self.show('work_mem'), '12MB')
+            try:
+                with transaction.atomic():
+                    self.show('work_mem')
+                    raise ValueError
+            except ValueError:
+                pass
+        # Settings applied before the rolled back transaction are reset.
+        self.assertEqual(self.show('work_mem'), default)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    def test_unknown_setting(self):
+        self.tenant.get_session_settings = lambda: {'work_mme': '12MB'}
+        with self.tenant.as_global():
+            with self.assertRaises(DatabaseError):
+                self.show('work_mem')
+
+    @skipUnless(connection.vendor != 'postgresql', 'Requires a backend other than PostgreSQL.')
+    def test_ignored(self):
+        with CaptureQueriesContext(connection) as queries, self.tenant.as_global():
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        self.assertEqual(len(queries), 1)
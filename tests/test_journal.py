@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+
+from importlib import import_module
+from unittest import skipUnless
+
+import django
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from tenancy.journal import MigrationJournal, get_running_migration
+from tenancy.models import Tenant
+
+from .utils import TenancyTestCase
+
+run_python = import_module('tests.test_operations_migrations.journal.0002_run_python')
+
+
+@skipUnless(django.VERSION >= (1, 10), 'Requires non-atomic migrations.')
+@override_settings(
+    TENANCY_MIGRATION_JOURNAL=True,
+    MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.journal'},
+)
+class MigrationJournalTest(TenancyTestCase):
+    def setUp(self):
+        super(MigrationJournalTest, self).setUp()
+        self.journal = MigrationJournal(connection)
+
+    def tearDown(self):
+        run_python.failing.clear()
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        MigrationRecorder(connection).flush()
+        super(MigrationJournalTest, self).tearDown()
+        del run_python.calls[:]
+
+    def migrate(self):
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+
+    def get_entries(self):
+        return dict(
+            self.journal.entries.filter(name='0002_run_python').values_list('tenant', 'status')
+        )
+
+    def test_record(self):
+        self.migrate()
+        self.assertEqual(self.get_entries(), {
+            self.tenant.db_schema: MigrationJournal.APPLIED,
+            self.other_tenant.db_schema: MigrationJournal.APPLIED,
+        })
+        entry = self.journal.entries.get(name='0002_run_python', tenant=self.tenant.db_schema)
+        self.assertEqual(entry.app, 'tests')
+        self.assertEqual(entry.operation, 0)
+        self.assertEqual(entry.direction, MigrationJournal.FORWARDS)
+        self.assertIsNotNone(entry.duration)
+
+    def test_resume(self):
+        run_python.failing.add('other_tenant')
+        with self.assertRaises(ValueError):
+            self.migrate()
+        self.assertEqual(self.get_entries(), {
+            self.tenant.db_schema: MigrationJournal.APPLIED,
+            self.other_tenant.db_schema: MigrationJournal.FAILED,
+        })
+        run_python.failing.clear()
+        del run_python.calls[:]
+        self.migrate()
+        # Tenants that were already migrated are skipped.
+        self.assertEqual(run_python.calls, ['other_tenant'])
+        self.assertEqual(set(self.get_entries().values()), {MigrationJournal.APPLIED})
+
+    def test_backwards(self):
+        self.migrate()
+        call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
+        entry = self.journal.entries.get(name='0002_run_python', tenant=self.tenant.db_schema)
+        self.assertEqual(entry.direction, MigrationJournal.BACKWARDS)
+        self.assertEqual(entry.status, MigrationJournal.APPLIED)
+
+    def test_tenant_deletion(self):
+        self.migrate()
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        tenant = Tenant.objects.get(pk=self.tenant.pk)
+        db_schema = tenant.db_schema
+        tenant.delete()
+        self.assertFalse(self.journal.entries.filter(tenant=db_schema).exists())
+        self.assertTrue(self.journal.entries.filter(tenant=self.other_tenant.db_schema).exists())
+
+    def test_get_running_migration(self):
+        operation = run_python.Migration.operations[0]
+        migration, index = get_running_migration(operation, 'tests')
+        self.assertEqual((migration.app_label, migration.name, index), ('tests', '0002_run_python', 0))
+        self.assertIsNone(get_running_migration(operation, 'tenancy'))
+
+    @override_settings(TENANCY_MIGRATION_JOURNAL=False)
+    def test_tenant_deletion_disabled(self):
+        has_table = MigrationJournal.has_table
+        MigrationJournal.has_table = lambda journal: self.fail('The journal table was introspected.')
+        try:
+            self.tenant.delete()
+        finally:
+            MigrationJournal.has_table = has_table
+
+    @override_settings(TENANCY_MIGRATION_JOURNAL=False)
+    def test_disabled(self):
+        self.migrate()
+        self.assertEqual(sorted(run_python.calls), ['other_tenant', 'tenant'])
+        self.assertFalse(self.journal.has_table() and self.get_entries())
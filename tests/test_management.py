@@ -0,0 +1,370 @@
+from __future__ import unicode_literals
+
+import datetime
+import json
+import os
+import tarfile
+import tempfile
+from io import BytesIO
+from unittest import skipUnless
+
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test.testcases import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from tenancy import management
+from tenancy.management import (
+    SCHEMA_PLACEHOLDER, TOMBSTONE_PREFIX, _schema_ddl_templates,
+    clear_schema_ddl_cache, get_tenant_schema_ddl, provision_pending_tenants,
+    provision_tenant, purge_tenant_tombstones,
+)
+from tenancy.management.snapshot import restore_tenant, snapshot_tenant
+from tenancy.models import Tenant
+from tenancy.signals import provisioning_requested
+from tenancy.utils import uses_attached_databases
+
+from .client import TenantClient
+from .models import PostInitFieldsModel, ProvisionedTenant
+from .utils import MIDDLEWARE_SETTING, TenancyTestCase
+
+
+class SchemaDDLCacheTest(TenancyTestCase):
+    def setUp(self):
+        clear_schema_ddl_cache()
+        super(SchemaDDLCacheTest, self).setUp()
+
+    def tearDown(self):
+        super(SchemaDDLCacheTest, self).tearDown()
+        MigrationRecorder(connection).flush()
+
+    def test_templates_cached(self):
+        self.assertEqual(len(_schema_ddl_templates), 1)
+        templates, = _schema_ddl_templates.values()
+        self.assertTrue(templates)
+        for template in templates:
+            self.assertNotIn(self.tenant.db_schema, template)
+            self.assertNotIn(self.other_tenant.db_schema, template)
+        self.assertTrue(any(SCHEMA_PLACEHOLDER in template for template in templates))
+
+    def test_templated_schema_usable(self):
+        """
+        Tenants provisioned from cached templates must be fully functional.
+        """
+        self.other_tenant.specificmodels.create()
+        self.assertEqual(self.other_tenant.specificmodels.count(), 1)
+        self.assertEqual(self.tenant.specificmodels.count(), 0)
+
+    def test_recreated_tenant(self):
+        self.other_tenant.delete()
+        self.other_tenant = Tenant.objects.create(name='other_tenant')
+        self.assertEqual(self.other_tenant.specificmodels.count(), 0)
+
+    def test_identifier_collision(self):
+        clear_schema_ddl_cache()
+        # The schema of the tenant is part of the hidden_non_tenant_id column.
+        tenant = Tenant.objects.create(name='id')
+        self.assertEqual(_schema_ddl_templates, {})
+        self.assertEqual(tenant.specificmodels.count(), 0)
+
+    def test_schema_outside_qualifiers(self):
+        clear_schema_ddl_cache()
+        statement = "COMMENT ON TABLE %s.%s IS '%s'" % (
+            connection.ops.quote_name(self.tenant.db_schema), connection.ops.quote_name('table'),
+            self.tenant.db_schema,
+        )
+        collect_tenant_schema_ddl = management.collect_tenant_schema_ddl
+        management.collect_tenant_schema_ddl = lambda tenant, connection, models: [statement]
+        try:
+            self.assertEqual(get_tenant_schema_ddl(self.tenant, connection, []), [statement])
+        finally:
+            management.collect_tenant_schema_ddl = collect_tenant_schema_ddl
+        self.assertEqual(_schema_ddl_templates, {})
+
+    @override_settings(TENANCY_SCHEMA_DDL_CACHE=False)
+    def test_disabled(self):
+        clear_schema_ddl_cache()
+        tenant = Tenant.objects.create(name='uncached')
+        self.assertEqual(_schema_ddl_templates, {})
+        self.assertEqual(tenant.specificmodels.count(), 0)
+
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.create_model'})
+    def test_cleared_on_tenant_migration(self):
+        self.assertTrue(_schema_ddl_templates)
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        self.assertEqual(_schema_ddl_templates, {})
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
+
+class TenantProvisioningTest(TransactionTestCase):
+    def setUp(self):
+        self.provisioned = []
+        self.requested = []
+        self.dropped = []
+        self.create_tenant_schema = management.create_tenant_schema
+        management.create_tenant_schema = self.fake_create_tenant_schema
+        self.drop_tenant_schema = management.drop_tenant_schema
+        management.drop_tenant_schema = lambda tenant, using=None: self.dropped.append(tenant.name)
+        provisioning_requested.connect(self.receive_request, sender=ProvisionedTenant)
+
+    def tearDown(self):
+        ProvisionedTenant.objects.clear_cache()
+        management.create_tenant_schema = self.create_tenant_schema
+        management.drop_tenant_schema = self.drop_tenant_schema
+        provisioning_requested.disconnect(self.receive_request, sender=ProvisionedTenant)
+
+    def fake_create_tenant_schema(self, tenant, using=None):
+        if tenant.name == 'broken':
+            raise ValueError('Broken')
+        self.provisioned.append(tenant.name)
+
+    def receive_request(self, tenant, using, **kwargs):
+        self.requested.append(tenant.name)
+
+    @override_settings(TENANCY_ASYNC_PROVISIONING=True)
+    def test_save_defers_provisioning(self):
+        tenant = ProvisionedTenant.objects.create(name='pending')
+        self.assertEqual(tenant.provisioning_state, ProvisionedTenant.PROVISIONING_PENDING)
+        self.assertFalse(tenant.is_provisioned())
+        self.assertEqual(self.requested, ['pending'])
+        self.assertEqual(self.provisioned, [])
+
+    @override_settings(TENANCY_ASYNC_PROVISIONING=True)
+    def test_provision_tenant(self):
+        tenant = ProvisionedTenant.objects.create(name='pending')
+        self.assertTrue(provision_tenant(tenant))
+        self.assertEqual(self.provisioned, ['pending'])
+        self.assertTrue(tenant.is_provisioned())
+        self.assertEqual(
+            ProvisionedTenant.objects.get(pk=tenant.pk).provisioning_state,
+            ProvisionedTenant.PROVISIONING_READY
+        )
+        # Tenants can only be claimed once.
+        self.assertFalse(provision_tenant(tenant))
+        self.assertEqual(self.provisioned, ['pending'])
+
+    @override_settings(TENANCY_ASYNC_PROVISIONING=True)
+    def test_is_provisioned_refresh(self):
+        tenant = ProvisionedTenant.objects.create(name='pending')
+        provision_tenant(ProvisionedTenant.objects.get(pk=tenant.pk))
+        self.assertFalse(tenant.is_provisioned())
+        self.assertTrue(tenant.is_provisioned(refresh=True))
+
+    @override_settings(TENANCY_ASYNC_PROVISIONING=True)
+    def test_provision_pending_tenants(self):
+        ProvisionedTenant.objects.create(name='first')
+        broken = ProvisionedTenant.objects.create(name='broken')
+        ProvisionedTenant.objects.create(name='second')
+        self.assertEqual(provision_pending_tenants(ProvisionedTenant), 2)
+        self.assertEqual(self.provisioned, ['first', 'second'])
+        broken.refresh_from_db()
+        self.assertEqual(broken.provisioning_state, ProvisionedTenant.PROVISIONING_FAILED)
+        self.assertEqual(provision_pending_tenants(ProvisionedTenant), 0)
+
+    @override_settings(TENANCY_ASYNC_PROVISIONING=True, TENANCY_PROVISIONING_STALE_TIMEOUT=60)
+    def test_stale_provisioning(self):
+        tenant = ProvisionedTenant.objects.create(name='stale')
+        tenants = ProvisionedTenant.objects.filter(pk=tenant.pk)
+        tenants.update(
+            provisioning_state=ProvisionedTenant.PROVISIONING_IN_PROGRESS,
+            provisioning_started_at=timezone.now() - datetime.timedelta(seconds=30),
+        )
+        self.assertEqual(provision_pending_tenants(ProvisionedTenant), 0)
+        # The worker that claimed the tenant is assumed to have crashed.
+        tenants.update(provisioning_started_at=timezone.now() - datetime.timedelta(seconds=90))
+        self.assertEqual(provision_pending_tenants(ProvisionedTenant), 1)
+        self.assertEqual(self.dropped, ['stale'])
+        self.assertEqual(self.provisioned, ['stale'])
+        self.assertEqual(tenants.get().provisioning_state, ProvisionedTenant.PROVISIONING_READY)
+
+    @override_settings(
+        ROOT_URLCONF='tests.urls',
+        **{MIDDLEWARE_SETTING: ['tenancy.middleware.TenantProvisioningMiddleware']}
+    )
+    def test_middleware(self):
+        with self.settings(TENANCY_ASYNC_PROVISIONING=True):
+            tenant = ProvisionedTenant.objects.create(name='pending')
+        client = TenantClient(tenant)
+        response = client.get('/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        provision_tenant(ProvisionedTenant.objects.get(pk=tenant.pk))
+        self.assertEqual(client.get('/').status_code, 200)
+
+
+@override_settings(TENANCY_DEFERRED_SCHEMA_DROP=True)
+class DeferredSchemaDropTest(TenancyTestCase):
+    def tearDown(self):
+        super(DeferredSchemaDropTest, self).tearDown()
+        while purge_tenant_tombstones():
+            pass
+
+    def get_tombstones(self):
+        if uses_attached_databases(connection):
+            directory = connection.get_tenant_databases_dir()
+            return [filename for filename in os.listdir(directory) if filename.endswith('.tombstone')]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname LIKE %s", [TOMBSTONE_PREFIX + '%'])
+            return [row[0] for row in cursor.fetchall()]
+
+    @skipUnless(
+        connection.vendor == 'postgresql' or uses_attached_databases(connection),
+        'Requires schemas or attached databases.'
+    )
+    def test_deferred_drop(self):
+        content_type = ContentType.objects.get_for_model(self.tenant.specificmodels.model)
+        self.tenant.specificmodels.create()
+        self.tenant.delete()
+        self.assertFalse(ContentType.objects.filter(pk=content_type.pk).exists())
+        self.assertEqual(len(self.get_tombstones()), 1)
+        # The schema is immediately available for reuse.
+        tenant = Tenant.objects.create(name='tenant')
+        self.assertEqual(tenant.specificmodels.count(), 0)
+        self.assertEqual(self.other_tenant.specificmodels.count(), 0)
+        while purge_tenant_tombstones(batch_size=1):
+            pass
+        self.assertEqual(self.get_tombstones(), [])
+        self.assertEqual(purge_tenant_tombstones(), 0)
+
+    @skipUnless(
+        connection.vendor == 'postgresql' or uses_attached_databases(connection),
+        'Requires schemas or attached databases.'
+    )
+    def test_deferred_drop_permissions(self):
+        content_type = ContentType.objects.get_for_model(self.tenant.specificmodels.model)
+        permission = Permission.objects.create(content_type=content_type, codename='tenant', name='Tenant')
+        user = User.objects.create(username='user')
+        user.user_permissions.add(permission)
+        group = Group.objects.create(name='group')
+        group.permissions.add(permission)
+        self.tenant.delete()
+        self.assertFalse(Permission.objects.filter(pk=permission.pk).exists())
+        self.assertFalse(User.user_permissions.through.objects.filter(permission_id=permission.pk).exists())
+        self.assertFalse(Group.permissions.through.objects.filter(permission_id=permission.pk).exists())
+
+    @skipUnless(
+        connection.vendor == 'postgresql' or uses_attached_databases(connection),
+        'Requires schemas or attached databases.'
+    )
+    def test_deferred_drop_related_objects(self):
+        content_type = ContentType.objects.get_for_model(self.tenant.specificmodels.model)
+        # Objects referencing the content types are cascaded.
+        self.other_tenant.postinits.create(content_type=content_type, object_id=1)
+        self.tenant.delete()
+        self.assertFalse(ContentType.objects.filter(pk=content_type.pk).exists())
+        self.assertEqual(self.other_tenant.postinits.count(), 0)
+
+    @skipUnless(
+        connection.vendor == 'postgresql' or uses_attached_databases(connection),
+        'Requires schemas or attached databases.'
+    )
+    def test_deferred_drop_references(self):
+        # Tenant model references don't have a table to query.
+        table = connection.ops.quote_name(PostInitFieldsModel._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            self.tenant.delete()
+        self.assertFalse([query for query in queries if (' FROM %s ' % table) in query['sql']])
+
+    def test_command(self):
+        self.tenant.delete()
+        stdout = StringIO()
+        call_command('purgetenanttombstones', batch_size=1, stdout=stdout, verbosity=2)
+        self.assertIn('Purged', stdout.getvalue())
+        self.assertEqual(purge_tenant_tombstones(), 0)
+
+
+class TenantSnapshotTest(TenancyTestCase):
+    def populate(self, tenant):
+        specific = tenant.specificmodels.create(date=datetime.date(2015, 1, 1))
+        related = tenant.related_tenant_models.create(fk=specific)
+        related.m2m.add(specific)
+        tenant.postinits.create(content_object=specific)
+        return specific
+
+    def snapshot(self, tenant):
+        fileobj = BytesIO()
+        snapshot_tenant(tenant, fileobj)
+        fileobj.seek(0)
+        return fileobj
+
+    def assertPopulated(self, tenant):
+        specific = tenant.specificmodels.get()
+        self.assertEqual(specific.date, datetime.date(2015, 1, 1))
+        related = tenant.related_tenant_models.get()
+        self.assertEqual(related.fk, specific)
+        self.assertEqual(list(related.m2m.all()), [specific])
+        self.assertEqual(tenant.postinits.get().content_object, specific)
+
+    def test_restore(self):
+        self.populate(self.tenant)
+        snapshot = self.snapshot(self.tenant)
+        self.tenant.specificmodels.create()
+        restore_tenant(self.tenant, snapshot)
+        self.assertPopulated(self.tenant)
+        # Sequences must account for restored rows.
+        self.tenant.specificmodels.create()
+        self.assertEqual(self.tenant.specificmodels.count(), 2)
+
+    def test_restore_permissions(self):
+        content_type = ContentType.objects.get_for_model(self.tenant.specificmodels.model)
+        permission = Permission.objects.create(content_type=content_type, codename='tenant', name='Tenant')
+        user = User.objects.create(username='user')
+        user.user_permissions.add(permission)
+        restore_tenant(self.tenant, self.snapshot(self.tenant))
+        self.assertEqual(ContentType.objects.get_for_model(self.tenant.specificmodels.model), content_type)
+        self.assertEqual(list(user.user_permissions.all()), [permission])
+
+    def test_clone(self):
+        self.populate(self.tenant)
+        restore_tenant(self.other_tenant, self.snapshot(self.tenant))
+        self.assertPopulated(self.other_tenant)
+        self.assertPopulated(self.tenant)
+
+    def test_corrupt_archive(self):
+        self.populate(self.tenant)
+        snapshot = self.snapshot(self.tenant)
+        corrupt = BytesIO()
+        with tarfile.open(fileobj=snapshot, mode='r:gz') as archive, \
+                tarfile.open(fileobj=corrupt, mode='w:gz') as corrupt_archive:
+            for info in archive.getmembers():
+                data = archive.extractfile(info).read()
+                if info.name == 'tables/tests.specificmodel':
+                    data = b'corrupt\n'
+                    info.size = len(data)
+                corrupt_archive.addfile(info, BytesIO(data))
+        corrupt.seek(0)
+        with self.assertRaises(Exception):
+            restore_tenant(self.tenant, corrupt)
+        # The existing rows survive a failed restore.
+        self.assertPopulated(Tenant.objects.get(pk=self.tenant.pk))
+
+    def test_vendor_mismatch(self):
+        snapshot = self.snapshot(self.tenant)
+        with tarfile.open(fileobj=snapshot, mode='r:gz') as archive:
+            manifest = json.loads(archive.extractfile('manifest.json').read().decode('utf-8'))
+        manifest['vendor'] = 'oracle'
+        altered = BytesIO()
+        with tarfile.open(fileobj=altered, mode='w:gz') as archive:
+            data = json.dumps(manifest).encode('utf-8')
+            info = tarfile.TarInfo('manifest.json')
+            info.size = len(data)
+            archive.addfile(info, BytesIO(data))
+        altered.seek(0)
+        with self.assertRaisesMessage(ValueError, "Snapshots taken on oracle can't be restored"):
+            restore_tenant(self.tenant, altered)
+
+    def test_commands(self):
+        self.populate(self.tenant)
+        fd, path = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(fd)
+        try:
+            call_command('snapshottenant', path, 'tenant', stdout=StringIO())
+            call_command('restoretenant', path, 'other_tenant', interactive=False, stdout=StringIO())
+        finally:
+            os.remove(path)
+        self.assertPopulated(self.other_tenant)
@@ -2,19 +2,29 @@ from __future__ import unicode_literals
 
 import contextlib
 import unittest
+from importlib import import_module
 
 import django
 from django.core.management import call_command
-from django.db import connection
+from django.db import NotSupportedError, connection
+from django.db.migrations.loader import MigrationLoader
 from django.db.migrations.recorder import MigrationRecorder
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils.six import StringIO
 
+from tenancy import operations
 from tenancy.models import Tenant, db_schema_table
-from tenancy.utils import patch_connection_introspection
+from tenancy.operations import (
+    AddField, AlterField, OnlineAddField, OnlineAlterField,
+)
+from tenancy.utils import (
+    ConstraintsCatalog, SchemaConstraints, patch_connection_introspection,
+)
 
 from .utils import TenancyTestCase
 
+online_field = import_module('tests.test_operations_migrations.online_field.0002_online_field')
+
 
 class TestTenantSchemaOperations(TenancyTestCase):
     def tearDown(self):
@@ -84,6 +94,172 @@ class TestTenantSchemaOperations(TenancyTestCase):
         for tenant in Tenant.objects.all():
             self.assertTenantTableDoesntExists(tenant, 'tests_createmodel')
 
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.create_model_many_to_many'})
+    def test_create_model_many_to_many(self):
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            self.assertTenantTableExists(tenant, 'tests_source_targets')
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            self.assertTenantTableDoesntExists(tenant, 'tests_source_targets')
+
+    @override_settings(TENANCY_MIGRATION_REUSE_SQL=True)
+    def test_can_reuse_sql(self):
+        with connection.schema_editor() as schema_editor:
+            self.assertEqual(
+                AddField('model', 'field', None).can_reuse_sql(schema_editor), connection.vendor == 'postgresql'
+            )
+            # Operations introspecting the database can't reuse SQL.
+            self.assertFalse(AlterField('model', 'field', None).can_reuse_sql(schema_editor))
+        with connection.schema_editor(collect_sql=True) as schema_editor:
+            self.assertFalse(AddField('model', 'field', None).can_reuse_sql(schema_editor))
+
+    @override_settings(
+        TENANCY_MIGRATION_REUSE_SQL=True,
+        TENANCY_MIGRATION_SQL_BATCH_SIZE=10,
+        MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.create_model_many_to_many'},
+    )
+    def test_reuse_sql(self):
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            self.assertTenantTableExists(tenant, 'tests_source')
+            self.assertTenantTableExists(tenant, 'tests_source_targets')
+            constraints = self.get_tenant_table_constraints(tenant, 'tests_source_targets')
+            self.assertTrue(self.get_column_constraints(constraints, 'target_id'))
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            self.assertTenantTableDoesntExists(tenant, 'tests_source_targets')
+
+    def test_chunk_size_deconstruct(self):
+        operation = AddField('model', 'field', None, chunk_size=10)
+        self.assertEqual(operation.chunk_size, 10)
+        self.assertEqual(operation.deconstruct()[2]['chunk_size'], 10)
+        self.assertNotIn('chunk_size', AddField('model', 'field', None).deconstruct()[2])
+
+    @unittest.skipIf(django.VERSION < (1, 10), 'Requires non-atomic migrations.')
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.chunked'})
+    def test_chunk_size(self):
+        run_python = import_module('tests.test_operations_migrations.chunked.0002_run_python')
+
+        def count(tenant):
+            table_name = connection.ops.quote_name(self.get_tenant_table_name(tenant, 'tests_chunked'))
+            with self.tenant_connection_context(tenant) as cursor:
+                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                return cursor.fetchone()[0]
+        run_python.failing.add('other_tenant')
+        try:
+            with self.assertRaises(ValueError):
+                call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        finally:
+            run_python.failing.clear()
+        # Both tenants are part of the same chunk.
+        for tenant in Tenant.objects.all():
+            self.assertEqual(count(tenant), 0)
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            self.assertEqual(count(tenant), 1)
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
+    @unittest.skipIf(django.VERSION < (1, 10), 'Requires non-atomic migrations.')
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.online_field'})
+    def test_online_field(self):
+        call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            table_name = connection.ops.quote_name(self.get_tenant_table_name(tenant, 'tests_onlinefield'))
+            with self.tenant_connection_context(tenant) as cursor:
+                for altered in (None, 1, None):
+                    cursor.execute("INSERT INTO %s (altered) VALUES (%%s)" % table_name, [altered])
+        # Record whether or not a transaction is open between batches.
+        online_operations = online_field.Migration.operations
+        in_atomic_block = []
+        sleep = operations.time.sleep
+        operations.time.sleep = lambda seconds: in_atomic_block.append(connection.in_atomic_block)
+        for operation in online_operations:
+            operation.throttle = 1
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        finally:
+            operations.time.sleep = sleep
+            for operation in online_operations:
+                operation.throttle = 0
+        # Columns are backfilled in batches of two rows committed on their own.
+        updates = [
+            query for query in queries if query['sql'].startswith('UPDATE') and ' IN (' in query['sql']
+        ]
+        self.assertEqual(len(updates), 6)
+        self.assertEqual(in_atomic_block, [False, False])
+        for tenant in Tenant.objects.all():
+            table_name = connection.ops.quote_name(self.get_tenant_table_name(tenant, 'tests_onlinefield'))
+            with self.tenant_connection_context(tenant) as cursor:
+                cursor.execute("SELECT added, altered FROM %s ORDER BY id" % table_name)
+                self.assertEqual(cursor.fetchall(), [(42, 7), (42, 1), (42, 7)])
+            columns = {column[0]: column for column in self.get_tenant_table_columns(tenant, 'tests_onlinefield')}
+            self.assertFalse(columns['added'][6])
+            self.assertFalse(columns['altered'][6])
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.online_field'})
+    def test_online_field_atomic(self):
+        call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
+        migration = online_field.Migration('0002_online_field', 'tests')
+        state = MigrationLoader(connection).project_state(('tests', '0001_create_model'))
+        with self.assertRaisesMessage(NotSupportedError, 'OnlineAddField cannot be executed inside a transaction'):
+            with connection.schema_editor() as schema_editor:
+                migration.apply(state, schema_editor)
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
+    def test_online_field_deconstruct(self):
+        operation = OnlineAddField('model', 'field', None, batch_size=10, throttle=0.5)
+        kwargs = operation.deconstruct()[2]
+        self.assertEqual(kwargs['batch_size'], 10)
+        self.assertEqual(kwargs['throttle'], 0.5)
+        kwargs = OnlineAlterField('model', 'field', None).deconstruct()[2]
+        self.assertNotIn('batch_size', kwargs)
+        self.assertNotIn('throttle', kwargs)
+
+    @unittest.skipIf(django.VERSION < (1, 11), 'Requires model indexes.')
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.add_index_concurrently'})
+    def test_add_index_concurrently(self):
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            constraints = self.get_tenant_table_constraints(tenant, 'tests_addindexconcurrently')
+            name_constraints = list(self.get_column_constraints(constraints, 'name').values())
+            self.assertEqual(len(name_constraints), 1)
+            self.assertTrue(name_constraints[0]['index'])
+        call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            constraints = self.get_tenant_table_constraints(tenant, 'tests_addindexconcurrently')
+            self.assertEqual(self.get_column_constraints(constraints, 'name'), {})
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
+    @unittest.skipIf(django.VERSION < (1, 11), 'Requires model indexes.')
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.add_index_concurrently'})
+    def test_add_index_concurrently_postgresql(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        created = [query['sql'] for query in queries if query['sql'].startswith('CREATE INDEX CONCURRENTLY')]
+        self.assertEqual(len(created), 2)
+        with connection.cursor() as cursor:
+            for tenant in Tenant.objects.all():
+                cursor.execute(
+                    "SELECT i.indisvalid FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "WHERE n.nspname = %s AND c.relname = %s",
+                    [tenant.db_schema, 'concurrent_name_idx']
+                )
+                self.assertEqual(cursor.fetchone(), (True,))
+        with CaptureQueriesContext(connection) as queries:
+            call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
+        dropped = [query['sql'] for query in queries if query['sql'].startswith('DROP INDEX CONCURRENTLY')]
+        self.assertEqual(len(dropped), 2)
+        for tenant in Tenant.objects.all():
+            constraints = self.get_tenant_table_constraints(tenant, 'tests_addindexconcurrently')
+            self.assertEqual(self.get_column_constraints(constraints, 'name'), {})
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
     @override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.delete_model'})
     def test_delete_model(self):
         call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
@@ -503,19 +679,19 @@ class TestTenantSchemaOperations(TenancyTestCase):
         for tenant in Tenant.objects.all():
             table_name = self.get_tenant_table_name(tenant, 'tests_runpython')
             with self.tenant_connection_context(tenant) as cursor:
-                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table_name))
                 self.assertEqual(cursor.fetchone(), (0,))
         call_command('migrate', 'tests', '0002', interactive=False, stdout=StringIO())
         for tenant in Tenant.objects.all():
             table_name = self.get_tenant_table_name(tenant, 'tests_runpython')
             with self.tenant_connection_context(tenant) as cursor:
-                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table_name))
                 self.assertEqual(cursor.fetchone(), (1,))
         call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
         for tenant in Tenant.objects.all():
             table_name = self.get_tenant_table_name(tenant, 'tests_runpython')
             with self.tenant_connection_context(tenant) as cursor:
-                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table_name))
                 self.assertEqual(cursor.fetchone(), (0,))
 
     @unittest.skipIf(connection.vendor == 'sqlite', 'Cannot use RunSQL on SQLite.')
@@ -525,17 +701,37 @@ class TestTenantSchemaOperations(TenancyTestCase):
         for tenant in Tenant.objects.all():
             table_name = self.get_tenant_table_name(tenant, 'tests_runsql')
             with self.tenant_connection_context(tenant) as cursor:
-                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table_name))
                 self.assertEqual(cursor.fetchone(), (0,))
         call_command('migrate', 'tests', '0002', interactive=False, stdout=StringIO())
         for tenant in Tenant.objects.all():
             table_name = self.get_tenant_table_name(tenant, 'tests_runsql')
             with self.tenant_connection_context(tenant) as cursor:
-                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table_name))
                 self.assertEqual(cursor.fetchone(), (1,))
         call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
         for tenant in Tenant.objects.all():
             table_name = self.get_tenant_table_name(tenant, 'tests_runsql')
             with self.tenant_connection_context(tenant) as cursor:
-                cursor.execute("SELECT COUNT(*) FROM %s" % table_name)
+                cursor.execute("SELECT COUNT(*) FROM %s" % connection.ops.quote_name(table_name))
                 self.assertEqual(cursor.fetchone(), (0,))
+
+
+class ConstraintsCatalogTest(TenancyTestCase):
+    def test_invalidate(self):
+        catalog = ConstraintsCatalog([self.tenant.db_schema])
+        catalog.invalidate(self.tenant.db_schema)
+        # Invalidated schemas are not queried.
+        self.assertIsNone(catalog.get_constraints(None, self.tenant.db_schema, 'tests_specificmodel'))
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL.')
+    def test_get_constraints(self):
+        catalog = ConstraintsCatalog(tenant.db_schema for tenant in Tenant.objects.all())
+        with connection.cursor() as cursor:
+            for tenant in Tenant.objects.all():
+                for model in tenant.models:
+                    db_table = model._meta.db_table.split('"."')[-1]
+                    self.assertEqual(
+                        catalog.get_constraints(cursor, tenant.db_schema, db_table),
+                        SchemaConstraints(tenant.db_schema)(cursor, db_table),
+                    )
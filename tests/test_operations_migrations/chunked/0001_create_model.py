@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from tenancy.models import Managed
+from tenancy.operations import CreateModel
+
+
+class Migration(migrations.Migration):
+
+    operations = [
+        CreateModel(
+            name='Chunked',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+            ],
+            bases=(models.Model,),
+            options={
+                'managed': Managed('tenancy.Tenant'),
+            }
+        ),
+    ]
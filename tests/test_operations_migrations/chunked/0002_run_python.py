@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from tenancy.models import Tenant
+from tenancy.operations import RunPython
+
+failing = set()
+
+
+def forward(apps, schema_editor):
+    apps.get_model('tests', 'Chunked').objects.create()
+    if schema_editor.tenant.name in failing:
+        raise ValueError(schema_editor.tenant.name)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('tests', '0001_create_model'),
+    ]
+
+    operations = [
+        RunPython(Tenant, forward, migrations.RunPython.noop, atomic=False, chunk_size=2),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from tenancy.models import Managed
+from tenancy.operations import CreateModel
+
+
+class Migration(migrations.Migration):
+
+    operations = [
+        CreateModel(
+            name='Target',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+            ],
+            bases=(models.Model,),
+            options={
+                'managed': Managed('tenancy.Tenant'),
+            }
+        ),
+        CreateModel(
+            name='Source',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('targets', models.ManyToManyField(to='tests.Target')),
+            ],
+            bases=(models.Model,),
+            options={
+                'managed': Managed('tenancy.Tenant'),
+            }
+        ),
+    ]
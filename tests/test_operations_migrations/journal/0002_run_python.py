@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from tenancy.models import Tenant
+from tenancy.operations import RunPython
+
+calls = []
+failing = set()
+
+
+def forward(apps, schema_editor):
+    name = schema_editor.tenant.name
+    calls.append(name)
+    if name in failing:
+        raise ValueError(name)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('tests', '0001_create_model'),
+    ]
+
+    operations = [
+        RunPython(Tenant, forward, migrations.RunPython.noop, atomic=False),
+    ]
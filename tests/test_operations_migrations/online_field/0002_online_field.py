@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from tenancy.operations import OnlineAddField, OnlineAlterField
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('tests', '0001_create_model'),
+    ]
+
+    operations = [
+        OnlineAddField('OnlineField', 'added', models.IntegerField(default=42), batch_size=2),
+        OnlineAlterField('OnlineField', 'altered', models.IntegerField(default=7), batch_size=2),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from tenancy.operations import AddField
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('tests', '0001_create_model'),
+    ]
+
+    operations = [
+        AddField('Parallel', 'added', models.PositiveIntegerField(default=0)),
+    ]
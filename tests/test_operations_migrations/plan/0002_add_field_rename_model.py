@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from tenancy.operations import AddField, RenameModel
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0001_create_model'),
+    ]
+
+    operations = [
+        AddField('Planned', 'value', models.IntegerField(null=True)),
+        RenameModel('Planned', 'Replanned'),
+    ]
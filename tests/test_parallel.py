@@ -0,0 +1,197 @@
+from __future__ import unicode_literals
+
+import threading
+from unittest import skipUnless
+
+import django
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from tenancy import map_tenants
+from tenancy.models import Tenant
+from tenancy.operations import AddField, RunPython
+from tenancy.parallel import (
+    TenantExecutionError, TenantProcessError, run_for_tenants,
+)
+from tenancy.pool import _pools, get_pool
+from tenancy.throttling import TenantOverBudget
+
+from .utils import TenancyTestCase
+
+
+def global_tenant_name(tenant):
+    global_tenant = Tenant.get_global()
+    if global_tenant.name == 'broken':
+        raise ValueError('Broken')
+    return global_tenant.name
+
+
+def over_budget(tenant):
+    raise TenantOverBudget('Over budget', 1)
+
+
+def idle_pooled_connections(tenant):
+    return get_pool('parallel').get_metrics()['idle']
+
+
+class RunForTenantsTest(TenancyTestCase):
+    def test_serial(self):
+        threads = []
+        run_for_tenants(Tenant.objects.all(), lambda tenant: threads.append(threading.current_thread()))
+        self.assertEqual(len(threads), 2)
+        # No threads are spawned for a single tenant.
+        run_for_tenants([self.tenant], lambda tenant: threads.append(threading.current_thread()), 4)
+        self.assertEqual(set(threads), {threading.current_thread()})
+
+    def test_serial_error(self):
+        def fail(tenant):
+            raise ValueError(tenant.name)
+        with self.assertRaises(ValueError):
+            run_for_tenants([self.tenant, self.other_tenant], fail)
+
+    def test_threaded(self):
+        processed = {}
+
+        def process(tenant):
+            processed[tenant.name] = threading.current_thread()
+        run_for_tenants([self.tenant, self.other_tenant], process, 2)
+        self.assertEqual(set(processed), {'tenant', 'other_tenant'})
+        self.assertNotIn(threading.current_thread(), processed.values())
+
+    def test_threaded_errors(self):
+        processed = []
+
+        def process(tenant):
+            if tenant.name == 'tenant':
+                raise ValueError('Broken')
+            processed.append(tenant.name)
+        with self.assertRaises(TenantExecutionError) as context:
+            run_for_tenants([self.tenant, self.other_tenant], process, 2)
+        # Failures don't prevent other tenants from being processed.
+        self.assertEqual(processed, ['other_tenant'])
+        (tenant, error), = context.exception.errors
+        self.assertEqual(tenant, self.tenant)
+        self.assertIsInstance(error, ValueError)
+        self.assertIn("('tenant',): Broken", str(context.exception))
+
+
+class MapTenantsTest(TenancyTestCase):
+    def test_serial(self):
+        self.assertEqual(map_tenants(global_tenant_name, [self.tenant, self.other_tenant]), ['tenant', 'other_tenant'])
+
+    def test_threaded(self):
+        tenants = [Tenant(name=str(index)) for index in range(10)]
+        self.assertEqual(map_tenants(global_tenant_name, tenants, workers=4), [str(index) for index in range(10)])
+
+    def test_processes(self):
+        tenants = [self.tenant, self.other_tenant]
+        self.assertEqual(
+            map_tenants(global_tenant_name, tenants, workers=2, mode='process'), ['tenant', 'other_tenant']
+        )
+
+    def test_processes_pool(self):
+        pool = get_pool('parallel')
+        connection = object()
+        pool.release(connection, self.tenant.db_schema)
+        try:
+            # Idle connections of the parent's pools are not handed to processes.
+            self.assertEqual(
+                map_tenants(idle_pooled_connections, [self.tenant, self.other_tenant], workers=2, mode='process'),
+                [0, 0]
+            )
+            self.assertEqual(pool.acquire(self.tenant.db_schema), (connection, self.tenant.db_schema))
+        finally:
+            del _pools['parallel']
+
+    def test_errors(self):
+        broken = Tenant(name='broken')
+        for workers, mode in ((1, 'thread'), (2, 'thread'), (2, 'process')):
+            with self.assertRaises(TenantExecutionError) as context:
+                map_tenants(global_tenant_name, [broken, self.tenant], workers=workers, mode=mode)
+            (tenant, error), = context.exception.errors
+            self.assertEqual(tenant.name, 'broken')
+            if mode == 'process':
+                self.assertIsInstance(error, TenantProcessError)
+                self.assertTrue(error.class_path.endswith('.ValueError'))
+                self.assertEqual(str(error), "%s: Broken" % error.class_path)
+                self.assertIn("raise ValueError('Broken')", error.traceback)
+            else:
+                self.assertIsInstance(error, ValueError)
+            self.assertEqual(context.exception.results, [None, 'tenant'])
+
+    def test_unpicklable_process_errors(self):
+        # TenantOverBudget requires a `retry_after` argument.
+        with self.assertRaises(TenantExecutionError) as context:
+            map_tenants(over_budget, [self.tenant, self.other_tenant], workers=2, mode='process')
+        self.assertEqual(
+            [error.class_path for _tenant, error in context.exception.errors],
+            ['tenancy.throttling.TenantOverBudget'] * 2
+        )
+
+    def test_progress(self):
+        progress = []
+
+        def report(tenant, error, done, total):
+            progress.append((tenant.name, error, done, total))
+        map_tenants(global_tenant_name, [self.tenant, self.other_tenant], progress=report)
+        self.assertEqual(progress, [('tenant', None, 1, 2), ('other_tenant', None, 2, 2)])
+
+    def test_invalid_mode(self):
+        with self.assertRaisesMessage(ValueError, "Invalid mode 'fork'"):
+            map_tenants(global_tenant_name, [self.tenant], mode='fork')
+
+
+class MigrationConcurrencyTest(TenancyTestCase):
+    def tearDown(self):
+        super(MigrationConcurrencyTest, self).tearDown()
+        MigrationRecorder(connection).flush()
+
+    def get_concurrency(self, **kwargs):
+        operation = AddField('model', 'field', None)
+        with connection.schema_editor(**kwargs) as schema_editor:
+            return operation.get_concurrency(schema_editor)
+
+    @override_settings(TENANCY_MIGRATION_CONCURRENCY=4)
+    def test_atomic(self):
+        self.assertEqual(self.get_concurrency(), 1)
+
+    @override_settings(TENANCY_MIGRATION_CONCURRENCY=4)
+    def test_collect_sql(self):
+        self.assertEqual(self.get_concurrency(collect_sql=True), 1)
+
+    @skipUnless(
+        connection.vendor == 'postgresql' and django.VERSION >= (1, 10),
+        'Requires PostgreSQL and non-atomic migrations.'
+    )
+    @override_settings(TENANCY_MIGRATION_CONCURRENCY=4)
+    def test_non_atomic(self):
+        self.assertEqual(self.get_concurrency(atomic=False), 4)
+
+    @skipUnless(
+        connection.vendor == 'postgresql' and django.VERSION >= (1, 10),
+        'Requires PostgreSQL and non-atomic migrations.'
+    )
+    @override_settings(
+        TENANCY_MIGRATION_CONCURRENCY=4,
+        MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.parallel_add_field'},
+    )
+    def test_migrate(self):
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        for tenant in Tenant.objects.all():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = %s AND table_name = %s", [tenant.db_schema, 'tests_parallel']
+                )
+                self.assertIn(('added',), cursor.fetchall())
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+
+    def test_run_python_concurrency(self):
+        operation = RunPython(Tenant, lambda apps, schema_editor: None, concurrency=8)
+        self.assertEqual(operation.deconstruct()[2]['concurrency'], 8)
+        with connection.schema_editor() as schema_editor:
+            # Concurrency is still only allowed outside of transactions.
+            self.assertEqual(operation.get_concurrency(schema_editor), 1)
@@ -0,0 +1,92 @@
+from __future__ import unicode_literals
+
+from django.test import SimpleTestCase
+
+from tenancy.pool import ConnectionPool
+
+
+class FakeConnection(object):
+    def __init__(self, name):
+        self.name = name
+        self.resets = 0
+        self.checks = 0
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def reset(connection):
+    connection.resets += 1
+
+
+def check(connection):
+    connection.checks += 1
+    if connection.name == 'broken':
+        raise ValueError
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(size=2, reset=reset, check=check)
+
+    def test_acquire_empty(self):
+        self.assertIsNone(self.pool.acquire('tenant'))
+        self.assertEqual(self.pool.get_metrics()['misses'], 1)
+
+    def test_acquire_pinned(self):
+        first, second = FakeConnection('first'), FakeConnection('second')
+        self.pool.release(first, 'tenant')
+        self.pool.release(second, 'other_tenant')
+        self.assertEqual(self.pool.get_metrics()['pinned'], 2)
+        self.assertEqual(self.pool.acquire('tenant'), (first, 'tenant'))
+        self.assertEqual((first.resets, first.checks), (0, 1))
+        self.assertEqual(self.pool.get_metrics()['hits'], 1)
+
+    def test_acquire_reset(self):
+        first, second = FakeConnection('first'), FakeConnection('second')
+        self.pool.release(first, 'tenant')
+        self.pool.release(second, None)
+        # The least recently released connection is reset.
+        self.assertEqual(self.pool.acquire('other_tenant'), (first, None))
+        self.assertEqual(first.resets, 1)
+        self.assertEqual(self.pool.acquire(), (second, None))
+        self.assertEqual(second.resets, 1)
+        self.assertEqual(self.pool.get_metrics()['resets'], 2)
+
+    def test_reset_failure(self):
+        def failing_reset(connection):
+            if connection.name == 'broken':
+                raise ValueError
+        pool = ConnectionPool(reset=failing_reset)
+        broken, working = FakeConnection('broken'), FakeConnection('working')
+        pool.release(broken)
+        pool.release(working)
+        self.assertEqual(pool.acquire(), (working, None))
+        self.assertTrue(broken.closed)
+        self.assertEqual(pool.get_metrics()['discarded'], 1)
+
+    def test_check_failure(self):
+        broken, working = FakeConnection('broken'), FakeConnection('working')
+        self.pool.release(working, 'tenant')
+        self.pool.release(broken, 'tenant')
+        # The most recently released pinned connection fails to be checked.
+        self.assertEqual(self.pool.acquire('tenant'), (working, 'tenant'))
+        self.assertTrue(broken.closed)
+        self.assertEqual(self.pool.get_metrics()['discarded'], 1)
+
+    def test_release_size(self):
+        connections = [FakeConnection(name) for name in ('first', 'second', 'third')]
+        for connection in connections:
+            self.pool.release(connection, connection.name)
+        self.assertTrue(connections[0].closed)
+        metrics = self.pool.get_metrics()
+        self.assertEqual(metrics['idle'], 2)
+        self.assertEqual(metrics['discarded'], 1)
+
+    def test_clear(self):
+        connection = FakeConnection('first')
+        self.pool.release(connection, 'tenant')
+        self.pool.clear()
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.pool.get_metrics()['idle'], 0)
@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from tenancy.models import Tenant
+from tenancy.query import union_all
+
+from .utils import TenancyTestCase
+
+
+class UnionAllTest(TenancyTestCase):
+    def setUp(self):
+        super(UnionAllTest, self).setUp()
+        self.tenant.specificmodels.create(date=datetime.date(2000, 1, 1))
+        self.tenant.specificmodels.create(date=datetime.date(2000, 1, 1))
+        self.other_tenant.specificmodels.create(date=datetime.date(2000, 1, 2))
+
+    def count_by_tenant(self, tenant):
+        return tenant.specificmodels.values('date').annotate(count=Count('id'))
+
+    def test_union_all(self):
+        tenants = list(Tenant.objects.order_by('name'))
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(union_all(tenants, self.count_by_tenant))
+        self.assertEqual(len(queries), 1)
+        self.assertIn('UNION ALL', queries[0]['sql'])
+        self.assertEqual(sorted((natural_key, row['count']) for natural_key, row in rows), [
+            (('other_tenant',), 1), (('tenant',), 2),
+        ])
+
+    def test_chunk_size(self):
+        tenants = list(Tenant.objects.order_by('name'))
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(union_all(tenants, self.count_by_tenant, chunk_size=1))
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            [natural_key for natural_key, _row in rows], [('other_tenant',), ('tenant',)]
+        )
+
+    def test_params(self):
+        rows = list(union_all(Tenant.objects.all(), lambda tenant: tenant.specificmodels.filter(
+            date=datetime.date(2000, 1, 2)
+        ).values('id')))
+        self.assertEqual(
+            [(natural_key, row['id']) for natural_key, row in rows],
+            [(('other_tenant',), self.other_tenant.specificmodels.get().pk)]
+        )
+
+    def test_empty(self):
+        tenants = list(Tenant.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(union_all(tenants, lambda tenant: tenant.specificmodels.filter(pk__in=[])))
+        self.assertEqual(rows, [])
+        self.assertEqual(len(queries), 0)
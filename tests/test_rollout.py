@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+from importlib import import_module
+from unittest import skipUnless
+
+import django
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from tenancy.journal import MigrationJournal
+from tenancy.models import Tenant, db_schema_table
+from tenancy.rollout import TenantSelector
+
+from .utils import TenancyTestCase
+
+run_python = import_module('tests.test_operations_migrations.journal.0002_run_python')
+
+
+class TenantSelectorTest(TenancyTestCase):
+    def select(self, selector):
+        return selector.select(Tenant.objects.all(), list(Tenant.objects.all()))
+
+    def test_natural_keys(self):
+        self.assertEqual(self.select(TenantSelector(natural_keys=[['tenant']])), [self.tenant])
+
+    def test_filters(self):
+        self.assertEqual(self.select(TenantSelector(filters={'name__startswith': 'other'})), [self.other_tenant])
+
+    def test_shard(self):
+        shards = [self.select(TenantSelector(shard=(index, 2))) for index in range(2)]
+        self.assertEqual(sorted(shards[0] + shards[1], key=lambda tenant: tenant.pk), [self.tenant, self.other_tenant])
+
+    def test_combined(self):
+        selector = TenantSelector(natural_keys=[['tenant']], filters={'name__startswith': 'other'})
+        self.assertEqual(self.select(selector), [])
+
+    def test_invalid_options(self):
+        with self.assertRaisesMessage(CommandError, "Invalid shard '4/4'"):
+            call_command('tenantmigrate', shard='4/4', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "Invalid tenant filter 'name'"):
+            call_command('tenantmigrate', tenant_filters=['name'], stdout=StringIO())
+
+
+@skipUnless(django.VERSION >= (1, 10), 'Requires non-atomic migrations.')
+@override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.journal'})
+class StagedRolloutTest(TenancyTestCase):
+    def tearDown(self):
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        MigrationRecorder(connection).flush()
+        MigrationJournal(connection).entries.all().delete()
+        super(StagedRolloutTest, self).tearDown()
+        del run_python.calls[:]
+
+    def assertTableExists(self, tenant, exists=True):
+        table_name = 'tests_journal'
+        if connection.vendor != 'postgresql':
+            table_name = db_schema_table(tenant, table_name)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SET search_path = %s" % tenant.db_schema)
+            table_names = connection.introspection.table_names(cursor)
+            if connection.vendor == 'postgresql':
+                cursor.execute('RESET search_path')
+        self.assertEqual(table_name in table_names, exists)
+
+    def test_rollout(self):
+        call_command('tenantmigrate', 'tests', tenants=[['tenant']], interactive=False, stdout=StringIO())
+        self.assertEqual(run_python.calls, ['tenant'])
+        self.assertTableExists(self.tenant)
+        self.assertTableExists(self.other_tenant, False)
+        journal = MigrationJournal(connection)
+        self.assertEqual(
+            set(journal.entries.filter(tenant=self.other_tenant.db_schema).values_list('name', 'status')), {
+                ('0001_create_model', MigrationJournal.SKIPPED),
+                ('0002_run_python', MigrationJournal.SKIPPED),
+            }
+        )
+        # Selecting tenants that weren't skipped doesn't resume anything.
+        stdout = StringIO()
+        call_command('tenantmigrate', resume=True, tenants=[['tenant']], stdout=stdout)
+        self.assertEqual(run_python.calls, ['tenant'])
+        stdout = StringIO()
+        call_command('tenantmigrate', resume=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Resumed tests.0001_create_model\nResumed tests.0002_run_python\n')
+        self.assertEqual(run_python.calls, ['tenant', 'other_tenant'])
+        self.assertTableExists(self.other_tenant)
+        self.assertFalse(journal.entries.filter(status=MigrationJournal.SKIPPED).exists())
+        stdout = StringIO()
+        call_command('tenantmigrate', resume=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'No tenant migrations to resume.\n')
+
+    def test_lagging_tenants(self):
+        call_command(
+            'tenantmigrate', 'tests', '0001', tenants=[['tenant']], interactive=False, stdout=StringIO()
+        )
+        self.assertTableExists(self.other_tenant, False)
+        # Tenants left out of the canary migration are skipped by the next ones.
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        self.assertEqual(run_python.calls, ['tenant'])
+        journal = MigrationJournal(connection)
+        self.assertEqual(
+            journal.entries.get(tenant=self.other_tenant.db_schema, name='0002_run_python').status,
+            MigrationJournal.SKIPPED
+        )
+        stdout = StringIO()
+        call_command('tenantmigrate', resume=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Resumed tests.0001_create_model\nResumed tests.0002_run_python\n')
+        self.assertEqual(run_python.calls, ['tenant', 'other_tenant'])
+        self.assertTableExists(self.other_tenant)
@@ -0,0 +1,103 @@
+from __future__ import unicode_literals
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from tenancy.throttling import (
+    QueryBudget, TenantOverBudget, TenantUsage, TenantUsageTracker,
+    get_usage_tracker,
+)
+
+from .client import TenantClient
+from .models import SpecificModel
+from .utils import MIDDLEWARE_SETTING, TenancyTestCase
+
+
+class TenantUsageTrackerTest(SimpleTestCase):
+    def setUp(self):
+        self.tracker = TenantUsageTracker()
+
+    def test_concurrent_queries(self):
+        budget = QueryBudget(concurrent_queries=1)
+        self.tracker.acquire('tenant', budget)
+        with self.assertRaisesMessage(TenantOverBudget, '1 concurrent queries are already executing.'):
+            self.tracker.acquire('tenant', budget)
+        # Other tenants are not affected.
+        self.tracker.acquire('other_tenant', budget)
+        self.tracker.release('tenant', budget, 0.1)
+        self.tracker.acquire('tenant', budget)
+        self.assertEqual(self.tracker.get_usage('tenant'), (0.0, 1))
+
+    def test_db_time(self):
+        budget = QueryBudget(db_time=1, window=60)
+        self.tracker.acquire('tenant', budget)
+        self.tracker.release('tenant', budget, 1.5)
+        self.assertEqual(self.tracker.get_usage('tenant'), (1.5, 0))
+        with self.assertRaises(TenantOverBudget) as context:
+            self.tracker.admit('tenant', budget)
+        self.assertGreater(context.exception.retry_after, 59)
+        self.tracker.admit('other_tenant', budget)
+
+    def test_wait(self):
+        budget = QueryBudget(db_time=1, window=0.1, wait=1)
+        self.tracker.acquire('tenant', budget)
+        self.tracker.release('tenant', budget, 1)
+        # The query expires from the window while waiting.
+        self.tracker.admit('tenant', budget)
+        self.assertEqual(self.tracker.get_usage('tenant'), (0.0, 0))
+
+    def test_expire(self):
+        usage = TenantUsage()
+        usage.queries.extend([(10, 1.0), (20, 2.0)])
+        usage.db_time = 3.0
+        usage.expire(25, 10)
+        self.assertEqual(list(usage.queries), [(20, 2.0)])
+        self.assertEqual(usage.db_time, 2.0)
+
+
+class ThrottlingTest(TenancyTestCase):
+    def tearDown(self):
+        get_usage_tracker().reset()
+        super(ThrottlingTest, self).tearDown()
+
+    def test_get_query_budget(self):
+        self.assertIsNone(self.tenant.get_query_budget())
+        with self.settings(TENANCY_QUERY_BUDGET={'db_time': 5, 'window': 10}):
+            budget = self.tenant.get_query_budget()
+        self.assertEqual((budget.db_time, budget.window, budget.concurrent_queries), (5, 10, None))
+
+    @override_settings(TENANCY_QUERY_BUDGET={'db_time': 60})
+    def test_queries_accounted(self):
+        with self.tenant.as_global():
+            SpecificModel.for_tenant(self.tenant).objects.count()
+        db_time, concurrent_queries = get_usage_tracker().get_usage(self.tenant.db_schema)
+        self.assertGreater(db_time, 0)
+        self.assertEqual(concurrent_queries, 0)
+
+    @override_settings(TENANCY_QUERY_BUDGET={'db_time': 0})
+    def test_queries_over_budget(self):
+        with self.tenant.as_global():
+            with self.assertRaises(TenantOverBudget):
+                SpecificModel.for_tenant(self.tenant).objects.count()
+        # Queries executed outside of the tenant context are not throttled.
+        SpecificModel.for_tenant(self.tenant).objects.count()
+
+    @override_settings(
+        ROOT_URLCONF='tests.urls',
+        TENANCY_QUERY_BUDGET={'db_time': 1, 'window': 30},
+        **{MIDDLEWARE_SETTING: [
+            'tenancy.middleware.TenantThrottlingMiddleware',
+            'tenancy.middleware.GlobalTenantMiddleware',
+        ]}
+    )
+    def test_middleware(self):
+        client = TenantClient(self.tenant)
+        self.assertEqual(client.get('/global').status_code, 200)
+        budget = self.tenant.get_query_budget()
+        tracker = get_usage_tracker()
+        tracker.acquire(self.tenant.db_schema, budget)
+        tracker.release(self.tenant.db_schema, budget, 1)
+        response = client.get('/global')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(TenantClient(self.other_tenant).get('/global').status_code, 200)
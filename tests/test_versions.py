@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+from importlib import import_module
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from tenancy.models import Tenant
+from tenancy.versions import TenantSchemaVersions
+
+from .utils import TenancyTestCase
+
+run_python = import_module('tests.test_operations_migrations.journal.0002_run_python')
+
+
+@override_settings(MIGRATION_MODULES={'tests': 'tests.test_operations_migrations.journal'})
+class TenantSchemaVersionsTest(TenancyTestCase):
+    def setUp(self):
+        super(TenantSchemaVersionsTest, self).setUp()
+        self.versions = TenantSchemaVersions(connection)
+
+    def tearDown(self):
+        call_command('migrate', 'tests', 'zero', interactive=False, stdout=StringIO())
+        MigrationRecorder(connection).flush()
+        super(TenantSchemaVersionsTest, self).tearDown()
+        del run_python.calls[:]
+
+    def get_versions(self, tenant):
+        return set(self.versions.versions.filter(tenant=tenant.db_schema).values_list('app', 'name'))
+
+    @override_settings(TENANCY_SCHEMA_VERSIONS=True)
+    def test_record(self):
+        tenant = Tenant.objects.create(name='current')
+        self.assertIn(('tests', '0002_run_python'), self.get_versions(tenant))
+        graph = MigrationLoader(None, ignore_no_migrations=True).graph
+        current = self.versions.get_current_tenants(graph, ('tests', '0001_create_model'))
+        self.assertIn(tenant.db_schema, current)
+        self.assertNotIn(self.tenant.db_schema, current)
+        tenant.delete()
+        self.assertEqual(self.get_versions(tenant), set())
+
+    def test_disabled(self):
+        tenant = Tenant.objects.create(name='current')
+        self.assertFalse(self.versions.has_table() and self.get_versions(tenant))
+        tenant.delete()
+
+    @override_settings(TENANCY_SCHEMA_VERSIONS=True)
+    def test_skip_current_tenants(self):
+        tenant = Tenant.objects.create(name='current')
+        call_command('migrate', 'tests', interactive=False, stdout=StringIO())
+        # The schema of the tenant created after the migrations were written
+        # is already up to date.
+        self.assertEqual(sorted(run_python.calls), ['other_tenant', 'tenant'])
+        # Unapplying a migration forgets about the recorded versions.
+        call_command('migrate', 'tests', '0001', interactive=False, stdout=StringIO())
+        self.assertEqual(self.get_versions(tenant), set())
+        Tenant.objects.get(pk=tenant.pk).delete()
@@ -12,7 +12,7 @@ from django.test.signals import setting_changed
 from django.test.testcases import TransactionTestCase
 from django.utils.six.moves import input
 
-from tenancy import settings
+from tenancy import settings, versions
 from tenancy.management.commands import createtenant
 from tenancy.models import Tenant
 
@@ -55,6 +55,12 @@ def reload_settings_module(signal, sender, setting, value, **kwargs):
             logger.debug("Successfully reloaded the settings module.")
 
 
+@receiver(setting_changed)
+def clear_migration_loader(signal, sender, setting, value, **kwargs):
+    if setting == 'MIGRATION_MODULES':
+        versions.clear_migration_loader()
+
+
 class Replier(object):
     def __init__(self, replies):
         self.replies = OrderedDict(replies)